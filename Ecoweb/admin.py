@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Item, OrderItem, Order
+from .models import Item, OrderItem, Order, Notification
 
 
 class itemAdmin(admin.ModelAdmin):
@@ -9,3 +9,11 @@ class itemAdmin(admin.ModelAdmin):
 admin.site.register(Item, itemAdmin)
 admin.site.register(OrderItem)
 admin.site.register(Order)
+
+
+class NotificationAdmin(admin.ModelAdmin):
+    list_display = ["template", "channel", "recipient", "status", "attempts", "created_at", "sent_at"]
+    list_filter = ["status", "channel", "template"]
+
+
+admin.site.register(Notification, NotificationAdmin)
@@ -3,13 +3,15 @@ from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
+from django.utils import timezone
 from django.views import View
 from .models import Order, MpesaTransaction
-from .mpesa_service import MpesaService
+from .mpesa_service import STK_QUERY_RESULT_STATUS, MpesaService
+from .fulfilment import fulfil_order
+from .notifications import enqueue, enqueue_order_confirmation
+from .phone import normalize_phone_or_none
+from . import stk_latency
 import json
-import re
-import requests
-from django.conf import settings
 
 class PhoneConfirmationAPI(View):
     """API for phone number confirmation and messaging"""
@@ -27,12 +29,12 @@ class PhoneConfirmationAPI(View):
                 return JsonResponse({'error': 'Phone number required'}, status=400)
             
             # Validate and format phone number
-            formatted_phone = self.format_phone_number(phone)
+            formatted_phone = normalize_phone_or_none(phone)
             if not formatted_phone:
                 return JsonResponse({'error': 'Invalid phone number format'}, status=400)
             
             # Send confirmation message
-            message_sent = self.send_confirmation_sms(formatted_phone)
+            message_sent = self.send_confirmation_sms(formatted_phone, self.open_order(request))
             
             return JsonResponse({
                 'success': True,
@@ -46,21 +48,18 @@ class PhoneConfirmationAPI(View):
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
     
-    def format_phone_number(self, phone):
-        """Format and validate Kenyan phone number"""
-        phone = re.sub(r'\D', '', phone)
-        
-        if phone.startswith('0') and len(phone) == 10:
-            return '254' + phone[1:]
-        elif phone.startswith('254') and len(phone) == 12:
-            return phone
-        elif (phone.startswith('7') or phone.startswith('1')) and len(phone) == 9:
-            return '254' + phone
-        
+    @staticmethod
+    def open_order(request):
+        if request.user.is_authenticated:
+            return Order.objects.filter(user=request.user, ordered=False).order_by('pk').first()
         return None
     
-    def send_confirmation_sms(self, phone):
-        """Send SMS confirmation message"""
+    def send_confirmation_sms(self, phone, order=None):
+        """Queue the SMS confirmation message; returns whether a new one was queued.
+        
+        Sent once per order and phone number; without an order, once a day
+        per phone number, as this endpoint is open to anonymous clients.
+        """
         try:
             message = (
                 "Thank you for confirming your phone number with our store! "
@@ -68,43 +67,15 @@ class PhoneConfirmationAPI(View):
                 "For support, contact us at support@yourstore.com"
             )
             
-            # Use Africa's Talking or any SMS service
-            return self.send_sms_via_africas_talking(phone, message)
-            
-        except Exception as e:
-            print(f"SMS sending failed: {e}")
-            return False
-    
-    def send_sms_via_africas_talking(self, phone, message):
-        """Send SMS using Africa's Talking API"""
-        try:
-            # Replace with your Africa's Talking credentials
-            api_key = getattr(settings, 'AFRICAS_TALKING_API_KEY', '')
-            username = getattr(settings, 'AFRICAS_TALKING_USERNAME', '')
-            
-            if not api_key or not username:
-                return False
-            
-            url = "https://api.africastalking.com/version1/messaging"
-            
-            headers = {
-                'Accept': 'application/json',
-                'Content-Type': 'application/x-www-form-urlencoded',
-                'apiKey': api_key
-            }
-            
-            data = {
-                'username': username,
-                'to': phone,
-                'message': message,
-                'from': getattr(settings, 'SMS_SENDER_ID', 'YourStore')
-            }
-            
-            response = requests.post(url, headers=headers, data=data)
-            return response.status_code == 201
+            if order is not None:
+                dedup_key = f'order:{order.pk}:phone_confirmation:{phone}'
+            else:
+                dedup_key = f'phone:{phone}:phone_confirmation:{timezone.localdate().isoformat()}'
+            _, created = enqueue('phone_confirmation', 'sms', phone, message, order=order, dedup_key=dedup_key)
+            return created
             
         except Exception as e:
-            print(f"Africa's Talking SMS failed: {e}")
+            print(f"SMS queueing failed: {e}")
             return False
 
 
@@ -142,10 +113,7 @@ class PaymentStatusAPI(View):
                 'amount': str(mpesa_transaction.amount)
             }
             
-            # Send success message if payment completed
-            if mpesa_transaction.status == 'SUCCESS':
-                self.send_payment_success_message(mpesa_transaction)
-            
+            # The success SMS is queued once by the order_paid signal, not per poll
             return JsonResponse(response_data)
             
         except MpesaTransaction.DoesNotExist:
@@ -163,29 +131,17 @@ class PaymentStatusAPI(View):
             
             if status_response.get('ResponseCode') == '0':
                 result_code = status_response.get('ResultCode')
+                status = STK_QUERY_RESULT_STATUS.get(result_code)
                 
-                if result_code == '0':  # Success
-                    mpesa_transaction.status = 'SUCCESS'
-                    mpesa_transaction.save()
-                    
-                    # Update order
-                    order = mpesa_transaction.order
-                    order.payment_status = 'COMPLETED'
-                    order.ordered = True
-                    order.save()
+                if status:
+                    mpesa_transaction.status = status
+                    mpesa_transaction.result_code = result_code
+                    mpesa_transaction.save(update_fields=['status', 'result_code', 'updated_at'])
+                    stk_latency.settle(mpesa_transaction, stk_latency.VIA_POLL)
                     
-                    # Mark order items as ordered
-                    for item in order.items.all():
-                        item.ordered = True
-                        item.save()
-                        
-                elif result_code in ['1032', '1037']:  # Cancelled/Timeout
-                    mpesa_transaction.status = 'CANCELLED'
-                    mpesa_transaction.save()
-                    
-                elif result_code == '1':  # Failed
-                    mpesa_transaction.status = 'FAILED'
-                    mpesa_transaction.save()
+                    if status == 'SUCCESS':
+                        # Update order and mark its items as ordered
+                        fulfil_order(mpesa_transaction.order)
                     
         except Exception as e:
             print(f"Status update failed: {e}")
@@ -199,25 +155,6 @@ class PaymentStatusAPI(View):
             'PENDING': 'Waiting for payment confirmation. Please check your phone.'
         }
         return messages.get(status, 'Unknown payment status')
-    
-    def send_payment_success_message(self, mpesa_transaction):
-        """Send success SMS after payment completion"""
-        try:
-            order = mpesa_transaction.order
-            message = (
-                f"Payment successful! Your order #{order.id} for KES {mpesa_transaction.amount} "
-                f"has been confirmed. Receipt: {mpesa_transaction.mpesa_receipt_number}. "
-                f"Thank you for shopping with us!"
-            )
-            
-            phone_api = PhoneConfirmationAPI()
-            phone_api.send_sms_via_africas_talking(
-                mpesa_transaction.phone_number, 
-                message
-            )
-            
-        except Exception as e:
-            print(f"Success message failed: {e}")
 
 
 class PaymentSuccessMessageAPI(View):
@@ -239,83 +176,19 @@ class PaymentSuccessMessageAPI(View):
             if not order:
                 return JsonResponse({'error': 'No completed order found'}, status=404)
             
-            # Send success email and SMS
-            email_sent = self.send_success_email(order)
-            sms_sent = self.send_success_sms(order)
+            # Queue success email and SMS; the outbox worker delivers them
+            email_queued, sms_queued = enqueue_order_confirmation(order)
             
             return JsonResponse({
                 'success': True,
-                'email_sent': email_sent,
-                'sms_sent': sms_sent,
+                'email_sent': email_queued,
+                'sms_sent': sms_queued,
+                'queued': True,
                 'order_id': order.id
             })
             
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
-    
-    def send_success_email(self, order):
-        """Send order confirmation email"""
-        try:
-            from django.core.mail import send_mail
-            from django.template.loader import render_to_string
-            
-            subject = f'Order Confirmation #{order.id}'
-            
-            # Render email template
-            html_message = render_to_string('emails/order_confirmation.html', {
-                'order': order,
-                'customer_name': f"{order.first_name} {order.last_name}"
-            })
-            
-            plain_message = f"""
-            Dear {order.first_name},
-            
-            Thank you for your order! Your payment has been confirmed.
-            
-            Order Details:
-            Order Number: #{order.id}
-            Total Amount: KES {order.get_total()}
-            Payment Method: {order.payment_method}
-            
-            Your order is being processed and you will receive shipping updates soon.
-            
-            Thank you for shopping with us!
-            """
-            
-            send_mail(
-                subject,
-                plain_message,
-                settings.DEFAULT_FROM_EMAIL,
-                [order.email],
-                html_message=html_message,
-                fail_silently=False
-            )
-            
-            return True
-            
-        except Exception as e:
-            print(f"Email sending failed: {e}")
-            return False
-    
-    def send_success_sms(self, order):
-        """Send order confirmation SMS"""
-        try:
-            message = (
-                f"Order #{order.id} confirmed! "
-                f"Total: KES {order.get_total()}. "
-                f"We'll notify you when your order ships. "
-                f"Thank you for choosing us!"
-            )
-            
-            phone_api = PhoneConfirmationAPI()
-            return phone_api.send_sms_via_africas_talking(
-                order.customer_phone, 
-                message
-            )
-            
-        except Exception as e:
-            print(f"SMS sending failed: {e}")
-            return False
 
 
 # Function-based views for backward compatibility
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class EcowebConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'Ecoweb'
+
+    def ready(self):
+        # Connect the order_paid, Item change and database connection receivers
+        from . import fragment_cache, metrics, notifications, page_cache, slow_queries  # noqa: F401
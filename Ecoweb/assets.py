@@ -0,0 +1,239 @@
+"""
+Static asset bundles.
+
+Each page loads the ``base`` bundles plus at most one page bundle. The
+build_assets command concatenates and minifies every bundle into
+``static/dist/`` and subsets the icon fonts to the glyphs the templates and
+scripts actually use. collectstatic then hashes and gzip/Brotli-compresses
+the output like any other static file.
+
+With STATIC_BUNDLES off (DEBUG), the {% css_bundle %} and {% js_bundle %}
+tags emit the source files one by one instead, so no build is needed
+during development.
+"""
+
+import logging
+import posixpath
+import re
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DIST_DIR = 'dist'
+
+# Order matters: later stylesheets override earlier ones, and plugins must
+# load after jQuery
+CSS_BUNDLES = {
+    'base': [
+        'css/animate.css',
+        'css/icomoon.css',
+        'css/ionicons.min.css',
+        'css/bootstrap.min.css',
+        'css/magnific-popup.css',
+        'css/flexslider.css',
+        'css/owl.carousel.min.css',
+        'css/owl.theme.default.min.css',
+        'fonts/flaticon/font/flaticon.css',
+        'css/style.css',
+    ],
+}
+
+JS_BUNDLES = {
+    'base': [
+        'js/jquery.min.js',
+        'js/popper.min.js',
+        'js/bootstrap.min.js',
+        'js/jquery.easing.1.3.js',
+        'js/jquery.waypoints.min.js',
+        'js/owl.carousel.min.js',
+        'js/main.js',
+    ],
+    'home': [
+        'js/jquery.flexslider-min.js',
+    ],
+    'gallery': [
+        'js/jquery.magnific-popup.min.js',
+        'js/magnific-popup-options.js',
+    ],
+}
+
+# Icon fonts subset to the glyphs in use: font-family -> (source font, class prefix)
+ICON_FONTS = {
+    'icomoon': ('fonts/icomoon/icomoon.ttf', 'icon-'),
+    'Ionicons': ('fonts/ionicons/fonts/ionicons.ttf', 'ion-'),
+    'Flaticon': ('fonts/flaticon/font/Flaticon.ttf', 'flaticon-'),
+}
+
+URL_RE = re.compile(r'''url\(\s*(['"]?)(.*?)\1\s*\)''')
+FONT_FACE_RE = re.compile(r'@font-face\s*\{[^}]*\}', re.IGNORECASE)
+FONT_FAMILY_RE = re.compile(r'''font-family\s*:\s*['"]?([^'";}]+)''', re.IGNORECASE)
+RULE_RE = re.compile(r'([^{}@;]+)\{([^{}]*)\}')
+CONTENT_ESCAPE_RE = re.compile(r'''content\s*:\s*['"]\\([0-9a-fA-F]{2,6})['"]''')
+
+
+def bundle_name(kind, name):
+    """Static path of a built bundle"""
+    return f'{DIST_DIR}/{name}.{kind}'
+
+
+def bundle_sources(kind, name):
+    bundles = CSS_BUNDLES if kind == 'css' else JS_BUNDLES
+    return bundles[name]
+
+
+def static_root():
+    return Path(settings.STATICFILES_DIRS[0])
+
+
+def rebase_urls(css, source, target):
+    """Rewrite relative url()s in ``css`` from ``source``'s directory to ``target``'s"""
+    source_dir = posixpath.dirname(source)
+    target_dir = posixpath.dirname(target)
+
+    def rebase(match):
+        url = match.group(2)
+        if not url or url.startswith(('data:', 'http:', 'https:', '//', '/', '#')):
+            return match.group(0)
+        path, suffix = re.match(r'([^?#]*)(.*)', url).groups()
+        resolved = posixpath.normpath(posixpath.join(source_dir, path))
+        rebased = posixpath.relpath(resolved, target_dir)
+        return f'url("{rebased}{suffix}")'
+
+    return URL_RE.sub(rebase, css)
+
+
+def used_icon_classes(prefixes, search_dirs):
+    """Icon classes referenced from templates and scripts"""
+    pattern = re.compile(r'(?<![\w-])((?:%s)[a-z0-9-]+)' % '|'.join(re.escape(p) for p in prefixes))
+    used = set()
+    for directory in search_dirs:
+        for path in Path(directory).rglob('*'):
+            if path.suffix in ('.html', '.js') and path.is_file():
+                used.update(pattern.findall(path.read_text(errors='ignore')))
+    return used
+
+
+def prune_icon_rules(css, prefixes, used):
+    """Drop ``.prefix-name:before`` selectors for icons nothing references"""
+    icon_selector = re.compile(r'^\.((?:%s)[a-z0-9-]+)::?before$' % '|'.join(re.escape(p) for p in prefixes))
+
+    def prune(match):
+        selectors = [s.strip() for s in match.group(1).split(',')]
+        kept = []
+        for selector in selectors:
+            icon = icon_selector.match(selector)
+            if icon is None or icon.group(1) in used:
+                kept.append(selector)
+        if not kept:
+            return ''
+        if len(kept) == len(selectors):
+            return match.group(0)
+        return f"{','.join(kept)}{{{match.group(2)}}}"
+
+    return RULE_RE.sub(prune, css)
+
+
+def glyph_codepoints(css):
+    """Codepoints of every ``content: "\\e900"`` escape left in the stylesheet"""
+    return {int(code, 16) for code in CONTENT_ESCAPE_RE.findall(css)}
+
+
+def subset_font(source, codepoints, output_stem):
+    """Write woff2 and woff subsets of ``source``; returns their file names"""
+    from fontTools import subset
+
+    # fontTools logs every table it touches, and warns about dropping
+    # FontForge's timestamp table
+    logging.getLogger('fontTools').setLevel(logging.ERROR)
+    names = []
+    for flavor in ('woff2', 'woff'):
+        options = subset.Options()
+        options.flavor = flavor
+        options.layout_features = []
+        options.name_IDs = []
+        options.notdef_outline = True
+        font = subset.load_font(str(source), options)
+        subsetter = subset.Subsetter(options)
+        subsetter.populate(unicodes=codepoints)
+        subsetter.subset(font)
+        output = output_stem.with_suffix(f'.{flavor}')
+        subset.save_font(font, str(output), options)
+        names.append(output.name)
+    return names
+
+
+def replace_font_faces(css, fonts):
+    """Point each subset family's first @font-face at its subset files and drop the rest"""
+    seen = set()
+
+    def replace(match):
+        family = FONT_FAMILY_RE.search(match.group(0))
+        family = family.group(1).strip() if family else None
+        if family not in fonts:
+            return match.group(0)
+        if family in seen:
+            return ''
+        seen.add(family)
+        woff2, woff = fonts[family]
+        return (
+            f'@font-face{{font-family:"{family}";'
+            f'src:url("fonts/{woff2}") format("woff2"),url("fonts/{woff}") format("woff");'
+            f'font-weight:normal;font-style:normal;font-display:block}}'
+        )
+
+    return FONT_FACE_RE.sub(replace, css)
+
+
+def build_css(name, root, out_dir, search_dirs):
+    import rcssmin
+
+    target = bundle_name('css', name)
+    parts = []
+    for source in bundle_sources('css', name):
+        css = (root / source).read_text(encoding='utf-8')
+        parts.append(rebase_urls(css, source, target))
+    css = '\n'.join(parts)
+
+    prefixes = [prefix for _, prefix in ICON_FONTS.values()]
+    css = prune_icon_rules(css, prefixes, used_icon_classes(prefixes, search_dirs))
+    codepoints = glyph_codepoints(css)
+
+    fonts_dir = out_dir / 'fonts'
+    fonts_dir.mkdir(parents=True, exist_ok=True)
+    fonts = {}
+    for family, (source, _) in ICON_FONTS.items():
+        if re.search(r'''font-family\s*:\s*['"]?%s''' % re.escape(family), css, re.IGNORECASE):
+            fonts[family] = subset_font(root / source, codepoints, fonts_dir / f'{name}-{family.lower()}')
+    css = replace_font_faces(css, fonts)
+
+    output = out_dir / f'{name}.css'
+    output.write_text(rcssmin.cssmin(css, keep_bang_comments=True), encoding='utf-8')
+    return output
+
+
+def build_js(name, root, out_dir):
+    import rjsmin
+
+    # A leading ; guards against sources that end without one
+    js = '\n;'.join((root / source).read_text(encoding='utf-8') for source in bundle_sources('js', name))
+    output = out_dir / f'{name}.js'
+    output.write_text(rjsmin.jsmin(js, keep_bang_comments=True), encoding='utf-8')
+    return output
+
+
+def build_all(root=None):
+    """Build every bundle into ``<static>/dist``; returns the written paths"""
+    root = Path(root or static_root())
+    out_dir = root / DIST_DIR
+    out_dir.mkdir(parents=True, exist_ok=True)
+    search_dirs = [d for d in (Path(settings.BASE_DIR) / 'templates', root / 'js') if d.is_dir()]
+
+    written = []
+    for name in CSS_BUNDLES:
+        written.append(build_css(name, root, out_dir, search_dirs))
+    for name in JS_BUNDLES:
+        written.append(build_js(name, root, out_dir))
+    written.extend(sorted((out_dir / 'fonts').iterdir()))
+    return written
@@ -0,0 +1,132 @@
+import io
+import json
+import math
+import sys
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not samples:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(samples)))
+    return samples[rank - 1]
+
+
+def summarize(latencies, elapsed):
+    """Throughput and latency percentiles (in ms) for a list of durations in seconds"""
+    samples = sorted(latencies)
+    return {
+        'count': len(samples),
+        'throughput': len(samples) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p95_ms': percentile(samples, 95) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+        'max_ms': (samples[-1] if samples else 0.0) * 1000,
+    }
+
+
+def format_summary(name, summary):
+    return (
+        f"{name}: {summary['count']} requests, {summary['throughput']:.1f} req/s, "
+        f"p50 {summary['p50_ms']:.1f} ms, p95 {summary['p95_ms']:.1f} ms, "
+        f"p99 {summary['p99_ms']:.1f} ms, max {summary['max_ms']:.1f} ms"
+    )
+
+
+class WSGIResponse:
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class WSGIClient:
+    """Calls a WSGI application in-process, keeping cookies like a browser.
+
+    Unlike django.test.Client, requests go through the real WSGI entry
+    point and the full middleware stack, CSRF checks included. One client
+    per simulated customer; it is not shared between threads.
+    """
+
+    def __init__(self, application, host='localhost'):
+        self.application = application
+        self.host = host
+        self.cookies = {}
+
+    def get(self, path, **headers):
+        return self.request('GET', path, headers=headers)
+
+    def post(self, path, data=None, content_type='application/x-www-form-urlencoded', **headers):
+        if isinstance(data, (str, bytes)):
+            body = data.encode() if isinstance(data, str) else data
+        else:
+            body = urlencode(data or {}).encode()
+        return self.request('POST', path, body, content_type, headers)
+
+    def request(self, method, path, body=b'', content_type='', headers=None):
+        path, _, query = path.partition('?')
+        environ = {
+            'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+            'SERVER_NAME': self.host, 'SERVER_PORT': '443', 'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_HOST': self.host, 'HTTP_X_FORWARDED_PROTO': 'https', 'REMOTE_ADDR': '127.0.0.1',
+            'CONTENT_TYPE': content_type, 'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0), 'wsgi.url_scheme': 'https', 'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+        }
+        for name, value in (headers or {}).items():
+            environ[f"HTTP_{name.upper().replace('-', '_')}"] = value
+        if self.cookies:
+            environ['HTTP_COOKIE'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+
+        started = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            started['status'] = int(status.split()[0])
+            started['headers'] = response_headers
+
+        result = self.application(environ, start_response)
+        try:
+            content = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+        for name, value in started['headers']:
+            if name.lower() == 'set-cookie':
+                for morsel in SimpleCookie(value).values():
+                    if morsel['max-age'] == '0':
+                        self.cookies.pop(morsel.key, None)
+                    else:
+                        self.cookies[morsel.key] = morsel.value
+        return WSGIResponse(started['status'], dict(started['headers']), content)
+
+
+# Lower is better for latencies, higher for throughput
+COMPARED_METRICS = ('throughput', 'p50_ms', 'p95_ms', 'p99_ms')
+
+
+def compare(baseline, current):
+    """Change per step and metric against a baseline run.
+
+    Returns ``[(step, metric, baseline, current, change_pct)]``, where a
+    positive change_pct is always a slowdown.
+    """
+    rows = []
+    for step, summary in current['steps'].items():
+        base = baseline.get('steps', {}).get(step)
+        if not base:
+            continue
+        for metric in COMPARED_METRICS:
+            before, after = base.get(metric, 0.0), summary.get(metric, 0.0)
+            if not before:
+                continue
+            change = (after - before) / before * 100
+            if metric == 'throughput':
+                change = -change
+            rows.append((step, metric, before, after, change))
+    return rows
@@ -0,0 +1,290 @@
+"""
+Two-tier cache: a small in-process LRU (L1) in front of django_redis (L2).
+
+Reads are served from L1 when possible and fall through to Redis. Every
+write, delete or counter change goes to Redis and is broadcast on a pub/sub
+channel so other processes drop their L1 copy. L1 entries also expire after
+L1_TIMEOUT seconds, which bounds staleness if an invalidation is lost, and
+L1 is bypassed entirely while the process is not subscribed.
+
+Django creates one cache instance per thread, so the L1 store and the
+listener thread are shared per process (and recreated after a fork).
+"""
+
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django_redis.cache import RedisCache
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+# Invalidation payload meaning "drop everything"
+_ALL = '*'
+
+
+class LocalLRU:
+    """Bounded, thread-safe LRU of pickled values with per-entry expiry"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return _MISSING
+            pickled, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return _MISSING
+            self._data.move_to_end(key)
+        return pickle.loads(pickled)
+
+    def set(self, key, value, ttl):
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._data[key] = (pickled, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class LocalTier:
+    """Per-process L1 store plus the thread that applies invalidations to it"""
+
+    def __init__(self, max_entries, channel):
+        self.store = LocalLRU(max_entries)
+        self.channel = channel
+        self.origin = uuid.uuid4().hex
+        self.pid = os.getpid()
+        self.subscribed = threading.Event()
+        self.thread = None
+
+    def start(self, redis_client_factory):
+        self.thread = threading.Thread(
+            target=self._listen, args=(redis_client_factory,), name='cache-invalidation', daemon=True
+        )
+        self.thread.start()
+
+    def _listen(self, redis_client_factory):
+        while True:
+            try:
+                pubsub = redis_client_factory().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # Anything cached before the subscription may have missed an invalidation
+                self.store.clear()
+                self.subscribed.set()
+                for message in pubsub.listen():
+                    self.apply(message['data'])
+            except Exception as e:
+                logger.warning(f"Cache invalidation listener lost its subscription: {e}")
+            finally:
+                self.subscribed.clear()
+                self.store.clear()
+            time.sleep(1)
+
+    def apply(self, data):
+        try:
+            message = json.loads(data)
+        except (TypeError, ValueError):
+            return
+        if message.get('origin') == self.origin:
+            return
+        if message.get('keys') == _ALL:
+            self.store.clear()
+        else:
+            self.store.delete(message.get('keys', []))
+
+
+_tiers = {}
+_tiers_lock = threading.Lock()
+
+
+class TwoTierRedisCache(RedisCache):
+    """django_redis cache with a process-local LRU in front of it.
+
+    Extra OPTIONS: L1_MAX_ENTRIES (default 1000) and L1_TIMEOUT, the longest
+    an L1 entry is served without asking Redis (default 2 seconds; 0
+    disables L1).
+    """
+
+    def __init__(self, server, params):
+        params = dict(params)
+        options = dict(params.get('OPTIONS', {}))
+        self.l1_max_entries = int(options.pop('L1_MAX_ENTRIES', 1000))
+        self.l1_timeout = float(options.pop('L1_TIMEOUT', 2))
+        params['OPTIONS'] = options
+        super().__init__(server, params)
+        self.invalidation_channel = f'cache_invalidation:{self.key_prefix}'
+
+    def _tier(self):
+        """The process-wide L1 for this server, or None while it cannot be trusted"""
+        if self.l1_timeout <= 0:
+            return None
+        tier_key = (self._server if isinstance(self._server, str) else tuple(self._server), self.key_prefix)
+        tier = _tiers.get(tier_key)
+        if tier is None or tier.pid != os.getpid():
+            with _tiers_lock:
+                tier = _tiers.get(tier_key)
+                if tier is None or tier.pid != os.getpid():
+                    tier = LocalTier(self.l1_max_entries, self.invalidation_channel)
+                    tier.start(lambda: self.client.get_client(write=True))
+                    _tiers[tier_key] = tier
+        return tier if tier.subscribed.is_set() else None
+
+    def _l1_ttl(self, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if timeout is None:
+            return self.l1_timeout
+        return min(self.l1_timeout, timeout)
+
+    def _store_local(self, tier, made_key, value, timeout=DEFAULT_TIMEOUT):
+        ttl = self._l1_ttl(timeout)
+        if ttl > 0:
+            tier.store.set(made_key, value, ttl)
+        else:
+            tier.store.delete([made_key])
+
+    def _invalidate(self, made_keys):
+        """Drop keys locally and tell the other processes to do the same"""
+        tier = self._tier()
+        if tier is not None:
+            if made_keys == _ALL:
+                tier.store.clear()
+            else:
+                tier.store.delete(made_keys)
+        origin = tier.origin if tier is not None else None
+        try:
+            self.client.get_client(write=True).publish(
+                self.invalidation_channel, json.dumps({'origin': origin, 'keys': made_keys})
+            )
+        except Exception as e:
+            # Other processes fall back on L1_TIMEOUT
+            logger.warning(f"Could not publish cache invalidation: {e}")
+
+    def _made_key(self, key, version=None):
+        return self.make_key(key, version=version)
+
+    def get(self, key, default=None, version=None, client=None):
+        tier = self._tier()
+        made_key = self._made_key(key, version)
+        if tier is not None:
+            value = tier.store.get(made_key)
+            if value is not _MISSING:
+                return value
+
+        value = super().get(key, default=_MISSING, version=version, client=client)
+        if value is _MISSING:
+            return default
+        if tier is not None:
+            self._store_local(tier, made_key, value)
+        return value
+
+    def get_many(self, keys, version=None, client=None):
+        tier = self._tier()
+        found = {}
+        remote_keys = []
+        for key in keys:
+            value = tier.store.get(self._made_key(key, version)) if tier is not None else _MISSING
+            if value is _MISSING:
+                remote_keys.append(key)
+            else:
+                found[key] = value
+        if remote_keys:
+            remote = super().get_many(remote_keys, version=version, client=client)
+            if tier is not None:
+                for key, value in remote.items():
+                    self._store_local(tier, self._made_key(key, version), value)
+            found.update(remote)
+        return found
+
+    def has_key(self, key, version=None, client=None):
+        tier = self._tier()
+        if tier is not None and tier.store.get(self._made_key(key, version)) is not _MISSING:
+            return True
+        return super().has_key(key, version=version, client=client)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, client=None, nx=False, xx=False):
+        result = super().set(key, value, timeout=timeout, version=version, client=client, nx=nx, xx=xx)
+        made_key = self._made_key(key, version)
+        self._invalidate([made_key])
+        tier = self._tier()
+        # With nx/xx the write may not have happened; let the next read ask Redis
+        if result and tier is not None and not (nx or xx):
+            self._store_local(tier, made_key, value, timeout)
+        return result
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, client=None):
+        # Locks are taken with add(), so it always goes to Redis and never fills L1
+        result = super().add(key, value, timeout=timeout, version=version, client=client)
+        if result:
+            self._invalidate([self._made_key(key, version)])
+        return result
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None, client=None):
+        result = super().set_many(data, timeout=timeout, version=version, client=client)
+        self._invalidate([self._made_key(key, version) for key in data])
+        tier = self._tier()
+        if tier is not None:
+            for key, value in data.items():
+                self._store_local(tier, self._made_key(key, version), value, timeout)
+        return result
+
+    def delete(self, key, version=None, prefix=None, client=None):
+        result = super().delete(key, version=version, prefix=prefix, client=client)
+        self._invalidate([self._made_key(key, version)])
+        return result
+
+    def delete_many(self, keys, version=None, client=None):
+        keys = list(keys)
+        result = super().delete_many(keys, version=version, client=client)
+        self._invalidate([self._made_key(key, version) for key in keys])
+        return result
+
+    def incr(self, key, delta=1, version=None, client=None, ignore_key_check=False):
+        result = super().incr(key, delta=delta, version=version, client=client, ignore_key_check=ignore_key_check)
+        self._invalidate([self._made_key(key, version)])
+        return result
+
+    def decr(self, key, delta=1, version=None, client=None):
+        result = super().decr(key, delta=delta, version=version, client=client)
+        self._invalidate([self._made_key(key, version)])
+        return result
+
+    def delete_pattern(self, *args, **kwargs):
+        result = super().delete_pattern(*args, **kwargs)
+        self._invalidate(_ALL)
+        return result
+
+    def incr_version(self, *args, **kwargs):
+        result = super().incr_version(*args, **kwargs)
+        self._invalidate(_ALL)
+        return result
+
+    def clear(self):
+        result = super().clear()
+        self._invalidate(_ALL)
+        return result
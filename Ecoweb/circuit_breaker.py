@@ -0,0 +1,105 @@
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is refused because its circuit is open"""
+
+    def __init__(self, name, retry_after):
+        self.name = name
+        self.retry_after = retry_after
+        super().__init__(f"Circuit '{name}' is open, retry in {retry_after}s")
+
+
+class CircuitBreaker:
+    """Failure counter per upstream endpoint, shared by all workers through the cache.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    every call fails immediately for ``recovery_timeout`` seconds. Once the
+    cool-down has passed a single trial call is let through (half-open); its
+    outcome closes the circuit again or restarts the cool-down.
+    """
+
+    def __init__(self, name, failure_threshold=None, recovery_timeout=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or getattr(settings, 'CIRCUIT_BREAKER_FAILURE_THRESHOLD', 5)
+        self.recovery_timeout = recovery_timeout or getattr(settings, 'CIRCUIT_BREAKER_RECOVERY_TIMEOUT', 60)
+        self.failures_key = f'circuit_{name}_failures'
+        self.opened_at_key = f'circuit_{name}_opened_at'
+        self.trial_key = f'circuit_{name}_trial'
+
+    def _opened_at(self):
+        return cache.get(self.opened_at_key)
+
+    def state(self):
+        opened_at = self._opened_at()
+        if opened_at is None:
+            return CLOSED
+        if time.time() - opened_at < self.recovery_timeout:
+            return OPEN
+        return HALF_OPEN
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go upstream now"""
+        opened_at = self._opened_at()
+        if opened_at is None:
+            return
+        remaining = self.recovery_timeout - (time.time() - opened_at)
+        if remaining > 0:
+            raise CircuitOpenError(self.name, int(remaining) + 1)
+        # Half-open: only one worker gets to send the trial request
+        if not cache.add(self.trial_key, True, self.recovery_timeout):
+            raise CircuitOpenError(self.name, self.recovery_timeout)
+
+    async def abefore_call(self):
+        await sync_to_async(self.before_call, thread_sensitive=False)()
+
+    def record_success(self):
+        state = cache.get_many([self.failures_key, self.opened_at_key])
+        # Almost every call succeeds on a closed circuit; that needs no write
+        if not state.get(self.failures_key) and state.get(self.opened_at_key) is None:
+            return
+        if state.get(self.opened_at_key) is not None:
+            logger.info(f"Circuit '{self.name}' closed after successful trial call")
+        cache.delete_many([self.failures_key, self.opened_at_key, self.trial_key])
+
+    async def arecord_success(self):
+        await sync_to_async(self.record_success, thread_sensitive=False)()
+
+    def record_failure(self):
+        cache.add(self.failures_key, 0, self.recovery_timeout * 10)
+        try:
+            failures = cache.incr(self.failures_key)
+        except ValueError:
+            failures = 1
+            cache.set(self.failures_key, failures, self.recovery_timeout * 10)
+
+        if failures >= self.failure_threshold:
+            # Re-opening also restarts the cool-down after a failed trial call
+            cache.set(self.opened_at_key, time.time(), None)
+            cache.delete(self.trial_key)
+            logger.warning(f"Circuit '{self.name}' opened after {failures} consecutive failures")
+
+    async def arecord_failure(self):
+        await sync_to_async(self.record_failure, thread_sensitive=False)()
+
+    def status(self):
+        opened_at = self._opened_at()
+        retry_after = 0
+        if opened_at is not None:
+            retry_after = max(0, int(self.recovery_timeout - (time.time() - opened_at)))
+        return {
+            'state': self.state(),
+            'failures': cache.get(self.failures_key, 0),
+            'retry_after': retry_after,
+        }
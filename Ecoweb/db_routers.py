@@ -0,0 +1,72 @@
+"""
+Read-replica routing for the storefront.
+
+Catalog reads made while serving a request go to the ``replica`` database
+when DATABASE_REPLICA_URL is set; everything else (writes, orders,
+payments, sessions, management commands and the notification worker) uses
+``default``. A request that writes pins its client to the primary for
+REPLICA_PIN_SECONDS so the next pages do not read behind their own
+changes (see ReplicaPinMiddleware).
+"""
+
+import contextvars
+
+from django.conf import settings
+
+REPLICA = 'replica'
+PRIMARY = 'default'
+
+# Models whose reads may lag the primary by a few seconds
+CATALOG_MODELS = {'Ecoweb.item'}
+
+
+class RequestRouting:
+    """Routing state for the request being served"""
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+_routing = contextvars.ContextVar('db_routing', default=None)
+
+
+def begin_request(pinned):
+    """Start routing for a request; returns the token for end_request"""
+    return _routing.set(RequestRouting(pinned))
+
+
+def end_request(token):
+    """Finish the request and report whether it wrote to the primary"""
+    state = _routing.get()
+    _routing.reset(token)
+    return state is not None and state.wrote
+
+
+def replica_configured():
+    return REPLICA in settings.DATABASES
+
+
+class ReplicaRouter:
+    """Send catalog reads to the replica, everything else to the primary"""
+
+    def db_for_read(self, model, **hints):
+        state = _routing.get()
+        if state is None or state.pinned or state.wrote:
+            return PRIMARY
+        if model._meta.label_lower in CATALOG_MODELS and replica_configured():
+            return REPLICA
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        state = _routing.get()
+        if state is not None:
+            state.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        return {obj1._state.db, obj2._state.db} <= {PRIMARY, REPLICA}
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY
@@ -0,0 +1,22 @@
+from functools import wraps
+
+from asgiref.sync import markcoroutinefunction, sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.views.decorators.csrf import csrf_exempt
+
+
+def async_login_required(view_func):
+    """login_required for ``async def`` views; Django 4.2's version only wraps sync views"""
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        # request.user loads the session from the database on first access
+        is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+        if not is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view_func(request, *args, **kwargs)
+    return wrapper
+
+
+def async_csrf_exempt(view_func):
+    """csrf_exempt that keeps an ``async def`` view recognisable as async"""
+    return markcoroutinefunction(csrf_exempt(view_func))
@@ -0,0 +1,88 @@
+import logging
+import smtplib
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template.loader import get_template as load_template
+
+logger = logging.getLogger(__name__)
+
+# HTML alternatives for outbox email templates; others go out as plain text
+HTML_TEMPLATES = {
+    'order_confirmation_email': 'emails/order_confirmation.html',
+}
+
+
+@lru_cache(maxsize=None)
+def get_template(name):
+    """Compile an email template once per process, even when DEBUG disables the cached loader"""
+    return load_template(name)
+
+
+def order_context(order):
+    items = list(order.items.select_related('item'))
+    return {
+        'order': order,
+        'items': items,
+        'total': sum(order_item.get_total_item_price() for order_item in items),
+    }
+
+
+def build_message(notification, connection=None):
+    message = EmailMultiAlternatives(
+        notification.subject,
+        notification.body,
+        settings.DEFAULT_FROM_EMAIL,
+        [notification.recipient],
+        connection=connection
+    )
+    template_name = HTML_TEMPLATES.get(notification.template)
+    if template_name and notification.order_id:
+        html = get_template(template_name).render(order_context(notification.order))
+        message.attach_alternative(html, 'text/html')
+    return message
+
+
+def send_emails(notifications):
+    """Send outbox emails over one SMTP connection; returns ``{pk: error}``.
+
+    The connection stays open for the whole batch and is reopened once if the
+    server drops it part way through. Error is None for delivered messages.
+    """
+    results = {}
+    if not notifications:
+        return results
+
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        logger.error(f"Could not open email connection: {e}")
+        return {notification.pk: str(e) for notification in notifications}
+
+    try:
+        for notification in notifications:
+            try:
+                message = build_message(notification, connection)
+            except Exception as e:
+                results[notification.pk] = f"Rendering failed: {e}"
+                continue
+            try:
+                connection.send_messages([message])
+            except smtplib.SMTPServerDisconnected:
+                # Server closed an idle or long-lived session; retry once on a new one
+                connection.close()
+                try:
+                    connection.open()
+                    connection.send_messages([message])
+                except Exception as e:
+                    results[notification.pk] = str(e)
+                    continue
+            except Exception as e:
+                results[notification.pk] = str(e)
+                continue
+            results[notification.pk] = None
+    finally:
+        connection.close()
+    return results
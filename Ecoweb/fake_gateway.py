@@ -0,0 +1,420 @@
+"""
+Local stand-in for the Safaricom Daraja, Pesapal v3 and Africa's Talking APIs.
+
+Serves the endpoints the payment services call (OAuth, STK push, STK query,
+Pesapal RequestToken/RegisterIPN/SubmitOrderRequest/GetTransactionStatus)
+and the Africa's Talking bulk messaging endpoint with configurable latency and fault injection, and fires the M-Pesa callback
+and Pesapal IPN back at the app once a simulated payment settles.
+
+Run it standalone with ``manage.py run_fake_gateway`` and point
+MPESA_BASE_URL / PESAPAL_BASE_URL / AFRICAS_TALKING_BASE_URL at it, or use ``FakeGateway`` as a context
+manager from tests and load-test drivers.
+"""
+
+import json
+import logging
+import math
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Daraja's clock
+EAT = timezone(timedelta(hours=3), 'EAT')
+
+
+def parse_latency(spec):
+    """Build a latency sampler (seconds) from a spec string.
+
+    Supported forms: ``fixed:0.2``, ``uniform:0.05:0.5``,
+    ``normal:mean:stddev`` and ``lognormal:median:sigma``.
+    """
+    kind, _, args = (spec or 'fixed:0').partition(':')
+    params = [float(a) for a in args.split(':') if a]
+
+    if kind == 'fixed':
+        value = params[0] if params else 0.0
+        return lambda: value
+    if kind == 'uniform':
+        low, high = params
+        return lambda: random.uniform(low, high)
+    if kind == 'normal':
+        mean, stddev = params
+        return lambda: max(0.0, random.gauss(mean, stddev))
+    if kind == 'lognormal':
+        median, sigma = params
+        mu = math.log(median)
+        return lambda: random.lognormvariate(mu, sigma)
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class FakeGatewayConfig:
+    def __init__(self, latency='fixed:0', error_rate=0.0, timeout_rate=0.0, timeout_delay=35.0,
+                 callback_delay=1.0, success_rate=1.0, callback_url=None, fire_callbacks=True):
+        self.latency = parse_latency(latency) if isinstance(latency, str) else latency
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.timeout_delay = timeout_delay
+        self.callback_delay = callback_delay
+        self.success_rate = success_rate
+        # Overrides the CallBackURL sent in each STK push when set
+        self.callback_url = callback_url
+        self.fire_callbacks = fire_callbacks
+
+
+class GatewayState:
+    """Payments created through the fake gateway, keyed by their request id"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stk_requests = {}
+        self.pesapal_orders = {}
+        self.ipn_urls = {}
+        self.callbacks_sent = 0
+        self.sms_requests = 0
+        self.sms_recipients = 0
+
+    def settle(self, record, success):
+        with self.lock:
+            record['settled'] = True
+            record['success'] = success
+
+
+def default_callback_sender(method, url, body=None):
+    """Deliver a callback over HTTP"""
+    try:
+        if method == 'POST':
+            requests.post(url, json=body, timeout=10)
+        else:
+            requests.get(url, timeout=10)
+    except requests.RequestException as e:
+        logger.warning(f"Fake gateway callback to {url} failed: {e}")
+
+
+class FakeGatewayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    routes = {
+        ('GET', '/oauth/v1/generate'): 'daraja_oauth',
+        ('POST', '/mpesa/stkpush/v1/processrequest'): 'daraja_stk_push',
+        ('POST', '/mpesa/stkpushquery/v1/query'): 'daraja_stk_query',
+        ('POST', '/api/Auth/RequestToken'): 'pesapal_token',
+        ('POST', '/api/URLSetup/RegisterIPN'): 'pesapal_register_ipn',
+        ('POST', '/api/Transactions/SubmitOrderRequest'): 'pesapal_submit_order',
+        ('GET', '/api/Transactions/GetTransactionStatus'): 'pesapal_transaction_status',
+        ('POST', '/version1/messaging'): 'africas_talking_send',
+    }
+
+    @property
+    def gateway(self):
+        return self.server.gateway
+
+    def log_message(self, format, *args):
+        logger.debug(f"Fake gateway: {format % args}")
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def _dispatch(self, method):
+        parsed = urlparse(self.path)
+        handler_name = self.routes.get((method, parsed.path))
+        length = int(self.headers.get('Content-Length') or 0)
+        raw_body = self.rfile.read(length) if length else b''
+
+        if handler_name is None:
+            return self._send(404, {'errorMessage': f'No route for {method} {parsed.path}'})
+
+        config = self.gateway.config
+        time.sleep(config.latency())
+
+        roll = random.random()
+        if roll < config.timeout_rate:
+            time.sleep(config.timeout_delay)
+        elif roll < config.timeout_rate + config.error_rate:
+            return self._send(503, {
+                'requestId': uuid.uuid4().hex,
+                'errorCode': '503.001.01',
+                'errorMessage': 'Service is currently unavailable (injected fault)'
+            })
+
+        if self.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+            body = {k: v[0] for k, v in parse_qs(raw_body.decode()).items()}
+        else:
+            try:
+                body = json.loads(raw_body) if raw_body else {}
+            except json.JSONDecodeError:
+                return self._send(400, {'errorMessage': 'Invalid JSON'})
+        query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+
+        status, payload = getattr(self, handler_name)(body, query)
+        self._send(status, payload)
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # Daraja
+
+    def daraja_oauth(self, body, query):
+        return 200, {'access_token': f'fake_{uuid.uuid4().hex}', 'expires_in': '3599'}
+
+    def daraja_stk_push(self, body, query):
+        merchant_request_id = f'fake-{uuid.uuid4().hex[:12]}'
+        checkout_request_id = f'ws_CO_{datetime.now():%d%m%Y%H%M%S}{uuid.uuid4().hex[:8]}'
+        record = {
+            'merchant_request_id': merchant_request_id,
+            'checkout_request_id': checkout_request_id,
+            'amount': body.get('Amount'),
+            'phone': body.get('PhoneNumber'),
+            'callback_url': self.gateway.config.callback_url or body.get('CallBackURL'),
+            'settled': False,
+            'success': None,
+        }
+        with self.gateway.state.lock:
+            self.gateway.state.stk_requests[checkout_request_id] = record
+        self.gateway.schedule_stk_settlement(record)
+
+        return 200, {
+            'MerchantRequestID': merchant_request_id,
+            'CheckoutRequestID': checkout_request_id,
+            'ResponseCode': '0',
+            'ResponseDescription': 'Success. Request accepted for processing',
+            'CustomerMessage': 'Success. Request accepted for processing'
+        }
+
+    def daraja_stk_query(self, body, query):
+        record = self.gateway.state.stk_requests.get(body.get('CheckoutRequestID'))
+        if record is None:
+            return 400, {'errorCode': '400.002.02', 'errorMessage': 'Bad Request - Invalid CheckoutRequestID'}
+        if not record['settled']:
+            # Daraja answers queries for in-flight pushes with a 500
+            return 500, {'errorCode': '500.001.1001', 'errorMessage': 'The transaction is being processed'}
+
+        result_code, result_desc = stk_result(record['success'])
+        return 200, {
+            'ResponseCode': '0',
+            'ResponseDescription': 'The service request has been accepted successsfully',
+            'MerchantRequestID': record['merchant_request_id'],
+            'CheckoutRequestID': record['checkout_request_id'],
+            'ResultCode': str(result_code),
+            'ResultDesc': result_desc
+        }
+
+    # Pesapal
+
+    def pesapal_token(self, body, query):
+        return 200, {
+            'token': f'fake_{uuid.uuid4().hex}',
+            'expiryDate': (datetime.utcnow() + timedelta(minutes=5)).isoformat() + 'Z',
+            'error': None,
+            'status': '200',
+            'message': 'Request processed successfully'
+        }
+
+    def pesapal_register_ipn(self, body, query):
+        ipn_id = str(uuid.uuid4())
+        with self.gateway.state.lock:
+            self.gateway.state.ipn_urls[ipn_id] = body.get('url')
+        return 200, {
+            'url': body.get('url'),
+            'ipn_id': ipn_id,
+            'notification_type': 0 if body.get('ipn_notification_type') == 'GET' else 1,
+            'ipn_status': 1,
+            'status': '200'
+        }
+
+    def pesapal_submit_order(self, body, query):
+        order_tracking_id = str(uuid.uuid4())
+        record = {
+            'order_tracking_id': order_tracking_id,
+            'merchant_reference': body.get('id'),
+            'amount': body.get('amount'),
+            'ipn_url': self.gateway.state.ipn_urls.get(body.get('notification_id')),
+            'settled': False,
+            'success': None,
+        }
+        with self.gateway.state.lock:
+            self.gateway.state.pesapal_orders[order_tracking_id] = record
+        self.gateway.schedule_pesapal_settlement(record)
+
+        return 200, {
+            'order_tracking_id': order_tracking_id,
+            'merchant_reference': body.get('id'),
+            'redirect_url': f'{self.gateway.url}/pay/{order_tracking_id}',
+            'error': None,
+            'status': '200'
+        }
+
+    def pesapal_transaction_status(self, body, query):
+        record = self.gateway.state.pesapal_orders.get(query.get('orderTrackingId'))
+        if record is None:
+            return 200, {'payment_status_description': 'INVALID', 'status_code': 0, 'status': '500',
+                         'error': {'code': 'invalid_tracking_id', 'message': 'Unknown order tracking id'}}
+        if not record['settled']:
+            description, status_code = 'Pending', 0
+        elif record['success']:
+            description, status_code = 'Completed', 1
+        else:
+            description, status_code = 'Failed', 2
+        return 200, {
+            'payment_method': 'MpesaKE',
+            'amount': record['amount'],
+            'created_date': datetime.utcnow().isoformat(),
+            'confirmation_code': uuid.uuid4().hex[:10].upper() if record['success'] else '',
+            'payment_status_description': description,
+            'status_code': status_code,
+            'merchant_reference': record['merchant_reference'],
+            'currency': 'KES',
+            'status': '200'
+        }
+
+    # Africa's Talking
+
+    def africas_talking_send(self, body, query):
+        numbers = [n.strip() for n in body.get('to', '').split(',') if n.strip()]
+        state = self.gateway.state
+        with state.lock:
+            state.sms_requests += 1
+            state.sms_recipients += len(numbers)
+        recipients = []
+        for number in numbers:
+            if number.lstrip('+').isdigit() and len(number.lstrip('+')) == 12:
+                recipients.append({'statusCode': 101, 'number': number, 'status': 'Success',
+                                   'cost': 'KES 0.8000', 'messageId': f'ATXid_{uuid.uuid4().hex}'})
+            else:
+                recipients.append({'statusCode': 403, 'number': number, 'status': 'InvalidPhoneNumber',
+                                   'cost': '0', 'messageId': 'None'})
+        sent = sum(1 for r in recipients if r['statusCode'] == 101)
+        return 201, {'SMSMessageData': {
+            'Message': f'Sent to {sent}/{len(numbers)} Total Cost: KES {sent * 0.8:.4f}',
+            'Recipients': recipients
+        }}
+
+
+def stk_result(success):
+    if success:
+        return 0, 'The service request is processed successfully.'
+    return 1032, 'Request cancelled by user'
+
+
+class FakeGateway:
+    """Threaded fake Daraja/Pesapal server.
+
+    ``callback_sender(method, url, body)`` delivers callbacks; the default
+    posts over HTTP, in-process drivers can pass one that uses a test client.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, config=None, callback_sender=None):
+        self.config = config or FakeGatewayConfig()
+        self.state = GatewayState()
+        self.callback_sender = callback_sender or default_callback_sender
+        self.server = ThreadingHTTPServer((host, port), FakeGatewayHandler)
+        self.server.daemon_threads = True
+        self.server.gateway = self
+        self.thread = None
+        # Pending callback timers, so stop() can cancel them
+        self.timers = []
+        self.timers_lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def settings(self):
+        """Settings overrides that route the payment and SMS services to this server"""
+        return {
+            'MPESA_BASE_URL': self.url,
+            'PESAPAL_BASE_URL': self.url,
+            'AFRICAS_TALKING_BASE_URL': self.url,
+        }
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        logger.info(f"Fake payment gateway listening on {self.url}")
+        return self
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        with self.timers_lock:
+            timers, self.timers = self.timers, []
+        for timer in timers:
+            timer.cancel()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _schedule(self, func):
+        timer = threading.Timer(self.config.callback_delay, func)
+        timer.daemon = True
+        with self.timers_lock:
+            # Drop the timers that have fired; a long run schedules one per payment
+            self.timers = [pending for pending in self.timers if pending.is_alive()]
+            self.timers.append(timer)
+            timer.start()
+
+    def schedule_stk_settlement(self, record):
+        def settle():
+            success = random.random() < self.config.success_rate
+            self.state.settle(record, success)
+            if self.config.fire_callbacks and record['callback_url']:
+                self.callback_sender('POST', record['callback_url'], self.stk_callback_body(record))
+                with self.state.lock:
+                    self.state.callbacks_sent += 1
+
+        self._schedule(settle)
+
+    def schedule_pesapal_settlement(self, record):
+        def settle():
+            success = random.random() < self.config.success_rate
+            self.state.settle(record, success)
+            if self.config.fire_callbacks and record['ipn_url']:
+                params = urlencode({
+                    'OrderTrackingId': record['order_tracking_id'],
+                    'OrderMerchantReference': record['merchant_reference'],
+                    'OrderNotificationType': 'IPNCHANGE',
+                })
+                self.callback_sender('GET', f"{record['ipn_url']}?{params}", None)
+                with self.state.lock:
+                    self.state.callbacks_sent += 1
+
+        self._schedule(settle)
+
+    def stk_callback_body(self, record):
+        result_code, result_desc = stk_result(record['success'])
+        callback = {
+            'MerchantRequestID': record['merchant_request_id'],
+            'CheckoutRequestID': record['checkout_request_id'],
+            'ResultCode': result_code,
+            'ResultDesc': result_desc,
+        }
+        if record['success']:
+            callback['CallbackMetadata'] = {'Item': [
+                {'Name': 'Amount', 'Value': record['amount']},
+                {'Name': 'MpesaReceiptNumber', 'Value': uuid.uuid4().hex[:10].upper()},
+                {'Name': 'TransactionDate', 'Value': int(datetime.now(EAT).strftime('%Y%m%d%H%M%S'))},
+                {'Name': 'PhoneNumber', 'Value': int(record['phone'] or 0)},
+            ]}
+        return {'Body': {'stkCallback': callback}}
@@ -0,0 +1,84 @@
+"""
+Template fragment caching for the storefront.
+
+Fragments are cached with Django's {% cache %} tag and keyed on version
+numbers instead of being deleted:
+
+- ``release`` changes with every deploy, so header and footer markup is
+  rebuilt after a template change;
+- ``catalog_version`` is bumped whenever an Item is saved or deleted, so
+  the product grid is rebuilt and every older grid key becomes
+  unreachable (it ages out of the cache).
+
+Product cards inside the grid are keyed on the fields they display, so a
+rebuilt grid only re-renders the cards that changed.
+
+Item changes made with QuerySet.update() send no signals; call
+bump_catalog_version() after them.
+"""
+
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.functional import SimpleLazyObject
+
+from .models import Item
+
+logger = logging.getLogger(__name__)
+
+CATALOG_VERSION_KEY = 'catalog:version'
+
+
+def _initial_version():
+    # Larger than any version handed out before the key was lost (evicted,
+    # or Redis flushed), so no stale grid is ever reachable again
+    return time.time_ns() // 1000
+
+
+def catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, _initial_version(), None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+async def acatalog_version():
+    version = await cache.aget(CATALOG_VERSION_KEY)
+    if version is None:
+        await cache.aadd(CATALOG_VERSION_KEY, _initial_version(), None)
+        version = await cache.aget(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    try:
+        version = cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        version = _initial_version()
+        cache.set(CATALOG_VERSION_KEY, version, None)
+    logger.debug(f"Catalog version is now {version}")
+    return version
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+def item_changed(sender, **kwargs):
+    # Bumping before commit would let a concurrent render cache the old rows
+    # under the new version
+    transaction.on_commit(bump_catalog_version)
+
+
+def fragment_cache(request):
+    """Context processor: cache timeout and version keys for {% cache %}"""
+    return {
+        'fragment_cache_timeout': getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 86400),
+        'release': getattr(settings, 'RELEASE', ''),
+        # Only looked up when a template uses it
+        'catalog_version': SimpleLazyObject(catalog_version),
+    }
@@ -0,0 +1,96 @@
+import logging
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Order, OrderItem
+from .signals import order_paid
+
+logger = logging.getLogger(__name__)
+
+
+def fulfil_order(order, ordered_date=None):
+    """Mark an order and all of its lines as paid.
+
+    Uses one UPDATE for the order and one for its lines regardless of how many
+    lines there are. Returns False (and sends nothing) if another callback or
+    poll already completed the order, so ``order_paid`` fires exactly once.
+    """
+    ordered_date = ordered_date or timezone.now()
+
+    with transaction.atomic():
+        updated = (
+            Order.objects
+            .filter(pk=order.pk)
+            .exclude(payment_status='COMPLETED')
+            .update(payment_status='COMPLETED', ordered=True, ordered_date=ordered_date)
+        )
+        if updated:
+            OrderItem.objects.filter(order=order).update(ordered=True)
+            transaction.on_commit(lambda: order_paid.send(sender=Order, order=order))
+
+    if updated:
+        order.payment_status = 'COMPLETED'
+        order.ordered = True
+        order.ordered_date = ordered_date
+        logger.info(f"Order #{order.pk} fulfilled")
+    return bool(updated)
+
+
+def fulfil_orders(order_ids, ordered_date=None):
+    """Bulk version of fulfil_order for a batch of order ids.
+
+    Returns the ids that were newly completed; ``order_paid`` is sent for
+    each of them once the transaction commits.
+    """
+    ordered_date = ordered_date or timezone.now()
+
+    with transaction.atomic():
+        newly_paid = list(
+            Order.objects
+            .select_for_update()
+            .filter(pk__in=order_ids)
+            .exclude(payment_status='COMPLETED')
+            .values_list('pk', flat=True)
+        )
+        if newly_paid:
+            Order.objects.filter(pk__in=newly_paid).update(
+                payment_status='COMPLETED', ordered=True, ordered_date=ordered_date
+            )
+            OrderItem.objects.filter(order__in=newly_paid).update(ordered=True)
+
+            def send_signals():
+                for order in Order.objects.filter(pk__in=newly_paid):
+                    order_paid.send(sender=Order, order=order)
+
+            transaction.on_commit(send_signals)
+
+    return newly_paid
+
+
+def fail_order(order):
+    """Record a failed payment on an order still awaiting payment.
+
+    A failure reported after the order was paid (a late callback for an
+    earlier push, a stale status query) leaves it alone. Returns True if the
+    order was marked FAILED.
+    """
+    updated = Order.objects.filter(pk=order.pk, payment_status='PENDING').update(payment_status='FAILED')
+    if updated:
+        order.payment_status = 'FAILED'
+    return bool(updated)
+
+
+def apply_pesapal_status(order, status_response):
+    """Update an order from a Pesapal GetTransactionStatus response"""
+    payment_status = status_response.get('payment_status_description', '').upper()
+    if payment_status == 'COMPLETED':
+        fulfil_order(order)
+    elif payment_status in ['FAILED', 'INVALID']:
+        fail_order(order)
+    return payment_status
+
+
+def fail_orders(order_ids):
+    """Record failed payments for a batch of order ids still awaiting payment"""
+    return Order.objects.filter(pk__in=order_ids, payment_status='PENDING').update(payment_status='FAILED')
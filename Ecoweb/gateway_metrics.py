@@ -0,0 +1,295 @@
+"""
+Latency and outcome telemetry for calls to the payment and SMS gateways.
+
+Every Daraja, Pesapal and Africa's Talking request goes through call(),
+which records against its endpoint:
+
+- a latency histogram,
+- the HTTP status, or ``timeout`` / ``error`` when no response came back,
+- the gateway's own result codes (Daraja ResponseCode/ResultCode/errorCode,
+  Pesapal error codes and payment status, Africa's Talking per-recipient
+  statusCode),
+- how many of the calls were retries.
+
+Web workers and the notification worker all call the gateways, so the
+counters live in the shared cache (like the circuit breakers) rather than
+in process. ``manage.py gateway_stats`` and /metrics read them from there.
+A call costs three or four cache increments, which is small next to the
+gateway round trip. Async code uses acall(), which writes them in one
+worker thread hop instead of on the event loop. Counters reset if the cache
+is flushed.
+"""
+
+import bisect
+import logging
+import sys
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT = 'timeout'
+ERROR = 'error'
+
+BUCKETS = metrics.SECONDS_BUCKETS
+
+
+def _daraja_code(field):
+    def code(body):
+        # Error responses carry errorCode instead of the result field
+        return [body.get(field, body.get('errorCode'))]
+    return code
+
+
+def _pesapal_error(body):
+    return [(body.get('error') or {}).get('code')]
+
+
+def _pesapal_payment_status(body):
+    return [body.get('payment_status_description') or (body.get('error') or {}).get('code')]
+
+
+def _africastalking_recipients(body):
+    return [r.get('statusCode') for r in body.get('SMSMessageData', {}).get('Recipients', [])]
+
+
+# endpoint -> (service for request timings, result code extractor)
+ENDPOINTS = {
+    'mpesa_oauth': (metrics.DARAJA, _daraja_code('errorCode')),
+    'mpesa_stk_push': (metrics.DARAJA, _daraja_code('ResponseCode')),
+    'mpesa_stk_query': (metrics.DARAJA, _daraja_code('ResultCode')),
+    'pesapal_token': (metrics.PESAPAL, _pesapal_error),
+    'pesapal_register_ipn': (metrics.PESAPAL, _pesapal_error),
+    'pesapal_submit_order': (metrics.PESAPAL, _pesapal_error),
+    'pesapal_transaction_status': (metrics.PESAPAL, _pesapal_payment_status),
+    'africastalking_messaging': (metrics.AFRICAS_TALKING, _africastalking_recipients),
+}
+
+
+def _key(endpoint, field):
+    return f'gateway:{endpoint}:{field}'
+
+
+def _field_count_key(endpoint):
+    return _key(endpoint, 'fields')
+
+
+def _field_key(endpoint, slot):
+    return _key(endpoint, f'field:{slot}')
+
+
+def _incr(key, delta=1):
+    """Increment a counter that never expires; returns True if it was created"""
+    try:
+        cache.incr(key, delta)
+        return False
+    except ValueError:
+        if cache.add(key, delta, None):
+            return True
+        cache.incr(key, delta)
+        return False
+
+
+class GatewayCall:
+    """Outcome of one call; set ``response`` once the gateway answers"""
+
+    __slots__ = ('endpoint', 'retries', 'response', 'failure')
+
+    def __init__(self, endpoint, retries):
+        self.endpoint = endpoint
+        self.retries = retries
+        self.response = None
+        self.failure = None
+
+    def outcomes(self):
+        """(status, result codes) for the counters"""
+        if self.response is None:
+            return self.failure or ERROR, []
+        try:
+            body = self.response.json()
+        except ValueError:
+            return str(self.response.status_code), []
+        codes = ENDPOINTS[self.endpoint][1](body) if isinstance(body, dict) else []
+        return str(self.response.status_code), [str(code) for code in codes if code not in (None, '')]
+
+
+def _is_timeout(error):
+    # Only check the client libraries that are loaded; a call that raised
+    # has already imported its own
+    requests = sys.modules.get('requests')
+    httpx = sys.modules.get('httpx')
+    return (
+        (requests is not None and isinstance(error, requests.Timeout))
+        or (httpx is not None and isinstance(error, httpx.TimeoutException))
+    )
+
+
+@contextmanager
+def call(endpoint, retries=0):
+    """Time and count the enclosed gateway request.
+
+    ``retries`` is how many of the messages or payments in this request are
+    being sent again after a failed attempt.
+    """
+    gateway_call = GatewayCall(endpoint, retries)
+    start = time.perf_counter()
+    try:
+        with metrics.timed_outbound(ENDPOINTS[endpoint][0]):
+            yield gateway_call
+    except Exception as e:
+        gateway_call.failure = TIMEOUT if _is_timeout(e) else ERROR
+        raise
+    finally:
+        record(gateway_call, time.perf_counter() - start)
+
+
+@asynccontextmanager
+async def acall(endpoint, retries=0):
+    """``call`` for async code; the counters are written off the event loop"""
+    gateway_call = GatewayCall(endpoint, retries)
+    start = time.perf_counter()
+    try:
+        with metrics.timed_outbound(ENDPOINTS[endpoint][0]):
+            yield gateway_call
+    except Exception as e:
+        gateway_call.failure = TIMEOUT if _is_timeout(e) else ERROR
+        raise
+    finally:
+        await sync_to_async(record, thread_sensitive=False)(gateway_call, time.perf_counter() - start)
+
+
+def record(gateway_call, seconds):
+    endpoint = gateway_call.endpoint
+    try:
+        status, codes = gateway_call.outcomes()
+        _incr(_key(endpoint, f'bucket:{bisect.bisect_left(BUCKETS, seconds)}'))
+        _incr(_key(endpoint, 'sum_ms'), round(seconds * 1000))
+        new = []
+        if _incr(_key(endpoint, f'status:{status}')):
+            new.append(f'status:{status}')
+        for code in codes:
+            if _incr(_key(endpoint, f'result:{code}')):
+                new.append(f'result:{code}')
+        if gateway_call.retries:
+            _incr(_key(endpoint, 'retries'), gateway_call.retries)
+        for field in new:
+            # Statuses and result codes are open-ended; remember which exist so they
+            # can be read back. Each takes its own slot from an atomic counter, so
+            # workers adding fields at the same time cannot overwrite each other
+            slot = 1 if cache.add(_field_count_key(endpoint), 1, None) else cache.incr(_field_count_key(endpoint))
+            cache.set(_field_key(endpoint, slot), field, None)
+    except Exception as e:
+        # Telemetry must never fail a payment
+        logger.warning(f"Could not record {endpoint} gateway call: {e}")
+
+
+def _fields():
+    """``{endpoint: [status and result fields]}`` registered by record()"""
+    counts = cache.get_many([_field_count_key(endpoint) for endpoint in ENDPOINTS])
+    slots = {
+        _field_key(endpoint, slot): endpoint
+        for endpoint in ENDPOINTS
+        for slot in range(1, counts.get(_field_count_key(endpoint), 0) + 1)
+    }
+    fields = {endpoint: [] for endpoint in ENDPOINTS}
+    # A slot whose field is still being written is simply missing
+    for slot_key, field in cache.get_many(list(slots)).items():
+        fields[slots[slot_key]].append(field)
+    return fields
+
+
+def snapshot():
+    """Counters per endpoint, for endpoints that have been called"""
+    registered = _fields()
+
+    keys = {}
+    for endpoint in ENDPOINTS:
+        fields = [f'bucket:{i}' for i in range(len(BUCKETS) + 1)] + ['sum_ms', 'retries']
+        fields += registered[endpoint]
+        keys.update({_key(endpoint, field): (endpoint, field) for field in fields})
+    values = cache.get_many(keys)
+
+    stats = {}
+    for key, value in values.items():
+        endpoint, field = keys[key]
+        entry = stats.setdefault(endpoint, {
+            'buckets': [0] * (len(BUCKETS) + 1), 'sum_ms': 0, 'retries': 0, 'status': {}, 'result': {},
+        })
+        kind, _, name = field.partition(':')
+        if kind == 'bucket':
+            entry['buckets'][int(name)] = value
+        elif kind in ('status', 'result'):
+            entry[kind][name] = value
+        else:
+            entry[field] = value
+
+    for entry in stats.values():
+        entry['calls'] = sum(entry['buckets'])
+        entry['timeouts'] = entry['status'].get(TIMEOUT, 0)
+    return {endpoint: stats[endpoint] for endpoint in ENDPOINTS if endpoint in stats and stats[endpoint]['calls']}
+
+
+def quantile(buckets, q, bounds=BUCKETS):
+    """Estimate a quantile from bucket counts, interpolating within the bucket"""
+    total = sum(buckets)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for i, count in enumerate(buckets):
+        if seen + count >= rank and count:
+            if i == len(bounds):
+                # Above the largest bound; that bound is the best estimate
+                return bounds[-1]
+            lower = bounds[i - 1] if i else 0
+            return lower + (bounds[i] - lower) * (rank - seen) / count
+        seen += count
+    return bounds[-1]
+
+
+def reset():
+    registered = _fields()
+    counts = cache.get_many([_field_count_key(endpoint) for endpoint in ENDPOINTS])
+    keys = []
+    for endpoint in ENDPOINTS:
+        fields = [f'bucket:{i}' for i in range(len(BUCKETS) + 1)] + ['sum_ms', 'retries'] + registered[endpoint]
+        keys += [_key(endpoint, field) for field in fields]
+        keys += [_field_key(endpoint, slot) for slot in range(1, counts.get(_field_count_key(endpoint), 0) + 1)]
+        keys.append(_field_count_key(endpoint))
+    cache.delete_many(keys)
+
+
+def exposition(stats=None):
+    """The counters in the Prometheus text format"""
+    stats = snapshot() if stats is None else stats
+    lines = [
+        '# HELP ecoweb_gateway_duration_seconds Gateway request latency',
+        '# TYPE ecoweb_gateway_duration_seconds histogram',
+    ]
+    for endpoint, entry in stats.items():
+        cumulative = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), entry['buckets']):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(float(bound))
+            lines.append(f'ecoweb_gateway_duration_seconds_bucket{{endpoint="{endpoint}",le="{le}"}} {cumulative}')
+        lines.append(f'ecoweb_gateway_duration_seconds_sum{{endpoint="{endpoint}"}} {entry["sum_ms"] / 1000!r}')
+        lines.append(f'ecoweb_gateway_duration_seconds_count{{endpoint="{endpoint}"}} {cumulative}')
+
+    counters = [
+        ('ecoweb_gateway_responses_total', 'Gateway calls by HTTP status, or timeout/error', 'status', 'status'),
+        ('ecoweb_gateway_result_codes_total', 'Result codes returned by the gateway', 'result', 'code'),
+    ]
+    for name, help_text, kind, label in counters:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for endpoint, entry in stats.items():
+            for value, count in sorted(entry[kind].items()):
+                lines.append(f'{name}{{endpoint="{endpoint}",{label}="{metrics.escape_label(value)}"}} {count}')
+
+    lines += ['# HELP ecoweb_gateway_retries_total Messages or payments sent again', '# TYPE ecoweb_gateway_retries_total counter']
+    lines += [f'ecoweb_gateway_retries_total{{endpoint="{endpoint}"}} {entry["retries"]}' for endpoint, entry in stats.items()]
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,28 @@
+import asyncio
+import weakref
+
+from django.conf import settings
+
+from .lazy_imports import lazy_import
+
+httpx = lazy_import('httpx')
+
+# httpx clients are bound to the event loop they were first used on. Under
+# uvicorn there is one loop per process; under WSGI each async view gets its
+# own loop, so clients are kept per loop and dropped with it.
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """Pooled httpx.AsyncClient for the running event loop"""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=getattr(settings, 'HTTP_CLIENT_MAX_CONNECTIONS', 200),
+                max_keepalive_connections=getattr(settings, 'HTTP_CLIENT_MAX_KEEPALIVE', 50),
+            ),
+        )
+        _clients[loop] = client
+    return client
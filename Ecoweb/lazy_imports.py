@@ -0,0 +1,29 @@
+import importlib
+
+
+class LazyModule:
+    """Stand-in for a module that is imported on first attribute access.
+
+    For HTTP client libraries that would otherwise be imported by every
+    worker at boot, even though most requests never call a gateway.
+    importlib.import_module takes the import lock, so threads racing on the
+    first access all get the fully initialised module (unlike
+    importlib.util.LazyLoader before Python 3.12).
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        module = self._module
+        if module is None:
+            module = self._module = importlib.import_module(self._name)
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return f'<lazy module {self._name!r}>'
+
+
+def lazy_import(name):
+    return LazyModule(name)
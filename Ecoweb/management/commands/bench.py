@@ -0,0 +1,242 @@
+import json
+import platform
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import override_settings
+
+from Ecoweb.benchmarking import WSGIClient, compare, format_summary, summarize
+from Ecoweb.fake_gateway import FakeGateway, FakeGatewayConfig
+from Ecoweb.models import Item, MpesaTransaction
+from Ecoweb.wsgi import application
+
+USERNAME_PREFIX = 'bench_'
+
+# In flow order; the callback arrives from the gateway while status polls run
+STEPS = ('home', 'search', 'detail', 'add_to_cart', 'checkout_page', 'checkout', 'callback', 'status_poll')
+
+
+class FlowError(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the storefront and M-Pesa payment flows in-process through the WSGI app, '
+        'against the fake payment gateway, and compare with a stored baseline. SQLite serialises writes, '
+        'so run concurrent benchmarks against Postgres (DATABASE_URL)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=50, help='Number of customer flows to run (default: 50)')
+        parser.add_argument('--concurrency', type=int, default=5, help='Concurrent customers (default: 5)')
+        parser.add_argument('--warmup', type=int, default=3, help='Flows to run first and leave out of the results')
+        parser.add_argument('--latency', default='fixed:0', help='Gateway latency spec (see run_fake_gateway)')
+        parser.add_argument('--callback-delay', type=float, default=0.2, help='Seconds until the gateway calls back')
+        parser.add_argument('--poll-interval', type=float, default=0.5, help='Seconds between payment status polls')
+        parser.add_argument('--settle-timeout', type=float, default=30.0, help='Seconds to wait for a payment to settle')
+        parser.add_argument('--output', help='Results file (default: bench/results/<timestamp>.json)')
+        parser.add_argument('--baseline', default='bench/baseline.json', help='Baseline to compare against, if it exists')
+        parser.add_argument('--save-baseline', action='store_true', help='Also write the results as the new baseline')
+        parser.add_argument('--max-regression', type=float, help='Fail if any step p95 is this many percent slower')
+        parser.add_argument('--keep-data', action='store_true', help='Keep the benchmark users and orders')
+
+    def handle(self, *args, **options):
+        self.item = Item.objects.order_by('pk').first()
+        if self.item is None:
+            raise CommandError('Add at least one Item before running the benchmark')
+        self.search_term = self.item.title.split()[0]
+        self.options = options
+
+        self.lock = threading.Lock()
+        self.samples = {step: [] for step in STEPS}
+        self.errors = {step: 0 for step in STEPS}
+        self.flows = []
+        self.recording = False
+
+        config = FakeGatewayConfig(
+            latency=options['latency'],
+            callback_delay=options['callback_delay'],
+            callback_url='/mpesa/callback/',
+        )
+        users = self.create_customers(options['warmup'] + options['customers'])
+        warmup, measured = users[:options['warmup']], users[options['warmup']:]
+
+        try:
+            with FakeGateway(config=config, callback_sender=self.deliver_callback) as gateway:
+                with override_settings(MPESA_TEST_MODE=False, SECURE_SSL_REDIRECT=False, **gateway.settings()):
+                    self.run_flows(warmup, options['concurrency'])
+                    self.wait_for_settlement(warmup)
+                    self.recording = True
+                    elapsed = self.run_flows(measured, options['concurrency'])
+                    self.wait_for_settlement(measured)
+        finally:
+            if not options['keep_data']:
+                get_user_model().objects.filter(pk__in=[u.pk for u in users]).delete()
+
+        results = self.results(elapsed)
+        for step, summary in results['steps'].items():
+            self.stdout.write(format_summary(step, summary))
+        self.stdout.write(format_summary('flow', results['flow']))
+        if any(results['errors'].values()):
+            self.stdout.write(self.style.WARNING(f"errors: {results['errors']}"))
+
+        output = Path(options['output'] or f"bench/results/{datetime.now():%Y%m%d-%H%M%S}.json")
+        self.write(output, results)
+        self.stdout.write(f'Results written to {output}')
+
+        baseline_path = Path(options['baseline'])
+        regressions = []
+        if baseline_path.exists():
+            regressions = self.report_comparison(json.loads(baseline_path.read_text()), results)
+        if options['save_baseline']:
+            self.write(baseline_path, results)
+            self.stdout.write(f'Baseline written to {baseline_path}')
+        if regressions:
+            raise CommandError(f"p95 regressed by more than {options['max_regression']}%: {', '.join(regressions)}")
+
+    def create_customers(self, count):
+        User = get_user_model()
+        User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+        return [User.objects.create_user(f'{USERNAME_PREFIX}{n}', password=None) for n in range(count)]
+
+    def run_flows(self, users, concurrency):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(self.flow, users))
+        return time.perf_counter() - start
+
+    def flow(self, user):
+        # Log in outside the measured steps; the login page is not part of the flow
+        login = Client()
+        login.force_login(user)
+        client = WSGIClient(application)
+        client.cookies[settings.SESSION_COOKIE_NAME] = login.cookies[settings.SESSION_COOKIE_NAME].value
+
+        start = time.perf_counter()
+        try:
+            self.step('home', 200, client.get, '/')
+            self.step('search', 200, client.get, f'/search/?query={self.search_term}')
+            self.step('detail', 200, client.get, f'/product/{self.item.slug}/')
+            self.step('add_to_cart', 302, client.get, f'/add-to-cart/{self.item.slug}/')
+            self.step('checkout_page', 200, client.get, '/checkout/')
+            response = self.step('checkout', 200, client.post, '/checkout/', {
+                'first_name': 'Bench',
+                'last_name': 'Customer',
+                'email': f'{user.username}@example.com',
+                'phone': '0712345678',
+                'address': 'Kimathi street',
+                'city': 'Nairobi',
+                'payment_method': 'mpesa',
+                'mpesa_phone': '0712345678',
+            }, accept='application/json', origin=f'https://{client.host}', x_csrftoken=client.cookies.get('csrftoken', ''))
+            body = response.json()
+            if body.get('status') != 'success':
+                self.fail('checkout')
+            self.poll(client, body['checkout_request_id'])
+        except FlowError:
+            return
+        finally:
+            connections.close_all()
+        if self.recording:
+            with self.lock:
+                self.flows.append(time.perf_counter() - start)
+
+    def step(self, name, expected_status, send, *args, **headers):
+        start = time.perf_counter()
+        try:
+            response = send(*args, **headers)
+        except Exception as e:
+            self.stderr.write(f'{name}: {e}')
+            self.fail(name)
+        duration = time.perf_counter() - start
+        if response.status_code != expected_status:
+            self.fail(name)
+        if self.recording:
+            with self.lock:
+                self.samples[name].append(duration)
+        return response
+
+    def fail(self, name):
+        if self.recording:
+            with self.lock:
+                self.errors[name] += 1
+        raise FlowError(name)
+
+    def poll(self, client, checkout_request_id):
+        """Poll like the payment waiting page does, until the payment settles"""
+        deadline = time.monotonic() + self.options['settle_timeout']
+        while True:
+            response = self.step('status_poll', 200, client.get, f'/check-payment-status/{checkout_request_id}/')
+            if response.json().get('status') != 'pending':
+                return
+            if time.monotonic() > deadline:
+                self.fail('status_poll')
+            time.sleep(self.options['poll_interval'])
+
+    def deliver_callback(self, method, url, body):
+        # Callbacks arrive on the gateway's timer threads
+        try:
+            if method == 'POST':
+                self.step('callback', 200, WSGIClient(application).post, url, json.dumps(body), 'application/json')
+            else:
+                self.step('callback', 200, WSGIClient(application).get, url)
+        except FlowError:
+            pass
+        finally:
+            connections.close_all()
+
+    def wait_for_settlement(self, users):
+        deadline = time.monotonic() + self.options['settle_timeout']
+        pending = MpesaTransaction.objects.filter(order__user__in=users, status='PENDING')
+        while pending.exists() and time.monotonic() < deadline:
+            time.sleep(0.2)
+
+    def results(self, elapsed):
+        options = self.options
+        return {
+            'meta': {
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'release': getattr(settings, 'RELEASE', ''),
+                'customers': options['customers'],
+                'concurrency': options['concurrency'],
+                'latency': options['latency'],
+                'callback_delay': options['callback_delay'],
+                'python': platform.python_version(),
+                'database': connection.vendor,
+            },
+            'steps': {step: summarize(samples, elapsed) for step, samples in self.samples.items() if samples},
+            'flow': summarize(self.flows, elapsed),
+            'errors': self.errors,
+        }
+
+    def write(self, path, results):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(results, indent=2) + '\n')
+
+    def report_comparison(self, baseline, results):
+        """Print the change against the baseline; returns the steps over --max-regression"""
+        self.stdout.write(f"\nAgainst baseline from {baseline.get('meta', {}).get('created', '?')} (+ is slower):")
+        differences = [
+            key for key in ('customers', 'concurrency', 'latency', 'callback_delay', 'database')
+            if baseline.get('meta', {}).get(key) != results['meta'][key]
+        ]
+        if differences:
+            self.stdout.write(self.style.WARNING(f"The baseline was run with different {', '.join(differences)}"))
+        regressions = []
+        limit = self.options['max_regression']
+        for step, metric, before, after, change in compare(baseline, results):
+            line = f'{step:<14} {metric:<10} {before:>10.1f} -> {after:>10.1f}  {change:+6.1f}%'
+            regressed = limit is not None and metric == 'p95_ms' and change > limit
+            self.stdout.write(self.style.ERROR(line) if regressed else line)
+            if regressed:
+                regressions.append(step)
+        return regressions
@@ -0,0 +1,166 @@
+import contextlib
+import io
+import socketserver
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.mail import send_mail
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.test.utils import override_settings
+
+from Ecoweb.benchmarking import summarize
+from Ecoweb.emails import HTML_TEMPLATES, get_template, order_context, send_emails
+from Ecoweb.models import Item, Notification, Order, OrderItem
+
+BACKENDS = {
+    'locmem': 'django.core.mail.backends.locmem.EmailBackend',
+    'console': 'django.core.mail.backends.console.EmailBackend',
+}
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    """Minimal SMTP server that accepts and discards mail, with a delay per reply"""
+
+    def reply(self, line):
+        time.sleep(self.server.delay)
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        self.reply('220 sink ESMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors='replace').strip().upper()
+            if command.startswith('EHLO'):
+                self.reply('250 sink')
+            elif command.startswith('DATA'):
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b'.\n', b''):
+                    pass
+                self.reply('250 OK queued')
+            elif command.startswith('QUIT'):
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, delay):
+        super().__init__(('127.0.0.1', 0), SMTPSinkHandler)
+        self.delay = delay
+
+
+class Command(BaseCommand):
+    help = 'Compare order confirmation email throughput: one connection per message vs a pooled batch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=500, help='Messages per run (default: 500)')
+        parser.add_argument('--items', type=int, default=3, help='Line items in the benchmark order (default: 3)')
+        parser.add_argument(
+            '--backend', choices=[*BACKENDS, 'smtp-sink', 'configured'], default='locmem',
+            help='Email backend: locmem, console, a local SMTP sink, or EMAIL_BACKEND as configured (default: locmem)'
+        )
+        parser.add_argument(
+            '--smtp-latency', type=float, default=20.0,
+            help='Milliseconds the SMTP sink waits before each reply, standing in for network round trips (default: 20)'
+        )
+
+    def handle(self, *args, **options):
+        item = Item.objects.first()
+        if item is None:
+            raise CommandError('Add at least one Item before running the benchmark')
+
+        email_settings = {}
+        sink = None
+        if options['backend'] == 'configured':
+            email_settings['EMAIL_BACKEND'] = settings.EMAIL_BACKEND
+        elif options['backend'] == 'smtp-sink':
+            sink = SMTPSink(options['smtp_latency'] / 1000)
+            threading.Thread(target=sink.serve_forever, daemon=True).start()
+            email_settings.update(
+                EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                EMAIL_HOST='127.0.0.1', EMAIL_PORT=sink.server_address[1],
+                EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='', EMAIL_USE_TLS=False, EMAIL_USE_SSL=False,
+            )
+        else:
+            email_settings['EMAIL_BACKEND'] = BACKENDS[options['backend']]
+        self.stdout.write(f"Sending {options['messages']} messages through {email_settings['EMAIL_BACKEND']}")
+
+        try:
+            per_message, pooled = self.run_benchmark(item, options, email_settings)
+        finally:
+            if sink:
+                sink.shutdown()
+                sink.server_close()
+
+        self.report('send_mail per message', per_message)
+        self.report('pooled connection', pooled)
+        if per_message['throughput']:
+            self.stdout.write(f"Speed-up: {pooled['throughput'] / per_message['throughput']:.1f}x")
+
+    def run_benchmark(self, item, options, email_settings):
+        # The benchmark order is rolled back afterwards
+        with transaction.atomic(), override_settings(**email_settings):
+            order = self.create_order(item, options['items'])
+            notifications = [
+                Notification(
+                    pk=n, order=order, template='order_confirmation_email', channel='email',
+                    recipient=f'benchmark{n}@example.com', subject=f'Order Confirmation #{order.id}',
+                    body='Thank you for your order!'
+                )
+                for n in range(1, options['messages'] + 1)
+            ]
+            # Console output would swamp the report
+            with contextlib.redirect_stdout(io.StringIO()):
+                per_message = self.run_per_message(notifications)
+                get_template.cache_clear()
+                pooled = self.run_pooled(notifications)
+            transaction.set_rollback(True)
+        return per_message, pooled
+
+    def create_order(self, item, item_count):
+        user = get_user_model().objects.create_user('benchmark_email', password=None)
+        order = Order.objects.create(user=user, first_name='Benchmark', payment_method='M-Pesa')
+        order.items.add(*[
+            OrderItem.objects.create(user=user, item=item, quantity=n + 1) for n in range(item_count)
+        ])
+        return order
+
+    def run_per_message(self, notifications):
+        """What the confirmation API used to do: render and open a connection for every message"""
+        latencies = []
+        start = time.perf_counter()
+        for notification in notifications:
+            began = time.perf_counter()
+            html = render_to_string(HTML_TEMPLATES[notification.template], order_context(notification.order))
+            send_mail(
+                notification.subject, notification.body, settings.DEFAULT_FROM_EMAIL,
+                [notification.recipient], fail_silently=False, html_message=html
+            )
+            latencies.append(time.perf_counter() - began)
+        return summarize(latencies, time.perf_counter() - start)
+
+    def run_pooled(self, notifications):
+        start = time.perf_counter()
+        results = send_emails(notifications)
+        elapsed = time.perf_counter() - start
+        failed = sum(1 for error in results.values() if error)
+        if failed:
+            raise CommandError(f'{failed} messages failed in the pooled run')
+        # send_emails works on the batch, so spread its time evenly over the messages
+        return summarize([elapsed / len(notifications)] * len(notifications), elapsed)
+
+    def report(self, name, summary):
+        self.stdout.write(
+            f"{name}: {summary['count']} messages, {summary['throughput']:.1f} msg/s, "
+            f"p50 {summary['p50_ms']:.2f} ms, p99 {summary['p99_ms']:.2f} ms"
+        )
@@ -0,0 +1,69 @@
+import random
+import re
+import time
+
+from django.core.management.base import BaseCommand
+
+from Ecoweb.phone import normalize_phone, normalize_phone_or_none, normalize_phones
+
+
+def legacy_format_phone_number(phone):
+    """The per-service normalizer this module replaced, kept as the baseline"""
+    phone = re.sub(r'\D', '', phone)
+    if phone.startswith('0'):
+        if not (phone.startswith('07') or phone.startswith('01')):
+            raise ValueError("Phone number must start with 07 or 01")
+        phone = '254' + phone[1:]
+    elif phone.startswith('254'):
+        if not (phone.startswith('2547') or phone.startswith('2541')):
+            raise ValueError("Phone number must be a valid Kenyan mobile number (7... or 1...)")
+    elif phone.startswith('7') or phone.startswith('1'):
+        phone = '254' + phone
+    else:
+        raise ValueError("Phone number must start with 07, 01 or 254")
+    if len(phone) != 12:
+        raise ValueError("Invalid phone number length. Expected 10 digits (07...) or 12 digits (254...)")
+    return phone
+
+
+def legacy_or_none(phone):
+    try:
+        return legacy_format_phone_number(phone)
+    except ValueError:
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Micro-benchmark the phone normalizer: legacy per-call regex vs memoized and bulk paths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--numbers', type=int, default=100000, help='Numbers per run (default: 100000)')
+        parser.add_argument('--distinct', type=int, default=500, help='Distinct numbers in the repeated workload (default: 500)')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed (default: 1)')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        formats = ['07{}', '+2547{}', '2541{}', '7{}', '0{} ', '07-{}', '02{}']
+
+        def number():
+            digits = ''.join(rng.choice('0123456789') for _ in range(8))
+            return rng.choice(formats).format(digits)
+
+        # Unique numbers, like a customer import or SMS blast
+        unique = [number() for _ in range(options['numbers'])]
+        # A small working set seen over and over, like checkout and callbacks
+        working_set = [number() for _ in range(options['distinct'])]
+        repeated = [rng.choice(working_set) for _ in range(options['numbers'])]
+
+        for name, numbers in [('unique numbers', unique), ('repeated numbers', repeated)]:
+            self.stdout.write(f'{name} ({len(numbers)}):')
+            normalize_phone.cache_clear()
+            self.measure('legacy', lambda: [legacy_or_none(p) for p in numbers], len(numbers))
+            self.measure('normalize_phone', lambda: [normalize_phone_or_none(p) for p in numbers], len(numbers))
+            self.measure('normalize_phones', lambda: [n for _, n in normalize_phones(numbers)], len(numbers))
+
+    def measure(self, name, run, count):
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f'  {name:<18} {count / elapsed:>12,.0f} numbers/s  ({elapsed * 1e9 / count:,.0f} ns each)')
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from Ecoweb.assets import build_all, static_root
+
+
+class Command(BaseCommand):
+    help = 'Bundle and minify per-page CSS/JS and subset icon fonts into static/dist (run before collectstatic)'
+
+    def handle(self, *args, **options):
+        root = static_root()
+        for path in build_all(root):
+            self.stdout.write(f'  {path.relative_to(root)}  {path.stat().st_size / 1024:.1f} KB')
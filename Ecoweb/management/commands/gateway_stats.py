@@ -0,0 +1,44 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from Ecoweb import gateway_metrics
+
+
+class Command(BaseCommand):
+    help = (
+        'Latency, status codes, result codes, timeouts and retries per payment/SMS gateway endpoint, '
+        'across all workers sharing the cache'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help='Print the raw counters as JSON')
+        parser.add_argument('--reset', action='store_true', help='Clear the counters after printing them')
+
+    def handle(self, *args, **options):
+        stats = gateway_metrics.snapshot()
+
+        if options['json']:
+            self.stdout.write(json.dumps(stats, indent=2, sort_keys=True))
+        elif not stats:
+            self.stdout.write('No gateway calls recorded (counters are kept in the cache; with LocMemCache each process has its own)')
+        else:
+            self.stdout.write(
+                f"{'endpoint':<28} {'calls':>7} {'avg ms':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+                f"{'timeouts':>8} {'retries':>7}"
+            )
+            for endpoint, entry in stats.items():
+                p50, p95, p99 = (gateway_metrics.quantile(entry['buckets'], q) * 1000 for q in (0.5, 0.95, 0.99))
+                self.stdout.write(
+                    f"{endpoint:<28} {entry['calls']:>7} {entry['sum_ms'] / entry['calls']:>8.0f} "
+                    f"{p50:>8.0f} {p95:>8.0f} {p99:>8.0f} {entry['timeouts']:>8} {entry['retries']:>7}"
+                )
+            for endpoint, entry in stats.items():
+                self.stdout.write(f'\n{endpoint}')
+                self.stdout.write('  status:  ' + ', '.join(f'{k}={v}' for k, v in sorted(entry['status'].items())))
+                if entry['result']:
+                    self.stdout.write('  results: ' + ', '.join(f'{k}={v}' for k, v in sorted(entry['result'].items())))
+
+        if options['reset']:
+            gateway_metrics.reset()
+            self.stdout.write('Counters cleared')
@@ -0,0 +1,45 @@
+import re
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from Ecoweb.fragment_cache import bump_catalog_version
+from Ecoweb.models import Item
+from Ecoweb.storage import is_hashed_name
+
+# The random suffix FileSystemStorage added to clashing names: item-13_gJhr8gg.jpg
+RANDOM_SUFFIX_RE = re.compile(r'_[a-zA-Z0-9]{7}(?=\.[^./]+$)')
+
+
+class Command(BaseCommand):
+    help = 'Re-save item photos uploaded before HashedMediaStorage under content-hashed names'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only list the photos that would be renamed')
+
+    def handle(self, *args, **options):
+        renamed = 0
+        for item in Item.objects.exclude(photo='').only('pk', 'photo').order_by('pk'):
+            old_name = item.photo.name
+            if is_hashed_name(old_name):
+                continue
+            if not default_storage.exists(old_name):
+                self.stderr.write(f'  item #{item.pk}: {old_name} is missing, skipped')
+                continue
+            if options['dry_run']:
+                self.stdout.write(f'  item #{item.pk}: {old_name}')
+                renamed += 1
+                continue
+            with default_storage.open(old_name) as f:
+                new_name = default_storage.save(RANDOM_SUFFIX_RE.sub('', old_name), f)
+            # The old file is kept for pages and caches that still link to it
+            Item.objects.filter(pk=item.pk).update(photo=new_name)
+            self.stdout.write(f'  item #{item.pk}: {old_name} -> {new_name}')
+            renamed += 1
+
+        if renamed and not options['dry_run']:
+            # QuerySet.update() sends no signals; cached product grids still link the old names
+            bump_catalog_version()
+
+        verb = 'Would rename' if options['dry_run'] else 'Renamed'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {renamed} photo(s)'))
@@ -0,0 +1,116 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.test.utils import override_settings
+
+from Ecoweb.benchmarking import format_summary, summarize
+from Ecoweb.fake_gateway import FakeGateway, FakeGatewayConfig
+from Ecoweb.models import Item, MpesaTransaction, Order, OrderItem
+
+USERNAME_PREFIX = 'loadtest_'
+
+
+class Command(BaseCommand):
+    help = 'Load-test M-Pesa checkout in-process against the fake payment gateway'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--checkouts', type=int, default=100, help='Number of checkouts to run (default: 100)')
+        parser.add_argument('--concurrency', type=int, default=10, help='Concurrent customers (default: 10)')
+        parser.add_argument('--latency', default='lognormal:0.3:0.5', help='Gateway latency spec (see run_fake_gateway)')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of gateway calls that fail with 503')
+        parser.add_argument('--callback-delay', type=float, default=1.0, help='Seconds until the gateway calls back')
+        parser.add_argument('--success-rate', type=float, default=1.0, help='Fraction of payments that succeed')
+        parser.add_argument('--settle-timeout', type=float, default=30.0, help='Seconds to wait for callbacks afterwards')
+        parser.add_argument('--keep-data', action='store_true', help='Keep the load-test users and orders')
+
+    def handle(self, *args, **options):
+        item = Item.objects.first()
+        if item is None:
+            raise CommandError('Add at least one Item before running the load test')
+
+        self.client_lock = threading.Lock()
+        self.callback_client = Client()
+        config = FakeGatewayConfig(
+            latency=options['latency'],
+            error_rate=options['error_rate'],
+            callback_delay=options['callback_delay'],
+            success_rate=options['success_rate'],
+            callback_url='/mpesa/callback/',
+        )
+        users = self.create_customers(options['checkouts'], item)
+
+        try:
+            with FakeGateway(config=config, callback_sender=self.deliver_callback) as gateway:
+                with override_settings(MPESA_TEST_MODE=False, SECURE_SSL_REDIRECT=False, **gateway.settings()):
+                    latencies, errors, elapsed = self.run_checkouts(users, options['concurrency'])
+                    settled = self.wait_for_settlement(users, options['settle_timeout'])
+        finally:
+            if not options['keep_data']:
+                get_user_model().objects.filter(pk__in=[u.pk for u in users]).delete()
+
+        summary = summarize(latencies, elapsed)
+        self.stdout.write(format_summary('checkout', summary))
+        self.stdout.write(f'errors: {errors}, settled by callback: {settled}/{len(latencies)}')
+
+    def create_customers(self, count, item):
+        User = get_user_model()
+        User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+        users = []
+        for n in range(count):
+            user = User.objects.create_user(f'{USERNAME_PREFIX}{n}', password=None)
+            order = Order.objects.create(user=user)
+            order.items.add(OrderItem.objects.create(user=user, item=item))
+            users.append(user)
+        return users
+
+    def checkout(self, user):
+        client = Client()
+        client.force_login(user)
+        start = time.perf_counter()
+        try:
+            response = client.post('/checkout/', {
+                'first_name': 'Load',
+                'last_name': 'Test',
+                'email': f'{user.username}@example.com',
+                'phone': '0712345678',
+                'address': 'Kimathi street',
+                'city': 'Nairobi',
+                'payment_method': 'mpesa',
+                'mpesa_phone': '0712345678',
+            }, HTTP_ACCEPT='application/json')
+            ok = response.status_code == 200 and response.json().get('status') == 'success'
+        except Exception:
+            ok = False
+        finally:
+            connections.close_all()
+        return time.perf_counter() - start, ok
+
+    def run_checkouts(self, users, concurrency):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(self.checkout, users))
+        elapsed = time.perf_counter() - start
+        latencies = [duration for duration, ok in results if ok]
+        errors = sum(1 for _, ok in results if not ok)
+        return latencies, errors, elapsed
+
+    def deliver_callback(self, method, url, body):
+        # The test client is not thread-safe, and callbacks arrive on timer threads
+        with self.client_lock:
+            if method == 'POST':
+                self.callback_client.post(url, data=body, content_type='application/json')
+            else:
+                self.callback_client.get(url)
+        connections.close_all()
+
+    def wait_for_settlement(self, users, timeout):
+        deadline = time.monotonic() + timeout
+        pending = MpesaTransaction.objects.filter(order__user__in=users, status='PENDING')
+        while pending.exists() and time.monotonic() < deadline:
+            time.sleep(0.5)
+        return MpesaTransaction.objects.filter(order__user__in=users).exclude(status='PENDING').count()
@@ -0,0 +1,120 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from Ecoweb.fulfilment import fail_orders, fulfil_orders
+from Ecoweb.models import Order
+from Ecoweb.pesapal_service import PesapalService
+from Ecoweb.rate_limit import RateLimiter
+
+
+class Command(BaseCommand):
+    help = 'Query Pesapal for pending orders whose IPN never arrived and settle them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent status lookups (default: 8)')
+        parser.add_argument('--rate', type=float, default=10.0, help='Maximum Pesapal requests per second (default: 10)')
+        parser.add_argument('--chunk-size', type=int, default=200, help='Orders fetched and applied per batch (default: 200)')
+        parser.add_argument('--older-than', type=int, default=15, help='Only orders started at least this many minutes ago (default: 15)')
+        parser.add_argument(
+            '--checkpoint-file',
+            default=os.path.join(settings.BASE_DIR, '.reconcile_pesapal_checkpoint.json'),
+            help='Where progress is saved so an interrupted run can resume'
+        )
+        parser.add_argument('--reset', action='store_true', help='Ignore the checkpoint and start from the first order')
+
+    def handle(self, *args, **options):
+        checkpoint_file = options['checkpoint_file']
+        last_id = 0 if options['reset'] else self.load_checkpoint(checkpoint_file)
+        if last_id:
+            self.stdout.write(f'Resuming after order #{last_id}')
+
+        self.pesapal = PesapalService()
+        self.limiter = RateLimiter(options['rate'])
+        cutoff = timezone.now() - timedelta(minutes=options['older_than'])
+
+        pending = (
+            Order.objects
+            .filter(payment_status='PENDING', pesapal_tracking_id__isnull=False, start_date__lte=cutoff, pk__gt=last_id)
+            .exclude(pesapal_tracking_id='')
+            .order_by('pk')
+            .values_list('pk', 'pesapal_tracking_id')
+        )
+
+        totals = {'checked': 0, 'completed': 0, 'failed': 0, 'errors': 0}
+        started = time.monotonic()
+        chunk = []
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            for row in pending.iterator(chunk_size=options['chunk_size']):
+                chunk.append(row)
+                if len(chunk) >= options['chunk_size']:
+                    self.process_chunk(pool, chunk, totals, checkpoint_file)
+                    chunk = []
+            if chunk:
+                self.process_chunk(pool, chunk, totals, checkpoint_file)
+
+        # A finished pass starts from the beginning next time
+        if os.path.exists(checkpoint_file):
+            os.remove(checkpoint_file)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {totals['checked']} orders in {elapsed:.1f}s: {totals['completed']} completed, "
+            f"{totals['failed']} failed, {totals['errors']} lookups failed"
+        ))
+
+    def lookup(self, order_tracking_id):
+        self.limiter.acquire()
+        try:
+            token = self.pesapal.get_access_token()
+            if not token:
+                return None
+            return self.pesapal.get_transaction_status(order_tracking_id, token)
+        except requests.RequestException:
+            return None
+        except ValueError as e:
+            # A 200 without a JSON body (a gateway error page); skip the order this pass
+            self.stderr.write(f'{order_tracking_id}: unreadable Pesapal response: {e}')
+            return None
+
+    def process_chunk(self, pool, chunk, totals, checkpoint_file):
+        order_ids = [pk for pk, _ in chunk]
+        results = pool.map(self.lookup, [tracking_id for _, tracking_id in chunk])
+
+        completed, failed = [], []
+        for order_id, status_response in zip(order_ids, results):
+            if status_response is None:
+                totals['errors'] += 1
+                continue
+            payment_status = status_response.get('payment_status_description', '').upper()
+            if payment_status == 'COMPLETED':
+                completed.append(order_id)
+            elif payment_status in ['FAILED', 'INVALID']:
+                failed.append(order_id)
+
+        totals['checked'] += len(chunk)
+        totals['completed'] += len(fulfil_orders(completed)) if completed else 0
+        totals['failed'] += fail_orders(failed) if failed else 0
+
+        self.save_checkpoint(checkpoint_file, order_ids[-1])
+        self.stdout.write(f"Processed up to order #{order_ids[-1]} ({totals['checked']} checked)")
+
+    def load_checkpoint(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f).get('last_order_id', 0)
+        except (OSError, ValueError):
+            return 0
+
+    def save_checkpoint(self, path, last_order_id):
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'last_order_id': last_order_id, 'saved_at': timezone.now().isoformat()}, f)
+        os.replace(tmp_path, path)
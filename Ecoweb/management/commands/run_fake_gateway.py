@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+
+from Ecoweb.fake_gateway import FakeGateway, FakeGatewayConfig
+
+
+class Command(BaseCommand):
+    help = 'Run a local stand-in for the Daraja and Pesapal APIs with latency and fault injection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='Interface to bind (default: 127.0.0.1)')
+        parser.add_argument('--port', type=int, default=8900, help='Port to listen on (default: 8900)')
+        parser.add_argument(
+            '--latency',
+            default='fixed:0',
+            help='Response latency in seconds: fixed:S, uniform:LOW:HIGH, normal:MEAN:SD or lognormal:MEDIAN:SIGMA'
+        )
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of calls answered with HTTP 503')
+        parser.add_argument('--timeout-rate', type=float, default=0.0, help='Fraction of calls that hang for --timeout-delay')
+        parser.add_argument('--timeout-delay', type=float, default=35.0, help='Seconds a hanging call waits (default: 35)')
+        parser.add_argument('--callback-delay', type=float, default=3.0, help='Seconds until a payment settles (default: 3)')
+        parser.add_argument('--success-rate', type=float, default=1.0, help='Fraction of payments that succeed')
+        parser.add_argument('--callback-url', help='Send M-Pesa callbacks here instead of the CallBackURL in each push')
+        parser.add_argument('--no-callbacks', action='store_true', help='Settle payments without calling back')
+
+    def handle(self, *args, **options):
+        config = FakeGatewayConfig(
+            latency=options['latency'],
+            error_rate=options['error_rate'],
+            timeout_rate=options['timeout_rate'],
+            timeout_delay=options['timeout_delay'],
+            callback_delay=options['callback_delay'],
+            success_rate=options['success_rate'],
+            callback_url=options['callback_url'],
+            fire_callbacks=not options['no_callbacks'],
+        )
+        gateway = FakeGateway(host=options['host'], port=options['port'], config=config)
+
+        self.stdout.write(self.style.SUCCESS(f'Fake payment gateway listening on {gateway.url}'))
+        self.stdout.write(
+            f'Start the app with MPESA_BASE_URL={gateway.url} PESAPAL_BASE_URL={gateway.url} '
+            f'AFRICAS_TALKING_BASE_URL={gateway.url}'
+        )
+        try:
+            gateway.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write('\nShutting down...')
+        finally:
+            gateway.server.server_close()
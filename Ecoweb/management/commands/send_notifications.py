@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from Ecoweb.notifications import MAX_ATTEMPTS, deliver_pending
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued SMS and email notifications from the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Notifications claimed per batch (default: 1000)')
+        parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS, help=f'Attempts before giving up (default: {MAX_ATTEMPTS})')
+        parser.add_argument('--loop', action='store_true', help='Keep polling the outbox instead of exiting when it is empty')
+        parser.add_argument('--interval', type=float, default=2.0, help='Seconds between polls in --loop mode (default: 2)')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = deliver_pending(options['batch_size'], options['max_attempts'])
+            if sent or failed:
+                self.stdout.write(f'Sent {sent}, failed {failed}')
+
+            # Drain a backlog without sleeping between full batches
+            if sent + failed >= options['batch_size']:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
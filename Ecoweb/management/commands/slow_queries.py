@@ -0,0 +1,48 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from Ecoweb import slow_queries
+
+ORDERS = ('total_ms', 'max_ms', 'avg_ms', 'count')
+
+
+class Command(BaseCommand):
+    help = 'The slowest query shapes seen by all workers sharing the cache, with their EXPLAIN plans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=10, help='How many shapes to show (default: 10)')
+        parser.add_argument('--order', choices=ORDERS, default='total_ms', help='Sort by (default: total_ms)')
+        parser.add_argument('--no-plans', action='store_true', help='Leave out the query plans')
+        parser.add_argument('--json', action='store_true', help='Print the entries as JSON')
+        parser.add_argument('--reset', action='store_true', help='Clear the log after printing it')
+
+    def handle(self, *args, **options):
+        entries = slow_queries.top(options['limit'], options['order'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(entries, indent=2))
+        elif not entries:
+            self.stdout.write('No slow queries recorded (the log is kept in the cache; with LocMemCache each process has its own)')
+        else:
+            self.print_entries(entries, plans=not options['no_plans'])
+
+        if options['reset']:
+            slow_queries.reset()
+            self.stdout.write('Slow-query log cleared')
+
+    def print_entries(self, entries, plans):
+        for rank, entry in enumerate(entries, 1):
+            detail, last = entry['detail'], entry['last'] or {}
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"#{rank} {entry['fingerprint']}: {entry['count']} x, total {entry['total_ms']} ms, "
+                f"avg {entry['avg_ms']:.0f} ms, max {entry['max_ms']} ms"
+            ))
+            self.stdout.write(f"  first seen in {detail['view']} at {detail['frame']}")
+            if last:
+                self.stdout.write(f"  last seen {last['at']} in {last['view']} at {last['frame']}")
+            self.stdout.write(f"  {detail['shape']}")
+            if plans:
+                plan = detail['plan'] or '(no plan captured)'
+                self.stdout.write('\n'.join(f'    {line}' for line in plan.splitlines()))
+            self.stdout.write('')
@@ -0,0 +1,146 @@
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter so nothing is already imported. Loads the
+# application the way gunicorn does, then sends it one request.
+BOOT_SCRIPT = r'''
+import importlib, io, json, sys, time
+start = time.perf_counter()
+target, mode, path = sys.argv[1:4]
+module, attr = target.rsplit('.', 1)
+application = getattr(importlib.import_module(module), attr)
+loaded = time.perf_counter()
+sys.stderr.write('startup_profile: first request\n')
+sys.stderr.flush()
+
+if mode == 'asgi':
+    import asyncio
+    result = {}
+    messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            result['status'] = message['status']
+
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'https', 'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+        'headers': [(b'host', b'localhost'), (b'x-forwarded-proto', b'https')],
+        'client': ('127.0.0.1', 0), 'server': ('localhost', 443),
+    }
+    asyncio.run(application(scope, receive, send))
+    status = result.get('status')
+else:
+    result = {}
+
+    def start_response(status, headers, exc_info=None):
+        result['status'] = int(status.split()[0])
+
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '', 'SCRIPT_NAME': '',
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '443', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'localhost', 'HTTP_X_FORWARDED_PROTO': 'https', 'REMOTE_ADDR': '127.0.0.1',
+        'wsgi.version': (1, 0), 'wsgi.url_scheme': 'https', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True, 'wsgi.multiprocess': True, 'wsgi.run_once': False,
+    }
+    body = application(environ, start_response)
+    for _ in body:
+        pass
+    if hasattr(body, 'close'):
+        body.close()
+    status = result.get('status')
+
+done = time.perf_counter()
+print(json.dumps({'boot': loaded - start, 'first_request': done - loaded, 'status': status}))
+'''
+
+FIRST_REQUEST_MARKER = 'startup_profile: first request'
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$')
+
+
+def parse_importtime(lines):
+    """(module, self_us, cumulative_us, depth) for each ``-X importtime`` line"""
+    imports = []
+    for line in lines:
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            imports.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return imports
+
+
+class Command(BaseCommand):
+    help = 'Profile worker boot: per-module import time (python -X importtime) and time to first request'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/health/', help='Path of the first request (default: /health/)')
+        parser.add_argument('--asgi', action='store_true', help='Boot Ecoweb.asgi instead of the WSGI application')
+        parser.add_argument('--runs', type=int, default=3, help='Cold boots to time (default: 3)')
+        parser.add_argument('--top', type=int, default=20, help='Rows in the package and module tables (default: 20)')
+        parser.add_argument('--output', help='Also write the raw -X importtime log of the last run here')
+
+    def handle(self, *args, **options):
+        target = 'Ecoweb.asgi.application' if options['asgi'] else settings.WSGI_APPLICATION
+        mode = 'asgi' if options['asgi'] else 'wsgi'
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'Ecoweb.settings'))
+
+        timings = []
+        for _ in range(max(1, options['runs'])):
+            proc = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', BOOT_SCRIPT, target, mode, options['path']],
+                cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+            )
+            if proc.returncode != 0:
+                raise CommandError(f'Boot failed:\n{proc.stderr[-2000:]}')
+            timings.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+            log = proc.stderr
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(log)
+
+        lines = log.splitlines()
+        split = lines.index(FIRST_REQUEST_MARKER) if FIRST_REQUEST_MARKER in lines else len(lines)
+        boot_imports = parse_importtime(lines[:split])
+        request_imports = parse_importtime(lines[split:])
+
+        boot = [t['boot'] * 1000 for t in timings]
+        first_request = [t['first_request'] * 1000 for t in timings]
+        self.stdout.write(f'Boot ({target}): {statistics.median(boot):.1f} ms median of {len(boot)} (min {min(boot):.1f})')
+        self.stdout.write(
+            f"First request GET {options['path']} -> {timings[-1]['status']}: "
+            f'{statistics.median(first_request):.1f} ms median (min {min(first_request):.1f})'
+        )
+        for phase, imports in [('boot', boot_imports), ('first request', request_imports)]:
+            self.stdout.write(
+                f'Imports during {phase}: {len(imports)} modules, '
+                f'{sum(i[1] for i in imports) / 1000:.1f} ms'
+            )
+
+        imports = boot_imports + request_imports
+        packages = defaultdict(lambda: [0, 0])
+        for module, self_us, _, _ in imports:
+            package = packages[module.split('.')[0]]
+            package[0] += self_us
+            package[1] += 1
+
+        self.stdout.write('\nSlowest packages (self time, boot and first request):')
+        for package, (self_us, count) in sorted(packages.items(), key=lambda p: -p[1][0])[:options['top']]:
+            self.stdout.write(f'  {package:<32} {self_us / 1000:>8.1f} ms  ({count} modules)')
+
+        self.stdout.write('\nSlowest top-level imports (cumulative):')
+        top_level = [i for i in imports if i[3] == 0]
+        for module, _, cumulative_us, _ in sorted(top_level, key=lambda i: -i[2])[:options['top']]:
+            phase = 'first request' if (module, cumulative_us) in {(i[0], i[2]) for i in request_imports} else 'boot'
+            self.stdout.write(f'  {module:<48} {cumulative_us / 1000:>8.1f} ms  ({phase})')
@@ -0,0 +1,46 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from Ecoweb import gateway_metrics, stk_latency
+
+
+class Command(BaseCommand):
+    help = (
+        'M-Pesa payment latency per stage and Daraja ResultCode (push, callback, delivery, settlement), '
+        'from the hourly histograms kept in the cache'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24, help='How many hours back to look (default: 24)')
+        parser.add_argument('--by-hour', action='store_true', help='One table per hour instead of the total')
+        parser.add_argument('--json', action='store_true', help='Print the raw histograms as JSON')
+
+    def handle(self, *args, **options):
+        stats = stk_latency.snapshot(options['hours'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(stats, indent=2))
+        elif not stats:
+            self.stdout.write('No M-Pesa payments recorded (histograms are kept in the cache; with LocMemCache each process has its own)')
+        elif options['by_hour']:
+            for hour, labels in stats.items():
+                self.stdout.write(f'\n{hour[:4]}-{hour[4:6]}-{hour[6:8]} {hour[8:]}:00 UTC')
+                self.table(dict(sorted(labels.items())))
+        else:
+            self.stdout.write(f"Last {options['hours']} hours")
+            self.table(stk_latency.combined(stats))
+
+    def table(self, labels):
+        self.stdout.write(
+            f"{'stage':<22} {'result':>7} {'count':>7} {'avg s':>7} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7}"
+        )
+        for label, entry in labels.items():
+            stage, _, result_code = label.partition(':')
+            p50, p95, p99 = (
+                gateway_metrics.quantile(entry['buckets'], q, stk_latency.BUCKETS) for q in (0.5, 0.95, 0.99)
+            )
+            self.stdout.write(
+                f"{stage:<22} {result_code:>7} {entry['count']:>7} {entry['sum_ms'] / entry['count'] / 1000:>7.1f} "
+                f"{p50:>7.1f} {p95:>7.1f} {p99:>7.1f}"
+            )
@@ -0,0 +1,206 @@
+"""
+Per-request performance instrumentation.
+
+RequestMetricsMiddleware opens a RequestTimings for each request. While it
+is open, the database execute wrapper, the template backend
+(Ecoweb.template_backend) and timed_outbound() add to it. When the
+response leaves, the totals go into per-view histograms, and staff get
+them as a Server-Timing header.
+
+The histograms are kept in process and served in the Prometheus text
+format at /metrics. Recording a request takes one lock and a bisect per
+histogram (a few microseconds); prometheus_client's per-sample locking
+cost several times that. The numbers belong to one process, so the web
+service runs a single (async) gunicorn worker: with several behind one
+port, each scrape would reach a random worker and counters would jump
+backwards. Procfile and render.yaml pin ``--workers 1``, overriding any
+WEB_CONCURRENCY the platform sets.
+"""
+
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+# Outbound services, as labelled in Server-Timing and the histograms
+DARAJA = 'daraja'
+PESAPAL = 'pesapal'
+AFRICAS_TALKING = 'africastalking'
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# name -> (help, buckets); label sets are (view,) or, for outbound, (view, service)
+HISTOGRAMS = {
+    'ecoweb_request_duration_seconds': ('Time to serve a request', SECONDS_BUCKETS),
+    'ecoweb_db_queries': ('Database queries per request', QUERY_COUNT_BUCKETS),
+    'ecoweb_db_duration_seconds': ('Database time per request', SECONDS_BUCKETS),
+    'ecoweb_template_duration_seconds': ('Template rendering time per request', SECONDS_BUCKETS),
+    'ecoweb_outbound_duration_seconds': ('Time per request waiting on a payment or SMS gateway', SECONDS_BUCKETS),
+}
+
+
+class Histogram:
+    """Bucket counts (non-cumulative until exposition) and sum for one label set"""
+
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # The last slot is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.histograms = {name: {} for name in HISTOGRAMS}
+
+    def _histogram(self, name, labels):
+        series = self.histograms[name]
+        histogram = series.get(labels)
+        if histogram is None:
+            histogram = series[labels] = Histogram(HISTOGRAMS[name][1])
+        return histogram
+
+    def record(self, view, method, status, total, timings):
+        key = (view, method, status)
+        labels = (view,)
+        with self.lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self._histogram('ecoweb_request_duration_seconds', labels).observe(total)
+            self._histogram('ecoweb_db_queries', labels).observe(timings.db_queries)
+            self._histogram('ecoweb_db_duration_seconds', labels).observe(timings.db_time)
+            self._histogram('ecoweb_template_duration_seconds', labels).observe(timings.template_time)
+            for service, seconds in timings.outbound.items():
+                self._histogram('ecoweb_outbound_duration_seconds', (view, service)).observe(seconds)
+
+    def exposition(self):
+        """Everything recorded, in the Prometheus text format (version 0.0.4)"""
+        with self.lock:
+            requests = dict(self.requests)
+            histograms = {
+                name: {labels: (list(h.counts), h.sum) for labels, h in series.items()}
+                for name, series in self.histograms.items()
+            }
+
+        lines = ['# HELP ecoweb_requests_total Requests served', '# TYPE ecoweb_requests_total counter']
+        for (view, method, status), count in sorted(requests.items()):
+            lines.append(f'ecoweb_requests_total{{view="{escape_label(view)}",method="{method}",status="{status}"}} {count}')
+
+        for name, (help_text, buckets) in HISTOGRAMS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            label_names = ('view', 'service') if name == 'ecoweb_outbound_duration_seconds' else ('view',)
+            for labels, (counts, total) in sorted(histograms[name].items()):
+                label_text = ','.join(f'{k}="{escape_label(v)}"' for k, v in zip(label_names, labels))
+                cumulative = 0
+                for bound, count in zip(buckets + (float('inf'),), counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(float(bound))
+                    lines.append(f'{name}_bucket{{{label_text},le="{le}"}} {cumulative}')
+                lines.append(f'{name}_sum{{{label_text}}} {total!r}')
+                lines.append(f'{name}_count{{{label_text}}} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+
+
+class RequestTimings:
+    __slots__ = ('start', 'request', 'db_queries', 'db_time', 'template_time', 'template_depth', 'outbound')
+
+    def __init__(self, request=None):
+        self.start = time.perf_counter()
+        self.request = request
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        # Only the outermost render is timed; includes happen inside it
+        self.template_depth = 0
+        self.outbound = {}
+
+    @property
+    def view(self):
+        """Name of the view serving the request, None until the URL has resolved"""
+        match = getattr(self.request, 'resolver_match', None)
+        return match.view_name if match is not None else None
+
+    def server_timing(self, total):
+        entries = [
+            f'total;dur={total * 1000:.1f}',
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.db_queries} queries"',
+            f'tpl;dur={self.template_time * 1000:.1f}',
+        ]
+        entries.extend(f'{service};dur={seconds * 1000:.1f}' for service, seconds in self.outbound.items())
+        return ', '.join(entries)
+
+
+_current = contextvars.ContextVar('request_timings', default=None)
+
+
+def current():
+    """Timings of the request being served, or None"""
+    return _current.get()
+
+
+def begin_request(request=None):
+    """Start timing a request; returns the token for end_request"""
+    return _current.set(RequestTimings(request))
+
+
+def end_request(token, view, method, status):
+    """Stop timing, record the request and return its RequestTimings and total seconds"""
+    timings = _current.get()
+    _current.reset(token)
+    total = time.perf_counter() - timings.start
+    registry.record(view, method, status, total, timings)
+    return timings, total
+
+
+@contextmanager
+def timed_outbound(service):
+    """Count the enclosed gateway call towards the current request"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.outbound[service] = timings.outbound.get(service, 0.0) + time.perf_counter() - start
+
+
+def time_query(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db_time += time.perf_counter() - start
+        timings.db_queries += 1
+
+
+@receiver(connection_created)
+def install_query_timer(sender, connection, **kwargs):
+    # Connections are per thread (and reopened), so the wrapper is added to
+    # each one as it connects rather than around each request
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
@@ -0,0 +1,335 @@
+import time
+from urllib.parse import urlparse
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from whitenoise.base import WhiteNoise
+from whitenoise.middleware import WhiteNoiseMiddleware
+from whitenoise.string_utils import ensure_leading_trailing_slash
+
+from . import db_routers, metrics, page_cache
+from .fragment_cache import acatalog_version, catalog_version
+from .storage import is_hashed_name
+
+# Bytes read per thread hop when a file is streamed to an ASGI server
+ASYNC_FILE_CHUNK_SIZE = 64 * 1024
+
+
+async def _aread_chunks(file):
+    read = sync_to_async(file.read, thread_sensitive=False)
+    try:
+        while chunk := await read(ASYNC_FILE_CHUNK_SIZE):
+            yield chunk
+    finally:
+        await sync_to_async(file.close, thread_sensitive=False)()
+
+
+async def aserve(static_file, request):
+    """WhiteNoiseMiddleware.serve for the async stack.
+
+    Its FileResponse iterates the file synchronously, which Django's ASGI
+    handler can only do by reading the whole file into memory on a thread.
+    Here the body is an async generator reading one chunk per thread hop.
+    """
+    response = await sync_to_async(static_file.get_response, thread_sensitive=False)(request.method, request.META)
+    status = int(response.status)
+    if response.file is None:
+        # HEAD and 304
+        http_response = HttpResponse(status=status)
+    else:
+        http_response = StreamingHttpResponse(_aread_chunks(response.file), status=status)
+    # Remove default content-type
+    del http_response['Content-Type']
+    for key, value in response.headers:
+        http_response[key] = value
+    return http_response
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """WhiteNoise that does not force the rest of the stack onto a thread.
+
+    WhiteNoise 6.6 is sync-only, so under ASGI Django would run every
+    middleware and view below it (async views included) through
+    async_to_sync on the request's thread.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None):
+        super().__init__(get_response)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file, thread_sensitive=False)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await aserve(static_file, request)
+        return await self.get_response(request)
+
+
+class MediaFilesMiddleware:
+    """Serve uploads from MEDIA_ROOT with WhiteNoise's file handling.
+
+    Conditional requests, Range and HEAD are answered by WhiteNoise; under a
+    WSGI server the body goes out through wsgi.file_wrapper (sendfile), under
+    an ASGI one it is streamed in chunks (see aserve). Files saved by
+    HashedMediaStorage are cached by clients for good; older, unhashed uploads
+    for MEDIA_MAX_AGE. Uploads appear at runtime, so the disk is checked on a
+    miss, and only hashed (never changing) names are remembered. With
+    MEDIA_URL pointing at a pull-through CDN, this is its origin.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prefix = ensure_leading_trailing_slash(urlparse(settings.MEDIA_URL).path)
+        self.media = WhiteNoise(
+            None,
+            autorefresh=True,
+            max_age=getattr(settings, 'MEDIA_MAX_AGE', 3600),
+            immutable_file_test=lambda path, url: is_hashed_name(url),
+        )
+        self.media.add_files(settings.MEDIA_ROOT, prefix=self.prefix)
+        self.files = {}
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if request.path_info.startswith(self.prefix):
+            media_file = self.find_file(request.path_info)
+            if media_file is not None:
+                return WhiteNoiseMiddleware.serve(media_file, request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        if request.path_info.startswith(self.prefix):
+            media_file = self.files.get(request.path_info)
+            if media_file is None:
+                media_file = await sync_to_async(self.find_file, thread_sensitive=False)(request.path_info)
+            if media_file is not None:
+                return await aserve(media_file, request)
+        return await self.get_response(request)
+
+    def find_file(self, path):
+        media_file = self.files.get(path)
+        if media_file is None:
+            media_file = self.media.find_file(path)
+            if media_file is not None and is_hashed_name(path):
+                self.files[path] = media_file
+        return media_file
+
+
+class RequestMetricsMiddleware:
+    """Time each request and its database, template and gateway work (see Ecoweb/metrics.py).
+
+    Staff (and everyone under DEBUG) get the breakdown as a Server-Timing
+    header, which browser dev tools show next to the request.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = metrics.begin_request(request)
+        response = None
+        try:
+            response = self.get_response(request)
+        finally:
+            self.finish(token, request, response)
+        return response
+
+    async def __acall__(self, request):
+        token = metrics.begin_request(request)
+        response = None
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.finish(token, request, response)
+        return response
+
+    def finish(self, token, request, response):
+        status = response.status_code if response is not None else 500
+        timings, total = metrics.end_request(token, self.view_name(request, response), request.method, status)
+        if response is not None and self.show_timings(request):
+            response['Server-Timing'] = timings.server_timing(total)
+
+    @staticmethod
+    def view_name(request, response):
+        match = getattr(request, 'resolver_match', None)
+        if match is not None:
+            return match.view_name
+        if response is not None and response.get('X-Cache') == 'HIT':
+            return 'page_cache'
+        return 'unmatched'
+
+    @staticmethod
+    def show_timings(request):
+        if settings.DEBUG:
+            return True
+        # Without a session cookie the client is anonymous; skip loading the user
+        if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+            return False
+        user = getattr(request, 'user', None)
+        return user is not None and user.is_staff
+
+
+class PageCacheMiddleware:
+    """Serve anonymous catalog pages from the page cache (see Ecoweb/page_cache.py).
+
+    Sits above the session and auth middleware so a hit skips them. Shared
+    caches are told the page is public for PAGE_CACHE_CDN_MAX_AGE and varies
+    on Cookie; catalog pages rendered for a signed-in client are private.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not page_cache.cacheable_request(request):
+            return self.process_response(request, self.get_response(request))
+        cached = cache.get(page_cache.page_key(request.path_info))
+        if cached is not None:
+            return self.cached_response(request, cached)
+        version = catalog_version()
+        response = self.get_response(request)
+        return self.store(request, response, version, catalog_version())
+
+    async def __acall__(self, request):
+        if not page_cache.cacheable_request(request):
+            return self.process_response(request, await self.get_response(request))
+        cached = await cache.aget(page_cache.page_key(request.path_info))
+        if cached is not None:
+            return self.cached_response(request, cached)
+        version = await acatalog_version()
+        response = await self.get_response(request)
+        if request.method == 'GET' and page_cache.cacheable_response(request, response):
+            if version == await acatalog_version():
+                response['ETag'] = await page_cache.astore(request.path_info, response)
+            self.mark_miss(response)
+        return response
+
+    def store(self, request, response, version_before, version_after):
+        if request.method == 'GET' and page_cache.cacheable_response(request, response):
+            if version_before == version_after:
+                response['ETag'] = page_cache.store(request.path_info, response)
+            self.mark_miss(response)
+        return response
+
+    def mark_miss(self, response):
+        self.patch_public(response)
+        response['X-Cache'] = 'MISS'
+
+    def cached_response(self, request, cached):
+        etag, headers, content = cached
+        response = HttpResponse(content)
+        for key, value in headers:
+            response[key] = value
+        response['ETag'] = etag
+        self.patch_public(response)
+        response['X-Cache'] = 'HIT'
+        return get_conditional_response(request, etag=etag, response=response)
+
+    @staticmethod
+    def patch_public(response):
+        patch_cache_control(response, public=True, max_age=0, s_maxage=getattr(settings, 'PAGE_CACHE_CDN_MAX_AGE', 60))
+        patch_vary_headers(response, ['Cookie'])
+
+    @staticmethod
+    def process_response(request, response):
+        # Catalog pages rendered for a session must never be stored by a shared cache
+        if (
+            settings.SESSION_COOKIE_NAME in request.COOKIES
+            and 'Cache-Control' not in response
+            and page_cache.is_cached_url(request.path_info)
+        ):
+            patch_cache_control(response, private=True)
+        return response
+
+
+class ReplicaPinMiddleware:
+    """Keep a client's reads on the primary for a while after it writes.
+
+    The pin is a cookie holding its expiry time rather than a session key,
+    so checking it costs no database read.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.cookie_name = getattr(settings, 'REPLICA_PIN_COOKIE', 'pin_primary')
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = db_routers.begin_request(self.is_pinned(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = db_routers.end_request(token)
+        return self.process_response(request, response, wrote)
+
+    async def __acall__(self, request):
+        token = db_routers.begin_request(self.is_pinned(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            wrote = db_routers.end_request(token)
+        return self.process_response(request, response, wrote)
+
+    def is_pinned(self, request):
+        try:
+            return float(request.COOKIES.get(self.cookie_name, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def process_response(self, request, response, wrote):
+        if wrote and db_routers.replica_configured():
+            pin_for = getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+            response.set_cookie(
+                self.cookie_name,
+                str(int(time.time() + pin_for)),
+                max_age=pin_for,
+                secure=request.is_secure(),
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
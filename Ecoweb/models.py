@@ -1,5 +1,6 @@
 from django.conf import settings
 from django.db import models
+from django.db.models import F, FloatField, Sum
 from django.shortcuts import reverse
 from django.utils import timezone
 from decimal import Decimal
@@ -30,6 +31,24 @@ MPESA_TRANSACTION_STATUS = (
     ('CANCELLED', 'Cancelled'),
 )
 
+# How a transaction left PENDING: Daraja's callback or a status query
+MPESA_SETTLED_VIA = (
+    ('callback', 'Callback'),
+    ('poll', 'Status query'),
+)
+
+NOTIFICATION_CHANNELS = (
+    ('sms', 'SMS'),
+    ('email', 'Email'),
+)
+
+NOTIFICATION_STATUS = (
+    ('PENDING', 'Pending'),
+    ('SENDING', 'Sending'),
+    ('SENT', 'Sent'),
+    ('FAILED', 'Failed'),
+)
+
 
 class Item(models.Model):
     title = models.CharField(max_length=200)
@@ -90,10 +109,11 @@ class Order(models.Model):
         return f"Order #{self.id} - {self.user.username}"
 
     def get_total(self):
-        total = 0
-        for order_item in self.items.all():
-            total += order_item.get_total_item_price()
-        return total
+        """Sum of the line totals: from prefetched lines if loaded, otherwise in one query"""
+        if 'items' in getattr(self, '_prefetched_objects_cache', {}):
+            return sum(order_item.get_total_item_price() for order_item in self.items.all())
+        total = self.items.aggregate(total=Sum(F('quantity') * F('item__price'), output_field=FloatField()))['total']
+        return total or 0
 
 
 class MpesaTransaction(models.Model):
@@ -105,8 +125,42 @@ class MpesaTransaction(models.Model):
     mpesa_receipt_number = models.CharField(max_length=50, blank=True, null=True)
     transaction_date = models.DateTimeField(blank=True, null=True)
     status = models.CharField(max_length=20, choices=MPESA_TRANSACTION_STATUS, default='PENDING')
+    # Daraja ResultCode from the callback or status query that settled it
+    result_code = models.CharField(max_length=20, blank=True)
+    # Stages of the payment, for latency analytics (see Ecoweb/stk_latency.py)
+    push_sent_at = models.DateTimeField(blank=True, null=True)
+    push_accepted_at = models.DateTimeField(blank=True, null=True)
+    callback_received_at = models.DateTimeField(blank=True, null=True)
+    settled_at = models.DateTimeField(blank=True, null=True)
+    settled_via = models.CharField(max_length=10, choices=MPESA_SETTLED_VIA, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return f"M-Pesa Transaction {self.checkout_request_id} - {self.status}"
+
+
+class Notification(models.Model):
+    """Outbox entry for an SMS or email, delivered by `manage.py send_notifications`"""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='notifications', null=True, blank=True)
+    template = models.CharField(max_length=50)
+    channel = models.CharField(max_length=10, choices=NOTIFICATION_CHANNELS)
+    recipient = models.CharField(max_length=254)
+    subject = models.CharField(max_length=200, blank=True)
+    body = models.TextField()
+    # One notification per (order, template); enqueueing the same key twice is a no-op
+    dedup_key = models.CharField(max_length=150, unique=True)
+    status = models.CharField(max_length=10, choices=NOTIFICATION_STATUS, default='PENDING')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_channel_display()} {self.template} to {self.recipient} - {self.status}"
@@ -1,58 +1,140 @@
-import requests
 import json
 import base64
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.core.cache import cache
-import re
 import logging
 import time
 
+from . import gateway_metrics
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+from .http_client import get_async_client
+from .lazy_imports import lazy_import
+from .phone import normalize_phone
+
+httpx = lazy_import('httpx')
+requests = lazy_import('requests')
+
 logger = logging.getLogger(__name__)
 
+# One breaker per Daraja endpoint so a failing STK query does not block pushes
+CIRCUIT_OAUTH = 'mpesa_oauth'
+CIRCUIT_STK_PUSH = 'mpesa_stk_push'
+CIRCUIT_STK_QUERY = 'mpesa_stk_query'
+
+# Daraja answers STK queries for pushes still awaiting the customer's PIN with
+# an HTTP 500 carrying this code; it is a normal answer, not an outage
+STK_QUERY_PROCESSING_CODES = ('500.001.1001',)
+
+# STK query ResultCodes that settle a push, and the transaction status they mean;
+# other codes leave it pending
+STK_QUERY_RESULT_STATUS = {
+    '0': 'SUCCESS',
+    '1032': 'CANCELLED',  # Cancelled by the customer
+    '1037': 'CANCELLED',  # Customer did not respond in time
+    '1': 'FAILED',
+}
+
+TOKEN_CACHE_KEY = 'mpesa_access_token'
+# Tokens live for an hour; keep them for 50 minutes
+TOKEN_TTL = 3000
+# How long a successful STK query answer is reused
+STATUS_TTL = 30
+
+# Daraja timestamps are East Africa Time, which has no daylight saving
+DARAJA_TIMEZONE = timezone(timedelta(hours=3), 'EAT')
+
+# Simulated in test mode: success, cancelled and failed respectively
+TEST_PHONE_NUMBERS = ('254700000000', '254711111111', '254722222222')
+
+
+def parse_transaction_date(value):
+    """The callback's TransactionDate (YYYYMMDDHHMMSS in EAT, sent as a number) as an aware datetime"""
+    try:
+        return datetime.strptime(str(value), '%Y%m%d%H%M%S').replace(tzinfo=DARAJA_TIMEZONE)
+    except (TypeError, ValueError):
+        logger.warning(f"Unparseable M-Pesa TransactionDate: {value!r}")
+        return None
+
+
 class MpesaService:
+    circuits = {
+        CIRCUIT_OAUTH: CircuitBreaker(CIRCUIT_OAUTH),
+        CIRCUIT_STK_PUSH: CircuitBreaker(CIRCUIT_STK_PUSH),
+        CIRCUIT_STK_QUERY: CircuitBreaker(CIRCUIT_STK_QUERY),
+    }
+
     def __init__(self):
         self.consumer_key = getattr(settings, 'MPESA_CONSUMER_KEY', '')
         self.consumer_secret = getattr(settings, 'MPESA_CONSUMER_SECRET', '')
         self.business_shortcode = getattr(settings, 'MPESA_SHORTCODE', '174379')
         self.account_number = getattr(settings, 'BUSINESS_NUMBER', 'LNM_STK_PUSH')
         self.passkey = getattr(settings, 'MPESA_PASSKEY', '')
-        self.base_url = 'https://sandbox.safaricom.co.ke' if getattr(settings, 'MPESA_IS_SANDBOX', True) else 'https://api.safaricom.co.ke'
+        default_base_url = 'https://sandbox.safaricom.co.ke' if getattr(settings, 'MPESA_IS_SANDBOX', True) else 'https://api.safaricom.co.ke'
+        self.base_url = getattr(settings, 'MPESA_BASE_URL', default_base_url)
         self.callback_url = getattr(settings, 'MPESA_CALLBACK_URL', '')
         self.test_mode = getattr(settings, 'MPESA_TEST_MODE', getattr(settings, 'DEBUG', False))
-        self.timeout = 30
-    
-    def format_phone_number(self, phone):
-        """Format phone number to proper Kenyan format (starting with 254)"""
-        phone = re.sub(r'\D', '', phone)
-        
-        # Validate that input starts with 07 or 01 (after removing non-digits)
-        # or starts with 2547/2541
-        if phone.startswith('0'):
-            if not (phone.startswith('07') or phone.startswith('01')):
-                raise ValueError("Phone number must start with 07 or 01")
-            phone = '254' + phone[1:]
-        elif phone.startswith('254'):
-            if not (phone.startswith('2547') or phone.startswith('2541')):
-                raise ValueError("Phone number must be a valid Kenyan mobile number (7... or 1...)")
-        elif phone.startswith('7') or phone.startswith('1'):
-            phone = '254' + phone
+        self.timeout = getattr(settings, 'MPESA_TIMEOUT', 30)
+
+    @classmethod
+    def circuit_status(cls):
+        """Breaker state per Daraja endpoint, for the health endpoint"""
+        return {name: breaker.status() for name, breaker in cls.circuits.items()}
+
+    def _request(self, circuit, method, url, expected_error_codes=(), **kwargs):
+        """Send a Daraja request through the endpoint's circuit breaker.
+
+        Timeouts, connection errors and 5xx responses count as failures,
+        unless the 5xx body carries one of ``expected_error_codes``; anything
+        else (including 4xx) proves the upstream is answering.
+        """
+        breaker = self.circuits[circuit]
+        breaker.before_call()
+        try:
+            with gateway_metrics.call(circuit) as call:
+                response = call.response = requests.request(method, url, timeout=self.timeout, **kwargs)
+        except (requests.Timeout, requests.ConnectionError):
+            breaker.record_failure()
+            raise
+        self._record(breaker, response, expected_error_codes)
+        return response
+
+    async def _arequest(self, circuit, method, url, expected_error_codes=(), **kwargs):
+        """Non-blocking ``_request`` over the pooled httpx client"""
+        breaker = self.circuits[circuit]
+        await breaker.abefore_call()
+        try:
+            async with gateway_metrics.acall(circuit) as call:
+                response = call.response = await get_async_client().request(method, url, timeout=self.timeout, **kwargs)
+        except httpx.TransportError:
+            await breaker.arecord_failure()
+            raise
+        await self._arecord(breaker, response, expected_error_codes)
+        return response
+
+    def _record(self, breaker, response, expected_error_codes):
+        if response.status_code >= 500 and not self._has_error_code(response, expected_error_codes):
+            breaker.record_failure()
         else:
-            raise ValueError("Phone number must start with 07, 01 or 254")
-        
-        if len(phone) != 12:
-            raise ValueError(f"Invalid phone number length. Expected 10 digits (07...) or 12 digits (254...)")
-        
-        return phone
+            breaker.record_success()
+
+    async def _arecord(self, breaker, response, expected_error_codes):
+        if response.status_code >= 500 and not self._has_error_code(response, expected_error_codes):
+            await breaker.arecord_failure()
+        else:
+            await breaker.arecord_success()
     
-    def get_access_token(self):
-        """Get OAuth access token from Safaricom with caching"""
-        # Check cache first for faster response
-        cache_key = 'mpesa_access_token'
-        token = cache.get(cache_key)
-        if token:
-            return token
-            
+    @staticmethod
+    def _has_error_code(response, codes):
+        if not codes:
+            return False
+        try:
+            return response.json().get('errorCode') in codes
+        except ValueError:
+            return False
+
+    def _token_request(self):
         url = f"{self.base_url}/oauth/v1/generate?grant_type=client_credentials"
         
         credentials = base64.b64encode(f"{self.consumer_key}:{self.consumer_secret}".encode()).decode()
@@ -61,20 +143,52 @@ class MpesaService:
             'Authorization': f'Basic {credentials}',
             'Content-Type': 'application/json'
         }
-        
+        return url, headers
+
+    def _token_result(self, response):
+        if response.status_code == 200:
+            return response.json().get('access_token')
+        logger.error(f"Failed to get access token: {response.status_code} - {response.text}")
+        return None
+
+    def get_access_token(self):
+        """Get OAuth access token from Safaricom with caching"""
+        # Check cache first for faster response
+        token = cache.get(TOKEN_CACHE_KEY)
+        if token:
+            return token
+            
+        url, headers = self._token_request()
         try:
-            response = requests.get(url, headers=headers, timeout=self.timeout)
-            if response.status_code == 200:
-                token = response.json().get('access_token')
-                # Cache token for 50 minutes (expires in 1 hour)
-                cache.set(cache_key, token, 3000)
-                return token
-            else:
-                logger.error(f"Failed to get access token: {response.status_code} - {response.text}")
+            token = self._token_result(self._request(CIRCUIT_OAUTH, 'GET', url, headers=headers))
+            if token:
+                cache.set(TOKEN_CACHE_KEY, token, TOKEN_TTL)
+            return token
+        except CircuitOpenError:
+            raise
         except Exception as e:
             logger.error(f"Error getting access token: {e}")
         
         return None
+
+    async def aget_access_token(self):
+        """Async ``get_access_token``"""
+        token = await cache.aget(TOKEN_CACHE_KEY)
+        if token:
+            return token
+
+        url, headers = self._token_request()
+        try:
+            token = self._token_result(await self._arequest(CIRCUIT_OAUTH, 'GET', url, headers=headers))
+            if token:
+                await cache.aset(TOKEN_CACHE_KEY, token, TOKEN_TTL)
+            return token
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"Error getting access token: {e}")
+
+        return None
     
     def generate_password(self):
         """Generate password for STK push"""
@@ -82,22 +196,8 @@ class MpesaService:
         password_string = f"{self.business_shortcode}{self.passkey}{timestamp}"
         password = base64.b64encode(password_string.encode()).decode()
         return password, timestamp
-    
-    def initiate_stk_push(self, phone_number, amount, order_id, description="Payment"):
-        """Initiate STK push to customer's phone with test mode support"""
-        # Test mode for localhost development
-        if self.test_mode and phone_number in ['254700000000', '254711111111', '254722222222']:
-            return self._simulate_test_payment(phone_number, amount, order_id)
-            
-        access_token = self.get_access_token()
-        if not access_token:
-            return {'status': 'error', 'message': 'Failed to get access token'}
-        
-        try:
-            formatted_phone = self.format_phone_number(phone_number)
-        except ValueError as e:
-            return {'status': 'error', 'message': str(e)}
-        
+
+    def _stk_push_request(self, access_token, formatted_phone, amount, order_id, description):
         password, timestamp = self.generate_password()
         
         url = f"{self.base_url}/mpesa/stkpush/v1/processrequest"
@@ -120,49 +220,86 @@ class MpesaService:
             "AccountReference": self.account_number,
             "TransactionDesc": f"{description} - Order #{order_id}"
         }
+        return url, payload, headers
+
+    def _stk_push_result(self, response, formatted_phone):
+        result = response.json()
         
+        logger.info(f"STK Push Response: {result}")
+        
+        if response.status_code == 200 and result.get('ResponseCode') == '0':
+            logger.info(f"✅ STK push successful for {formatted_phone}")
+            return {
+                'status': 'success',
+                'checkout_request_id': result.get('CheckoutRequestID'),
+                'merchant_request_id': result.get('MerchantRequestID'),
+                'message': f'Payment prompt sent to {formatted_phone}. Check your phone for M-Pesa notification.'
+            }
+        error_msg = result.get('errorMessage', result.get('ResponseDescription', 'Failed to initiate payment'))
+        logger.error(f"STK Push failed: {error_msg}")
+        return {
+            'status': 'error',
+            'message': error_msg
+        }
+    
+    def initiate_stk_push(self, phone_number, amount, order_id, description="Payment"):
+        """Initiate STK push to customer's phone with test mode support"""
+        # Test mode for localhost development
+        if self.test_mode and phone_number in TEST_PHONE_NUMBERS:
+            return self._simulate_test_payment(phone_number, amount, order_id)
+            
+        try:
+            formatted_phone = normalize_phone(phone_number)
+        except ValueError as e:
+            return {'status': 'error', 'message': str(e)}
+
+        try:
+            access_token = self.get_access_token()
+        except CircuitOpenError as e:
+            return self._unavailable(e)
+        if not access_token:
+            return {'status': 'error', 'message': 'Failed to get access token'}
+        
+        url, payload, headers = self._stk_push_request(access_token, formatted_phone, amount, order_id, description)
         try:
             logger.info(f"Initiating STK push for {formatted_phone}, Amount: {amount}")
-            response = requests.post(url, json=payload, headers=headers, timeout=self.timeout)
-            result = response.json()
-            
-            logger.info(f"STK Push Response: {result}")
-            
-            if response.status_code == 200 and result.get('ResponseCode') == '0':
-                logger.info(f"✅ STK push successful for {formatted_phone}")
-                return {
-                    'status': 'success',
-                    'checkout_request_id': result.get('CheckoutRequestID'),
-                    'merchant_request_id': result.get('MerchantRequestID'),
-                    'message': f'Payment prompt sent to {formatted_phone}. Check your phone for M-Pesa notification.'
-                }
-            else:
-                error_msg = result.get('errorMessage', result.get('ResponseDescription', 'Failed to initiate payment'))
-                logger.error(f"STK Push failed: {error_msg}")
-                return {
-                    'status': 'error',
-                    'message': error_msg
-                }
+            response = self._request(CIRCUIT_STK_PUSH, 'POST', url, json=payload, headers=headers)
+            return self._stk_push_result(response, formatted_phone)
+        except CircuitOpenError as e:
+            return self._unavailable(e)
         except Exception as e:
             logger.error(f"STK Push request failed: {str(e)}")
             return {'status': 'error', 'message': f'Request failed: {str(e)}'}
-    
-    def query_stk_status(self, checkout_request_id):
-        """Query the status of STK push transaction with caching"""
-        # Check cache first for faster response
-        cache_key = f'mpesa_status_{checkout_request_id}'
-        cached_status = cache.get(cache_key)
-        if cached_status:
-            return cached_status
-            
-        # Test mode simulation
-        if self.test_mode and checkout_request_id.startswith('test_'):
-            return self._get_test_status(checkout_request_id)
-            
-        access_token = self.get_access_token()
+
+    async def ainitiate_stk_push(self, phone_number, amount, order_id, description="Payment"):
+        """Async ``initiate_stk_push``; waits on Safaricom without holding a thread"""
+        if self.test_mode and phone_number in TEST_PHONE_NUMBERS:
+            return await sync_to_async(self._simulate_test_payment)(phone_number, amount, order_id)
+
+        try:
+            formatted_phone = normalize_phone(phone_number)
+        except ValueError as e:
+            return {'status': 'error', 'message': str(e)}
+
+        try:
+            access_token = await self.aget_access_token()
+        except CircuitOpenError as e:
+            return self._unavailable(e)
         if not access_token:
             return {'status': 'error', 'message': 'Failed to get access token'}
-        
+
+        url, payload, headers = self._stk_push_request(access_token, formatted_phone, amount, order_id, description)
+        try:
+            logger.info(f"Initiating STK push for {formatted_phone}, Amount: {amount}")
+            response = await self._arequest(CIRCUIT_STK_PUSH, 'POST', url, json=payload, headers=headers)
+            return self._stk_push_result(response, formatted_phone)
+        except CircuitOpenError as e:
+            return self._unavailable(e)
+        except Exception as e:
+            logger.error(f"STK Push request failed: {str(e)}")
+            return {'status': 'error', 'message': f'Request failed: {str(e)}'}
+
+    def _stk_query_request(self, access_token, checkout_request_id):
         password, timestamp = self.generate_password()
         
         url = f"{self.base_url}/mpesa/stkpushquery/v1/query"
@@ -178,19 +315,82 @@ class MpesaService:
             "Timestamp": timestamp,
             "CheckoutRequestID": checkout_request_id
         }
+        return url, payload, headers
+
+    def query_stk_status(self, checkout_request_id):
+        """Query the status of STK push transaction with caching"""
+        # Check cache first for faster response
+        cached_status = cache.get(f'mpesa_status_{checkout_request_id}')
+        if cached_status:
+            return cached_status
+            
+        # Test mode simulation
+        if self.test_mode and checkout_request_id.startswith('test_'):
+            return self._get_test_status(checkout_request_id)
+            
+        try:
+            access_token = self.get_access_token()
+        except CircuitOpenError as e:
+            return self._unavailable(e)
+        if not access_token:
+            return {'status': 'error', 'message': 'Failed to get access token'}
         
+        url, payload, headers = self._stk_query_request(access_token, checkout_request_id)
         try:
-            response = requests.post(url, json=payload, headers=headers, timeout=self.timeout)
+            response = self._request(
+                CIRCUIT_STK_QUERY, 'POST', url, json=payload, headers=headers,
+                expected_error_codes=STK_QUERY_PROCESSING_CODES
+            )
             result = response.json()
-            
-            # Cache successful responses for 30 seconds
             if response.status_code == 200:
-                cache.set(cache_key, result, 30)
-                
+                cache.set(f'mpesa_status_{checkout_request_id}', result, STATUS_TTL)
             return result
+        except CircuitOpenError as e:
+            return self._unavailable(e)
         except Exception as e:
             logger.error(f"Query failed: {str(e)}")
             return {'status': 'error', 'message': f'Query failed: {str(e)}'}
+
+    async def aquery_stk_status(self, checkout_request_id):
+        """Async ``query_stk_status``"""
+        cached_status = await cache.aget(f'mpesa_status_{checkout_request_id}')
+        if cached_status:
+            return cached_status
+
+        if self.test_mode and checkout_request_id.startswith('test_'):
+            return await sync_to_async(self._get_test_status)(checkout_request_id)
+
+        try:
+            access_token = await self.aget_access_token()
+        except CircuitOpenError as e:
+            return self._unavailable(e)
+        if not access_token:
+            return {'status': 'error', 'message': 'Failed to get access token'}
+
+        url, payload, headers = self._stk_query_request(access_token, checkout_request_id)
+        try:
+            response = await self._arequest(
+                CIRCUIT_STK_QUERY, 'POST', url, json=payload, headers=headers,
+                expected_error_codes=STK_QUERY_PROCESSING_CODES
+            )
+            result = response.json()
+            if response.status_code == 200:
+                await cache.aset(f'mpesa_status_{checkout_request_id}', result, STATUS_TTL)
+            return result
+        except CircuitOpenError as e:
+            return self._unavailable(e)
+        except Exception as e:
+            logger.error(f"Query failed: {str(e)}")
+            return {'status': 'error', 'message': f'Query failed: {str(e)}'}
+    
+    def _unavailable(self, error):
+        """Fast-fail response while a Daraja circuit is open"""
+        logger.warning(f"M-Pesa call skipped: {error}")
+        return {
+            'status': 'error',
+            'message': f'M-Pesa is temporarily unavailable. Please try again in {error.retry_after} seconds.',
+            'retry_after': error.retry_after
+        }
     
     def _simulate_test_payment(self, phone_number, amount, order_id):
         """Simulate payment for test mode"""
@@ -1,137 +1,36 @@
-import base64
-import json
-import requests
-from datetime import datetime
-from django.conf import settings
 import logging
 
+from .mpesa_service import MpesaService
+
 logger = logging.getLogger('mpesa')
 
-class MpesaClient:
-    def __init__(self):
-        self.consumer_key = settings.MPESA_CONSUMER_KEY
-        self.consumer_secret = settings.MPESA_CONSUMER_SECRET
-        self.passkey = settings.MPESA_PASSKEY
-        self.shortcode = getattr(settings, 'MPESA_SHORTCODE', '174379')
-        self.callback_url = settings.MPESA_CALLBACK_URL
-        self.base_url = getattr(settings, 'MPESA_BASE_URL', 'https://sandbox.safaricom.co.ke')
-        
-    def get_access_token(self):
-        """Get OAuth access token from Safaricom"""
-        try:
-            url = f"{self.base_url}/oauth/v1/generate?grant_type=client_credentials"
-            credentials = base64.b64encode(f"{self.consumer_key}:{self.consumer_secret}".encode()).decode()
-            
-            headers = {
-                'Authorization': f'Basic {credentials}',
-                'Content-Type': 'application/json'
-            }
-            
-            response = requests.get(url, headers=headers, timeout=30)
-            response.raise_for_status()
-            
-            return response.json().get('access_token')
-        except Exception as e:
-            logger.error(f"Failed to get access token: {e}")
-            return None
-    
-    def generate_password(self):
-        """Generate password for STK push"""
-        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-        password_string = f"{self.shortcode}{self.passkey}{timestamp}"
-        password = base64.b64encode(password_string.encode()).decode()
-        return password, timestamp
-    
+class MpesaClient(MpesaService):
+    """Backwards-compatible interface over MpesaService.
+
+    Kept for code written against the old standalone client; token caching,
+    phone validation and circuit breaking all come from MpesaService.
+    """
+
+    @property
+    def shortcode(self):
+        return self.business_shortcode
+
     def stk_push(self, phone_number, amount, account_reference, transaction_desc):
         """Initiate STK push payment"""
-        access_token = self.get_access_token()
-        if not access_token:
-            return {'success': False, 'message': 'Failed to get access token'}
-        
-        password, timestamp = self.generate_password()
-        
-        # Format phone number
-        if phone_number.startswith('0'):
-            phone_number = '254' + phone_number[1:]
-        elif phone_number.startswith('+254'):
-            phone_number = phone_number[1:]
-        elif not phone_number.startswith('254'):
-            phone_number = '254' + phone_number
-        
-        url = f"{self.base_url}/mpesa/stkpush/v1/processrequest"
-        
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
-        
-        payload = {
-            'BusinessShortCode': self.shortcode,
-            'Password': password,
-            'Timestamp': timestamp,
-            'TransactionType': 'CustomerPayBillOnline',
-            'Amount': int(amount),
-            'PartyA': phone_number,
-            'PartyB': self.shortcode,
-            'PhoneNumber': phone_number,
-            'CallBackURL': self.callback_url,
-            'AccountReference': account_reference,
-            'TransactionDesc': transaction_desc
-        }
-        
-        try:
-            response = requests.post(url, json=payload, headers=headers, timeout=30)
-            response.raise_for_status()
-            
-            result = response.json()
-            logger.info(f"STK Push response: {result}")
-            
-            if result.get('ResponseCode') == '0':
-                return {
-                    'success': True,
-                    'checkout_request_id': result.get('CheckoutRequestID'),
-                    'merchant_request_id': result.get('MerchantRequestID'),
-                    'message': 'STK push sent successfully'
-                }
-            else:
-                return {
-                    'success': False,
-                    'message': result.get('errorMessage', 'STK push failed')
-                }
-                
-        except Exception as e:
-            logger.error(f"STK Push error: {e}")
-            return {'success': False, 'message': str(e)}
-    
+        result = self.initiate_stk_push(phone_number, amount, account_reference, description=transaction_desc)
+
+        if result.get('status') == 'success':
+            return {
+                'success': True,
+                'checkout_request_id': result.get('checkout_request_id'),
+                'merchant_request_id': result.get('merchant_request_id'),
+                'message': 'STK push sent successfully'
+            }
+        return {'success': False, 'message': result.get('message', 'STK push failed')}
+
     def query_transaction(self, checkout_request_id):
         """Query transaction status"""
-        access_token = self.get_access_token()
-        if not access_token:
-            return {'success': False, 'message': 'Failed to get access token'}
-        
-        password, timestamp = self.generate_password()
-        
-        url = f"{self.base_url}/mpesa/stkpushquery/v1/query"
-        
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
-        
-        payload = {
-            'BusinessShortCode': self.shortcode,
-            'Password': password,
-            'Timestamp': timestamp,
-            'CheckoutRequestID': checkout_request_id
-        }
-        
-        try:
-            response = requests.post(url, json=payload, headers=headers, timeout=30)
-            response.raise_for_status()
-            
-            result = response.json()
-            return result
-            
-        except Exception as e:
-            logger.error(f"Query transaction error: {e}")
-            return {'success': False, 'message': str(e)}
\ No newline at end of file
+        result = self.query_stk_status(checkout_request_id)
+        if result.get('status') == 'error':
+            return {'success': False, 'message': result.get('message')}
+        return result
@@ -0,0 +1,199 @@
+import logging
+import textwrap
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .emails import send_emails
+from .models import Notification
+from .signals import order_paid
+from .sms import AfricasTalkingSMS, SMSError
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+# Retry after 30 s, 1 min, 2 min, 4 min, ...
+RETRY_BASE_DELAY = 30
+# A SENDING entry whose worker died is picked up again after this many seconds
+CLAIM_LEASE = 300
+
+
+def enqueue(template, channel, recipient, body, order=None, subject='', dedup_key=None):
+    """Add a notification to the outbox unless one with the same key exists.
+
+    The key defaults to (order, template), so re-enqueueing from a status poll
+    or a repeated callback never produces a second message. Returns
+    ``(notification, created)``.
+    """
+    if dedup_key is None:
+        dedup_key = f'order:{order.pk}:{template}'
+    if not recipient:
+        logger.warning(f"Not queueing {template}: no {channel} recipient")
+        return None, False
+
+    try:
+        with transaction.atomic():
+            return Notification.objects.get_or_create(
+                dedup_key=dedup_key,
+                defaults={
+                    'order': order,
+                    'template': template,
+                    'channel': channel,
+                    'recipient': recipient,
+                    'subject': subject,
+                    'body': body,
+                }
+            )
+    except IntegrityError:
+        # Lost a race with a concurrent enqueue of the same key
+        return Notification.objects.get(dedup_key=dedup_key), False
+
+
+def enqueue_payment_success_sms(order):
+    """Queue the 'payment successful' SMS for a paid order"""
+    mpesa_transaction = order.mpesa_transactions.filter(status='SUCCESS').order_by('-updated_at').first()
+    if mpesa_transaction:
+        body = (
+            f"Payment successful! Your order #{order.id} for KES {mpesa_transaction.amount} "
+            f"has been confirmed. Receipt: {mpesa_transaction.mpesa_receipt_number}. "
+            f"Thank you for shopping with us!"
+        )
+        phone = mpesa_transaction.phone_number
+    else:
+        body = (
+            f"Payment successful! Your order #{order.id} has been confirmed. "
+            f"Thank you for shopping with us!"
+        )
+        phone = order.customer_phone or order.phone
+    return enqueue('payment_success', 'sms', phone, body, order=order)
+
+
+def enqueue_order_confirmation(order):
+    """Queue the order confirmation email and SMS; returns (email_queued, sms_queued)"""
+    total = order.get_total()
+    email_body = textwrap.dedent(f"""
+        Dear {order.first_name},
+
+        Thank you for your order! Your payment has been confirmed.
+
+        Order Details:
+        Order Number: #{order.id}
+        Total Amount: KES {total}
+        Payment Method: {order.payment_method}
+
+        Your order is being processed and you will receive shipping updates soon.
+
+        Thank you for shopping with us!
+        """).strip()
+    sms_body = (
+        f"Order #{order.id} confirmed! "
+        f"Total: KES {total}. "
+        f"We'll notify you when your order ships. "
+        f"Thank you for choosing us!"
+    )
+    email, _ = enqueue(
+        'order_confirmation_email', 'email', order.email, email_body,
+        order=order, subject=f'Order Confirmation #{order.id}'
+    )
+    sms, _ = enqueue('order_confirmation_sms', 'sms', order.customer_phone, sms_body, order=order)
+    return email is not None, sms is not None
+
+
+@receiver(order_paid)
+def queue_payment_success_sms(sender, order, **kwargs):
+    enqueue_payment_success_sms(order)
+
+
+def _claim(batch_size):
+    """Mark a batch of due notifications as SENDING so concurrent workers skip them"""
+    now = timezone.now()
+    due = list(
+        Notification.objects
+        .filter(status__in=['PENDING', 'SENDING'], next_attempt_at__lte=now)
+        .order_by('next_attempt_at')
+        .values_list('pk', flat=True)[:batch_size]
+    )
+    # One UPDATE for the batch; the lease timestamp identifies the rows this
+    # worker won when another worker claims overlapping ids concurrently
+    lease = now + timedelta(seconds=CLAIM_LEASE)
+    Notification.objects.filter(
+        pk__in=due, status__in=['PENDING', 'SENDING'], next_attempt_at__lte=now
+    ).update(status='SENDING', next_attempt_at=lease)
+    return list(
+        Notification.objects
+        .filter(pk__in=due, status='SENDING', next_attempt_at=lease)
+        .select_related('order')
+    )
+
+
+def _mark_failed(notification, error, max_attempts):
+    notification.attempts += 1
+    notification.last_error = str(error)[:1000]
+    if notification.attempts >= max_attempts:
+        notification.status = 'FAILED'
+        logger.error(f"Giving up on notification {notification.pk} after {notification.attempts} attempts: {error}")
+    else:
+        notification.status = 'PENDING'
+        delay = RETRY_BASE_DELAY * 2 ** (notification.attempts - 1)
+        notification.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+    notification.save(update_fields=['status', 'attempts', 'last_error', 'next_attempt_at'])
+
+
+def _mark_delivered(notifications):
+    if notifications:
+        Notification.objects.filter(pk__in=[n.pk for n in notifications]).update(
+            status='SENT', attempts=F('attempts') + 1, sent_at=timezone.now(), last_error=''
+        )
+
+
+def _deliver_sms(notifications, max_attempts):
+    """Send SMS notifications in bulk, one request per distinct message body"""
+    by_body = defaultdict(list)
+    for notification in notifications:
+        by_body[notification.body].append(notification)
+
+    sms = AfricasTalkingSMS()
+    sent = failed = 0
+    for body, group in by_body.items():
+        try:
+            results = sms.send_bulk(
+                body, [n.recipient for n in group], retried=[n.recipient for n in group if n.attempts]
+            )
+        except SMSError as e:
+            results = {n.recipient: str(e) for n in group}
+
+        delivered = []
+        for notification in group:
+            error = results.get(notification.recipient, 'No result returned')
+            if error:
+                _mark_failed(notification, error, max_attempts)
+                failed += 1
+            else:
+                delivered.append(notification)
+        _mark_delivered(delivered)
+        sent += len(delivered)
+    return sent, failed
+
+
+def deliver_pending(batch_size=1000, max_attempts=MAX_ATTEMPTS):
+    """Deliver due outbox entries; returns (sent, failed) counts"""
+    notifications = _claim(batch_size)
+    sent, failed = _deliver_sms([n for n in notifications if n.channel == 'sms'], max_attempts)
+
+    emails = [n for n in notifications if n.channel == 'email']
+    results = send_emails(emails)
+    delivered = []
+    for notification in emails:
+        error = results.get(notification.pk, 'No result returned')
+        if error:
+            _mark_failed(notification, error, max_attempts)
+            failed += 1
+        else:
+            delivered.append(notification)
+    _mark_delivered(delivered)
+    sent += len(delivered)
+    return sent, failed
@@ -0,0 +1,124 @@
+"""
+Full-page cache for anonymous catalog pages.
+
+PageCacheMiddleware answers anonymous GET and HEAD requests for the URL
+names in PAGE_CACHE_URL_NAMES straight from the cache, before sessions,
+auth, CSRF and allauth run. A request counts as anonymous when it carries
+no session cookie and no pending messages. Nothing else a catalog page
+shows depends on the client, so the key is just the release and the path.
+Requests with a query string (other than tracking parameters) are not
+cached, so random parameters cannot fill the cache.
+
+A response is only stored if it is a plain 200 that sets no cookies and
+did not use a CSRF token. When an Item is saved or deleted, the home page
+and that item's detail page are purged (see purge_item_pages); a page
+rendered while the catalog version changed is not stored, so a render
+racing the purge cannot put the old page back. Shared
+caches (a CDN) may keep a page for PAGE_CACHE_CDN_MAX_AGE seconds, since
+they cannot be purged from here.
+"""
+
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.urls import Resolver404, resolve, reverse
+
+from .models import Item
+
+logger = logging.getLogger(__name__)
+
+# Query parameters added by ads and social links; they do not change the page
+IGNORED_QUERY_PREFIXES = ('utm_', 'fbclid', 'gclid', 'mc_')
+
+
+def page_key(path):
+    release = getattr(settings, 'RELEASE', '')
+    return f'page:{release}:{hashlib.md5(path.encode(), usedforsecurity=False).hexdigest()}'
+
+
+def cacheable_request(request):
+    """Whether ``request`` may be answered from, and stored in, the page cache"""
+    if request.method not in ('GET', 'HEAD') or not getattr(settings, 'PAGE_CACHE_TIMEOUT', 0):
+        return False
+    if settings.SESSION_COOKIE_NAME in request.COOKIES or 'messages' in request.COOKIES:
+        return False
+    if any(not name.startswith(IGNORED_QUERY_PREFIXES) for name in request.GET):
+        return False
+    return is_cached_url(request.path_info)
+
+
+def is_cached_url(path):
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return False
+    return match.url_name in getattr(settings, 'PAGE_CACHE_URL_NAMES', ())
+
+
+def cacheable_response(request, response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+        and 'private' not in response.get('Cache-Control', '')
+        and 'no-store' not in response.get('Cache-Control', '')
+    )
+
+
+def _entry(response):
+    """(etag, headers, content) as kept in the cache"""
+    etag = f'"{hashlib.md5(response.content, usedforsecurity=False).hexdigest()}"'
+    headers = [(k, v) for k, v in response.items() if k.lower() != 'content-length']
+    return etag, headers, response.content
+
+
+def store(path, response):
+    """Cache ``response`` for ``path``; returns its ETag"""
+    entry = _entry(response)
+    cache.set(page_key(path), entry, settings.PAGE_CACHE_TIMEOUT)
+    return entry[0]
+
+
+async def astore(path, response):
+    entry = _entry(response)
+    await cache.aset(page_key(path), entry, settings.PAGE_CACHE_TIMEOUT)
+    return entry[0]
+
+
+def purge(paths):
+    cache.delete_many([page_key(path) for path in paths])
+    logger.debug(f"Purged cached pages: {', '.join(paths)}")
+
+
+def item_page_paths(item):
+    """Pages that show ``item``"""
+    paths = [reverse('index')]
+    if item.slug:
+        paths.append(item.get_absolute_url())
+    return paths
+
+
+@receiver(pre_save, sender=Item)
+def remember_item_path(sender, instance, **kwargs):
+    # A changed slug moves the detail page; the old URL must go as well
+    if instance.pk:
+        old_slug = Item.objects.filter(pk=instance.pk).values_list('slug', flat=True).first()
+        if old_slug and old_slug != instance.slug:
+            instance._old_page_path = reverse('detail', kwargs={'slug': old_slug})
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+def purge_item_pages(sender, instance, **kwargs):
+    paths = item_page_paths(instance)
+    old_path = getattr(instance, '_old_page_path', None)
+    if old_path:
+        paths.append(old_path)
+    # After commit, or a request racing the save could re-cache the old page
+    transaction.on_commit(lambda: purge(paths))
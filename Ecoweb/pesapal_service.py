@@ -1,46 +1,54 @@
+import asyncio
 import hashlib
 import hmac
 import base64
 import urllib.parse
-import requests
 from django.conf import settings
+from django.core.cache import cache
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 import uuid
 import json
-import re
+import logging
+import time
+
+from . import gateway_metrics
+from .http_client import get_async_client
+from .lazy_imports import lazy_import
+from .phone import normalize_phone
+
+httpx = lazy_import('httpx')
+requests = lazy_import('requests')
+
+logger = logging.getLogger(__name__)
+
+# Pesapal tokens live for 5 minutes; refresh this many seconds before expiry
+TOKEN_EXPIRY_MARGIN = 30
+TOKEN_DEFAULT_TTL = 240
+
+# Payment statuses that never change again, and how long to cache them
+TERMINAL_STATUSES = ('COMPLETED', 'FAILED', 'INVALID', 'REVERSED')
+TERMINAL_STATUS_TTL = 24 * 60 * 60
+# How long callers that waited on a lookup have to pick up its answer
+STATUS_HANDOFF_TTL = 10
 
 class PesapalService:
     def __init__(self):
         self.consumer_key = getattr(settings, 'PESAPAL_CONSUMER_KEY', '')
         self.consumer_secret = getattr(settings, 'PESAPAL_CONSUMER_SECRET', '')
         self.is_sandbox = getattr(settings, 'PESAPAL_IS_SANDBOX', True)
-        self.base_url = "https://cybqa.pesapal.com/pesapalv3" if self.is_sandbox else "https://pay.pesapal.com/v3"
+        default_base_url = "https://cybqa.pesapal.com/pesapalv3" if self.is_sandbox else "https://pay.pesapal.com/v3"
+        self.base_url = getattr(settings, 'PESAPAL_BASE_URL', None) or default_base_url
         self.callback_url = getattr(settings, 'PESAPAL_CALLBACK_URL', '')
         self.ipn_url = getattr(settings, 'PESAPAL_IPN_URL', '')
+        self.timeout = getattr(settings, 'PESAPAL_TIMEOUT', 30)
+        # Tokens and IPN ids belong to one merchant account on one environment
+        account = hashlib.md5(f"{self.base_url}|{self.consumer_key}".encode()).hexdigest()[:12]
+        self.token_cache_key = f'pesapal_access_token_{account}'
+        self.ipn_cache_key_prefix = f'pesapal_ipn_id_{account}'
     
-    def format_phone_number(self, phone):
-        """Format phone number to proper Kenyan format (starting with 254)"""
-        phone = re.sub(r'\D', '', phone)
-        
-        if phone.startswith('0'):
-            if not (phone.startswith('07') or phone.startswith('01')):
-                raise ValueError("Phone number must start with 07 or 01")
-            phone = '254' + phone[1:]
-        elif phone.startswith('254'):
-            if not (phone.startswith('2547') or phone.startswith('2541')):
-                raise ValueError("Phone number must be a valid Kenyan mobile number (7... or 1...)")
-        elif phone.startswith('7') or phone.startswith('1'):
-            phone = '254' + phone
-        else:
-            raise ValueError("Phone number must start with 07, 01 or 254")
-        
-        if len(phone) != 12:
-            raise ValueError(f"Invalid phone number length. Expected 10 digits (07...) or 12 digits (254...)")
-        
-        return phone
-        
-    def get_access_token(self):
-        """Get access token from Pesapal"""
+    def _token_request(self):
         url = f"{self.base_url}/api/Auth/RequestToken"
         
         headers = {
@@ -52,12 +60,69 @@ class PesapalService:
             'consumer_key': self.consumer_key,
             'consumer_secret': self.consumer_secret
         }
-        
-        response = requests.post(url, json=data, headers=headers)
-        
+        return url, data, headers
+
+    def _token_result(self, response):
+        """The token in a RequestToken response and how long it may be cached"""
         if response.status_code == 200:
-            return response.json().get('token')
-        return None
+            result = response.json()
+            return result.get('token'), self._token_ttl(result.get('expiryDate'))
+        return None, 0
+
+    def get_access_token(self):
+        """Get access token from Pesapal, cached until shortly before it expires"""
+        token = cache.get(self.token_cache_key)
+        if token:
+            return token
+
+        url, data, headers = self._token_request()
+        try:
+            with gateway_metrics.call('pesapal_token') as call:
+                response = call.response = requests.post(url, json=data, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            logger.error(f"Error getting Pesapal access token: {e}")
+            return None
+        token, ttl = self._token_result(response)
+        if token and ttl > 0:
+            cache.set(self.token_cache_key, token, ttl)
+        return token
+
+    async def aget_access_token(self):
+        """Async ``get_access_token`` over the pooled httpx client"""
+        token = await cache.aget(self.token_cache_key)
+        if token:
+            return token
+
+        url, data, headers = self._token_request()
+        try:
+            async with gateway_metrics.acall('pesapal_token') as call:
+                response = call.response = await get_async_client().post(url, json=data, headers=headers, timeout=self.timeout)
+        except httpx.HTTPError as e:
+            logger.error(f"Error getting Pesapal access token: {e}")
+            return None
+        token, ttl = self._token_result(response)
+        if token and ttl > 0:
+            await cache.aset(self.token_cache_key, token, ttl)
+        return token
+
+    def _token_ttl(self, expiry_date):
+        """Seconds to cache a token given Pesapal's expiryDate"""
+        expires_at = parse_datetime(expiry_date) if expiry_date else None
+        if expires_at is None:
+            return TOKEN_DEFAULT_TTL
+        if timezone.is_naive(expires_at):
+            expires_at = timezone.make_aware(expires_at, timezone.utc)
+        remaining = (expires_at - timezone.now()).total_seconds() - TOKEN_EXPIRY_MARGIN
+        return int(min(max(remaining, 0), TOKEN_DEFAULT_TTL + TOKEN_EXPIRY_MARGIN))
+
+    def _handle_unauthorized(self, response):
+        # A revoked or expired token must not keep being served from the cache
+        if response.status_code == 401:
+            cache.delete(self.token_cache_key)
+
+    async def _ahandle_unauthorized(self, response):
+        if response.status_code == 401:
+            await cache.adelete(self.token_cache_key)
     
     def register_ipn_url(self, token):
         """Register IPN URL with Pesapal"""
@@ -74,8 +139,26 @@ class PesapalService:
             'ipn_notification_type': 'GET'
         }
         
-        response = requests.post(url, json=data, headers=headers)
+        with gateway_metrics.call('pesapal_register_ipn') as call:
+            response = call.response = requests.post(url, json=data, headers=headers, timeout=self.timeout)
+        self._handle_unauthorized(response)
         return response.json() if response.status_code == 200 else None
+
+    def get_ipn_id(self, token):
+        """IPN id for the configured IPN URL, registering it with Pesapal only once"""
+        cache_key = f"{self.ipn_cache_key_prefix}_{hashlib.md5((self.ipn_url or '').encode()).hexdigest()}"
+        ipn_id = cache.get(cache_key)
+        if ipn_id:
+            return ipn_id
+
+        result = self.register_ipn_url(token)
+        ipn_id = result.get('ipn_id') if result else None
+        if ipn_id:
+            # Registrations do not expire, keep the id until the cache is flushed
+            cache.set(cache_key, ipn_id, None)
+        else:
+            logger.error(f"Failed to register Pesapal IPN URL {self.ipn_url}: {result}")
+        return ipn_id
     
     def submit_order_request(self, order_data, token):
         """Submit order to Pesapal for payment"""
@@ -92,7 +175,7 @@ class PesapalService:
         
         # Format and validate phone number
         try:
-            formatted_phone = self.format_phone_number(order_data['phone'])
+            formatted_phone = normalize_phone(order_data['phone'])
         except ValueError as e:
             return {'status': 'error', 'message': str(e)}
         
@@ -118,7 +201,9 @@ class PesapalService:
             'account_number': '0840182413804'
         }
         
-        response = requests.post(url, json=pesapal_data, headers=headers)
+        with gateway_metrics.call('pesapal_submit_order') as call:
+            response = call.response = requests.post(url, json=pesapal_data, headers=headers, timeout=self.timeout)
+        self._handle_unauthorized(response)
         
         if response.status_code == 200:
             result = response.json()
@@ -131,8 +216,7 @@ class PesapalService:
         
         return {'status': 'error', 'message': 'Failed to submit order'}
     
-    def get_transaction_status(self, order_tracking_id, token):
-        """Get transaction status from Pesapal"""
+    def _status_request(self, order_tracking_id, token):
         url = f"{self.base_url}/api/Transactions/GetTransactionStatus"
         
         headers = {
@@ -141,9 +225,76 @@ class PesapalService:
         }
         
         params = {'orderTrackingId': order_tracking_id}
-        
-        response = requests.get(url, headers=headers, params=params)
-        
+        return url, headers, params
+
+    def _status_result(self, response):
         if response.status_code == 200:
             return response.json()
-        return None
\ No newline at end of file
+        return None
+
+    def get_transaction_status(self, order_tracking_id, token):
+        """Get transaction status from Pesapal"""
+        url, headers, params = self._status_request(order_tracking_id, token)
+        with gateway_metrics.call('pesapal_transaction_status') as call:
+            response = call.response = requests.get(url, headers=headers, params=params, timeout=self.timeout)
+        self._handle_unauthorized(response)
+        return self._status_result(response)
+
+    async def aget_transaction_status(self, order_tracking_id, token):
+        """Async ``get_transaction_status``"""
+        url, headers, params = self._status_request(order_tracking_id, token)
+        async with gateway_metrics.acall('pesapal_transaction_status') as call:
+            response = call.response = await get_async_client().get(url, headers=headers, params=params, timeout=self.timeout)
+        await self._ahandle_unauthorized(response)
+        return self._status_result(response)
+
+    def _status_keys(self, order_tracking_id):
+        result_key = f'pesapal_status_{order_tracking_id}'
+        return result_key, f'{result_key}_lock', self.timeout * 2 + 5
+
+    async def aresolve_transaction_status(self, order_tracking_id):
+        """Transaction status for ``order_tracking_id``, at most one upstream call at a time.
+
+        Concurrent lookups for the same id (the browser callback and the IPN)
+        wait on a cache lock and share the answer of the caller holding it.
+        Only terminal statuses are cached; a later lookup of a pending
+        payment asks Pesapal again, as the IPN means the status just changed.
+        """
+        result_key, lock_key, lock_timeout = self._status_keys(order_tracking_id)
+        deadline = time.monotonic() + lock_timeout
+        lock_token = uuid.uuid4().hex
+
+        while True:
+            result = await cache.aget(result_key)
+            if result:
+                return result
+            if await cache.aadd(lock_key, lock_token, lock_timeout):
+                break
+            holder = await cache.aget(lock_key)
+            while holder and await cache.aget(lock_key) == holder and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+            if holder:
+                handoff = await cache.aget(f'{lock_key}_{holder}')
+                if handoff is not None:
+                    return handoff['result']
+            if time.monotonic() >= deadline:
+                logger.warning(f"Gave up waiting for the Pesapal status lookup of {order_tracking_id}")
+                return None
+            # The holder failed without an answer; try to take the lock
+
+        result = None
+        try:
+            token = await self.aget_access_token()
+            if token:
+                result = await self.aget_transaction_status(order_tracking_id, token)
+        except httpx.HTTPError as e:
+            logger.error(f"Pesapal status lookup for {order_tracking_id} failed: {e}")
+        finally:
+            # Publish the answer before releasing the lock, so no waiter misses it
+            if result and result.get('payment_status_description', '').upper() in TERMINAL_STATUSES:
+                await cache.aset(result_key, result, TERMINAL_STATUS_TTL)
+            if result:
+                await cache.aset(f'{lock_key}_{lock_token}', {'result': result}, STATUS_HANDOFF_TTL)
+            if await cache.aget(lock_key) == lock_token:
+                await cache.adelete(lock_key)
+        return result
@@ -0,0 +1,66 @@
+"""
+Kenyan mobile number normalization shared by M-Pesa, Pesapal, SMS and the
+phone confirmation API.
+
+Accepts 07XXXXXXXX / 01XXXXXXXX, 2547XXXXXXXX / 2541XXXXXXXX and the bare
+7XXXXXXXX / 1XXXXXXXX forms, ignoring any non-digit characters (spaces,
+dashes, a leading +), and returns the 12-digit 254... form.
+"""
+
+import re
+from functools import lru_cache
+
+_NON_DIGITS = re.compile(r'\D')
+_MOBILE = re.compile(r'(?:0|254)?([17]\d{8})')
+
+
+class InvalidPhoneNumber(ValueError):
+    pass
+
+
+def _normalize(phone):
+    digits = _NON_DIGITS.sub('', phone)
+    match = _MOBILE.fullmatch(digits)
+    if match:
+        return '254' + match.group(1)
+
+    # Slow path only for rejected numbers, to say what is wrong with them
+    if digits.startswith('0'):
+        if not digits.startswith(('07', '01')):
+            raise InvalidPhoneNumber("Phone number must start with 07 or 01")
+    elif digits.startswith('254'):
+        if not digits.startswith(('2547', '2541')):
+            raise InvalidPhoneNumber("Phone number must be a valid Kenyan mobile number (7... or 1...)")
+    elif not digits.startswith(('7', '1')):
+        raise InvalidPhoneNumber("Phone number must start with 07, 01 or 254")
+    raise InvalidPhoneNumber("Invalid phone number length. Expected 10 digits (07...) or 12 digits (254...)")
+
+
+@lru_cache(maxsize=4096)
+def normalize_phone(phone):
+    """Return the 254XXXXXXXXX form of a Kenyan mobile number; raises InvalidPhoneNumber"""
+    return _normalize(phone)
+
+
+def normalize_phone_or_none(phone):
+    """Like normalize_phone, but returns None for missing or invalid numbers"""
+    if not phone:
+        return None
+    try:
+        return normalize_phone(phone)
+    except InvalidPhoneNumber:
+        return None
+
+
+def normalize_phones(phones):
+    """Lazily normalize an iterable of numbers, yielding ``(phone, normalized_or_None)``.
+
+    Meant for imports and SMS blasts: it holds one number at a time and skips
+    the memo, whose entries would only be evicted again by unique numbers.
+    """
+    normalize = _normalize
+    for phone in phones:
+        try:
+            yield phone, normalize(phone) if phone else None
+        except InvalidPhoneNumber:
+            yield phone, None
@@ -13,15 +13,16 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 import os
 from pathlib import Path
 import dj_database_url
-from decouple import config
-from dotenv import load_dotenv
-
-# Load environment variables from .env file
-load_dotenv()
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Load environment variables from .env file (local development; Render sets
+# them on the service, so workers skip importing python-dotenv)
+if (BASE_DIR / '.env').exists():
+    from dotenv import load_dotenv
+    load_dotenv(BASE_DIR / '.env')
+
 # Render Deployment Helpers
 RENDER_EXTERNAL_HOSTNAME = os.environ.get('RENDER_EXTERNAL_HOSTNAME')
 
@@ -83,14 +84,21 @@ INSTALLED_APPS = [
     'allauth',
     'allauth.account',
     'allauth.socialaccount',
-    'django_extensions',
     'Ecoweb'
 
 ]
 
+# Development helpers (shell_plus, runserver_plus) are not loaded in production
+if DEBUG:
+    INSTALLED_APPS.append('django_extensions')
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'Ecoweb.middleware.AsyncWhiteNoiseMiddleware',
+    'Ecoweb.middleware.MediaFilesMiddleware',
+    'Ecoweb.middleware.RequestMetricsMiddleware',
+    'Ecoweb.middleware.PageCacheMiddleware',
+    'Ecoweb.middleware.ReplicaPinMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -104,7 +112,10 @@ ROOT_URLCONF = 'Ecoweb.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Django's backend, with render time counted in request metrics
+        'BACKEND': 'Ecoweb.template_backend.TimedDjangoTemplates',
+        # Keep the alias templates are looked up by (engines['django'])
+        'NAME': 'django',
         'DIRS': [BASE_DIR / 'templates']
         ,
         'APP_DIRS': True,
@@ -114,6 +125,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'Ecoweb.fragment_cache.fragment_cache',
             ],
         },
     },
@@ -123,9 +135,12 @@ WSGI_APPLICATION = 'Ecoweb.wsgi.application'
 
 # Database - Render optimized
 DATABASE_URL = os.environ.get('DATABASE_URL')
+# Persistent connections are per thread; under ASGI every sync_to_async call
+# may land on a new thread, so the ASGI web service sets this to 0
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 600))
 if DATABASE_URL:
     DATABASES = {
-        'default': dj_database_url.parse(DATABASE_URL, conn_max_age=600)
+        'default': dj_database_url.parse(DATABASE_URL, conn_max_age=DB_CONN_MAX_AGE)
     }
 else:
     DATABASES = {
@@ -135,6 +150,17 @@ else:
         }
     }
 
+# Optional read replica for catalog pages (see Ecoweb/db_routers.py)
+DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+if DATABASE_REPLICA_URL:
+    DATABASES['replica'] = dj_database_url.parse(DATABASE_REPLICA_URL, conn_max_age=DB_CONN_MAX_AGE)
+    # Tests run against the primary only
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+DATABASE_ROUTERS = ['Ecoweb.db_routers.ReplicaRouter']
+# After a write, the client reads from the primary for this many seconds
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', '10'))
+REPLICA_PIN_COOKIE = 'pin_primary'
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -172,8 +198,12 @@ STATICFILES_DIRS = [
     BASE_DIR / "static"
 ]
 STATIC_ROOT = BASE_DIR / 'staticfiles'
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage' if not DEBUG else 'django.contrib.staticfiles.storage.StaticFilesStorage'
+STATICFILES_STORAGE = 'Ecoweb.storage.StaticFilesStorage' if not DEBUG else 'django.contrib.staticfiles.storage.StaticFilesStorage'
 WHITENOISE_USE_FINDERS = DEBUG
+# Only the hashed copies are served (with immutable caching); templates always go through {% static %}
+WHITENOISE_KEEP_ONLY_HASHED_FILES = True
+# Serve the bundles built by `manage.py build_assets` instead of the individual source files
+STATIC_BUNDLES = os.environ.get('STATIC_BUNDLES', str(not DEBUG)).lower() in ('true', '1', 'yes')
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
@@ -201,13 +231,29 @@ EMAIL_USE_TLS = os.environ.get('DJANGO_EMAIL_USE_TLS', 'True').lower() in ('true
 EMAIL_USE_SSL = os.environ.get('DJANGO_EMAIL_USE_SSL', 'False').lower() in ('true','1','yes')
 DEFAULT_FROM_EMAIL = os.environ.get('DJANGO_DEFAULT_FROM_EMAIL', 'webmaster@localhost')
 
-MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# SMS (Africa's Talking), delivered from the notification outbox by `manage.py send_notifications`
+AFRICAS_TALKING_API_KEY = os.environ.get('AFRICAS_TALKING_API_KEY', '')
+AFRICAS_TALKING_USERNAME = os.environ.get('AFRICAS_TALKING_USERNAME', '')
+SMS_SENDER_ID = os.environ.get('SMS_SENDER_ID', 'YourStore')
+SMS_TIMEOUT = int(os.environ.get('SMS_TIMEOUT', '10'))
+# Point at a local fake gateway for testing; recipients per bulk messaging request
+AFRICAS_TALKING_BASE_URL = os.environ.get('AFRICAS_TALKING_BASE_URL', 'https://api.africastalking.com')
+SMS_BATCH_SIZE = int(os.environ.get('SMS_BATCH_SIZE', '1000'))
+
+# Set MEDIA_URL to a pull-through CDN URL to serve uploads from its edge; this app stays the origin
+MEDIA_URL = os.environ.get('MEDIA_URL', '/media/')
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
+# Uploads are saved under content-hashed names and cached forever; older unhashed ones for MEDIA_MAX_AGE seconds
+DEFAULT_FILE_STORAGE = 'Ecoweb.storage.HashedMediaStorage'
+MEDIA_MAX_AGE = int(os.environ.get('MEDIA_MAX_AGE', 3600))
 
 # Pesapal Configuration
 PESAPAL_CONSUMER_KEY = os.environ.get('PESAPAL_CONSUMER_KEY', '3O5zLy+k7YTlamrZ+efC9r8XqYEMcv1l')
 PESAPAL_CONSUMER_SECRET = os.environ.get('PESAPAL_CONSUMER_SECRET', 'peHydzyxd0zBut2GaNdKpDN5HS8=')
 PESAPAL_IS_SANDBOX = os.environ.get('PESAPAL_IS_SANDBOX', 'True').lower() in ('true', '1', 'yes')
+# Optional override of the sandbox/live API root, e.g. for the local fake gateway
+PESAPAL_BASE_URL = os.environ.get('PESAPAL_BASE_URL')
+PESAPAL_TIMEOUT = int(os.environ.get('PESAPAL_TIMEOUT', '30'))
 
 # Dynamic Pesapal URLs
 PESAPAL_CALLBACK_URL = os.environ.get('PESAPAL_CALLBACK_URL')
@@ -243,22 +289,39 @@ if RENDER_EXTERNAL_HOSTNAME and not MPESA_CALLBACK_URL:
 elif DEBUG and not MPESA_CALLBACK_URL:
     MPESA_CALLBACK_URL = "http://127.0.0.1:8000/mpesa/callback/"
 
-# M-Pesa URLs based on environment
-if MPESA_IS_SANDBOX:
-    MPESA_BASE_URL = 'https://sandbox.safaricom.co.ke'
-else:
-    MPESA_BASE_URL = 'https://api.safaricom.co.ke'
+# M-Pesa URLs based on environment (MPESA_BASE_URL can point at `manage.py run_fake_gateway`)
+MPESA_BASE_URL = os.environ.get('MPESA_BASE_URL')
+if not MPESA_BASE_URL:
+    if MPESA_IS_SANDBOX:
+        MPESA_BASE_URL = 'https://sandbox.safaricom.co.ke'
+    else:
+        MPESA_BASE_URL = 'https://api.safaricom.co.ke'
+
+# Daraja request timeout and circuit breaker (shared across workers via the cache)
+MPESA_TIMEOUT = int(os.environ.get('MPESA_TIMEOUT', '30'))
+# Seconds a pending STK push is reused for repeat checkouts of the same order and amount
+MPESA_STK_DEDUP_WINDOW = int(os.environ.get('MPESA_STK_DEDUP_WINDOW', '120'))
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_BREAKER_FAILURE_THRESHOLD', '5'))
+CIRCUIT_BREAKER_RECOVERY_TIMEOUT = int(os.environ.get('CIRCUIT_BREAKER_RECOVERY_TIMEOUT', '60'))
+
+# Connection pool shared by the async Daraja/Pesapal calls in each worker
+HTTP_CLIENT_MAX_CONNECTIONS = int(os.environ.get('HTTP_CLIENT_MAX_CONNECTIONS', '200'))
+HTTP_CLIENT_MAX_KEEPALIVE = int(os.environ.get('HTTP_CLIENT_MAX_KEEPALIVE', '50'))
 
 # Caches - Render optimized
 REDIS_URL = os.environ.get('REDIS_URL')
 if REDIS_URL:
+    # Hot keys are also kept in a small per-process LRU for up to
+    # CACHE_L1_TIMEOUT seconds; writes are broadcast so other workers drop theirs
     CACHES = {
         'default': {
-            'BACKEND': 'django_redis.cache.RedisCache',
+            'BACKEND': 'Ecoweb.cache_backends.TwoTierRedisCache',
             'LOCATION': REDIS_URL,
             'OPTIONS': {
                 'CLIENT_CLASS': 'django_redis.client.DefaultClient',
                 'CONNECTION_POOL_KWARGS': {'max_connections': 20},
+                'L1_MAX_ENTRIES': int(os.environ.get('CACHE_L1_MAX_ENTRIES', '1000')),
+                'L1_TIMEOUT': float(os.environ.get('CACHE_L1_TIMEOUT', '2')),
             },
             'TIMEOUT': 300,
         }
@@ -271,6 +334,27 @@ else:
         }
     }
 
+# Template fragments ({% cache %}) are keyed on the release and the catalog version (see
+# Ecoweb/fragment_cache.py). Off by default under DEBUG, where templates change without a deploy.
+FRAGMENT_CACHE_TIMEOUT = int(os.environ.get('FRAGMENT_CACHE_TIMEOUT', 0 if DEBUG else 86400))
+RELEASE = os.environ.get('RELEASE') or os.environ.get('RENDER_GIT_COMMIT', 'dev')
+# Whole-page cache for anonymous visitors (see Ecoweb/page_cache.py); 0 turns it off.
+# A CDN may keep pages for PAGE_CACHE_CDN_MAX_AGE seconds, as it is not purged on Item changes.
+PAGE_CACHE_TIMEOUT = int(os.environ.get('PAGE_CACHE_TIMEOUT', 0 if DEBUG else 600))
+PAGE_CACHE_CDN_MAX_AGE = int(os.environ.get('PAGE_CACHE_CDN_MAX_AGE', 60))
+PAGE_CACHE_URL_NAMES = ['index', 'detail', 'about', 'contact']
+
+# Bearer token Prometheus sends to scrape /metrics; without one, /metrics is only served under DEBUG
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Queries slower than this many ms are logged and EXPLAINed (see Ecoweb/slow_queries.py); 0 turns it off
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+# How many query shapes to list, by total time, and how long to keep them after they were last seen
+SLOW_QUERY_TOP_N = int(os.environ.get('SLOW_QUERY_TOP_N', 50))
+SLOW_QUERY_RETENTION = int(os.environ.get('SLOW_QUERY_RETENTION', 7 * 86400))
+# Hours of M-Pesa payment latency histograms to keep (see Ecoweb/stk_latency.py)
+STK_LATENCY_HOURS = int(os.environ.get('STK_LATENCY_HOURS', 168))
+
 # Logging - Render optimized
 LOG_LEVEL = os.environ.get('DJANGO_LOG_LEVEL', 'INFO')
 LOGGING = {
@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Sent once per order, after the transaction that marks it paid has committed.
+# Receivers get ``order`` (the Order instance, already updated).
+order_paid = Signal()
@@ -0,0 +1,209 @@
+"""
+Slow-query log.
+
+Every database connection gets an execute wrapper that times its queries.
+A query slower than SLOW_QUERY_MS is logged with the view being served and
+the innermost frame of our own code that issued it, and counted against
+its shape: the SQL with literals, placeholders and IN/VALUES lists
+collapsed, so ``pk IN (1, 2)`` and ``pk IN (3, 4, 5)`` are one shape.
+
+The first time a shape is seen, its plan is captured with EXPLAIN
+(EXPLAIN QUERY PLAN on SQLite) on the same connection. Neither runs the
+statement. Shapes and their plans live in the shared cache, like the
+gateway counters, so every worker adds to one log; ``manage.py slow_queries``
+prints the SLOW_QUERY_TOP_N shapes with the most total time. Entries expire
+SLOW_QUERY_RETENTION seconds after they were last seen.
+
+Queries under the threshold cost two perf_counter() calls.
+"""
+
+import contextvars
+import hashlib
+import logging
+import re
+import sys
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+SHAPE_COUNT_KEY = 'slowq:shapes'
+NO_REQUEST = '(no request)'
+
+# Statements EXPLAIN can describe without running them
+EXPLAINABLE = ('SELECT', 'WITH', 'UPDATE', 'DELETE')
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%s|\?')
+_IN_LIST = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+_VALUES_ROWS = re.compile(r'(\(\s*\?(?:\s*,\s*\?)*\s*\))(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))+')
+_SPACE = re.compile(r'\s+')
+
+# Set while the log itself talks to the database (EXPLAIN, a database cache)
+_recording = contextvars.ContextVar('slow_query_recording', default=False)
+
+
+def normalize(sql):
+    """The query's shape: literals and placeholders as ?, lists collapsed"""
+    shape = _STRING.sub('?', sql)
+    shape = _NUMBER.sub('?', shape)
+    shape = _PLACEHOLDER.sub('?', shape)
+    shape = _IN_LIST.sub('IN (...)', shape)
+    shape = _VALUES_ROWS.sub(r'\1, ...', shape)
+    return _SPACE.sub(' ', shape).strip()
+
+
+def fingerprint(shape):
+    return hashlib.sha1(shape.encode()).hexdigest()[:16]
+
+
+def _key(fp, field):
+    return f'slowq:{fp}:{field}'
+
+
+def _shape_key(slot):
+    return f'slowq:shape:{slot}'
+
+
+# The execute wrappers are ours too, but never where a query comes from
+_WRAPPER_FILES = {__file__, metrics.__file__}
+
+
+def caller():
+    """``path:line in function`` of the innermost frame in the project's own code"""
+    root = str(settings.BASE_DIR)
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(root) and 'site-packages' not in filename and filename not in _WRAPPER_FILES:
+            return f'{Path(filename).relative_to(root)}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return None
+
+
+def explain(connection, sql, params):
+    """The plan for a statement, or None if it cannot be explained"""
+    if not sql.lstrip().upper().startswith(EXPLAINABLE):
+        return None
+    try:
+        # A failed EXPLAIN must not abort the caller's transaction on Postgres
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+                rows = cursor.fetchall()
+    except Exception as e:
+        logger.info(f"Could not EXPLAIN slow query: {e}")
+        return None
+    if connection.vendor == 'sqlite':
+        # (id, parent, notused, detail)
+        return '\n'.join(str(row[-1]) for row in rows)
+    return '\n'.join(' | '.join(str(column) for column in row) for row in rows)
+
+
+def _incr(key, delta, timeout):
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        if not cache.add(key, delta, timeout):
+            cache.incr(key, delta)
+    cache.touch(key, timeout)
+
+
+def record(connection, sql, params, many, seconds):
+    timings = metrics.current()
+    view = (timings.view or 'unmatched') if timings is not None else NO_REQUEST
+    frame = caller()
+    ms = seconds * 1000
+    logger.warning(f"Slow query ({ms:.0f} ms) in {view} at {frame}: {sql[:500]}")
+
+    retention = getattr(settings, 'SLOW_QUERY_RETENTION', 7 * 86400)
+    shape = normalize(sql)
+    fp = fingerprint(shape)
+    detail = {'shape': shape, 'sql': sql[:2000], 'view': view, 'frame': frame, 'plan': None, 'vendor': connection.vendor}
+    # Only the worker that adds the shape registers it and runs EXPLAIN
+    if cache.add(_key(fp, 'detail'), detail, retention):
+        # Each shape takes its own slot from an atomic counter, so workers seeing
+        # new shapes at the same time cannot overwrite each other. The counter
+        # never expires: a slot number is never handed out twice
+        slot = 1 if cache.add(SHAPE_COUNT_KEY, 1, None) else cache.incr(SHAPE_COUNT_KEY)
+        cache.set(_shape_key(slot), fp, retention)
+        if not many:
+            detail['plan'] = explain(connection, sql, params)
+            cache.set(_key(fp, 'detail'), detail, retention)
+
+    _incr(_key(fp, 'count'), 1, retention)
+    _incr(_key(fp, 'total_ms'), round(ms), retention)
+    max_key = _key(fp, 'max_ms')
+    if ms > (cache.get(max_key) or 0):
+        cache.set(max_key, round(ms), retention)
+    cache.set(_key(fp, 'last'), {'at': timezone.now().isoformat(), 'view': view, 'frame': frame}, retention)
+
+
+def log_slow_query(execute, sql, params, many, context):
+    threshold = getattr(settings, 'SLOW_QUERY_MS', 0)
+    if not threshold or _recording.get():
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    result = execute(sql, params, many, context)
+    seconds = time.perf_counter() - start
+    if seconds * 1000 >= threshold:
+        token = _recording.set(True)
+        try:
+            record(context['connection'], sql, params, many, seconds)
+        except Exception as e:
+            # The log must never fail the query it is describing
+            logger.warning(f"Could not record slow query: {e}")
+        finally:
+            _recording.reset(token)
+    return result
+
+
+def _slots():
+    """Keys of the slots record() has handed out"""
+    count = cache.get(SHAPE_COUNT_KEY, 0)
+    return [_shape_key(slot) for slot in range(1, count + 1)]
+
+
+def top(limit=None, order='total_ms'):
+    """The SLOW_QUERY_TOP_N shapes with the most total time, slowest first by
+    ``order`` (total_ms, max_ms, avg_ms or count)"""
+    # A shape seen again after it expired has a second slot; a slot still
+    # being written is simply missing
+    fps = list(dict.fromkeys(cache.get_many(_slots()).values()))
+    fields = ('detail', 'count', 'total_ms', 'max_ms', 'last')
+    values = cache.get_many([_key(fp, field) for fp in fps for field in fields])
+    entries = []
+    for fp in fps:
+        entry = {field: values.get(_key(fp, field)) for field in fields}
+        if not entry['detail'] or not entry['count']:
+            continue
+        entry['fingerprint'] = fp
+        entry['avg_ms'] = entry['total_ms'] / entry['count']
+        entries.append(entry)
+    entries.sort(key=lambda entry: -(entry['total_ms'] or 0))
+    entries = entries[:getattr(settings, 'SLOW_QUERY_TOP_N', 50)]
+    entries.sort(key=lambda entry: -(entry[order] or 0))
+    return entries[:limit]
+
+
+def reset():
+    slots = _slots()
+    fps = set(cache.get_many(slots).values())
+    fields = ('detail', 'count', 'total_ms', 'max_ms', 'last')
+    cache.delete_many([SHAPE_COUNT_KEY] + slots + [_key(fp, field) for fp in fps for field in fields])
+
+
+@receiver(connection_created)
+def install_slow_query_log(sender, connection, **kwargs):
+    if log_slow_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(log_slow_query)
@@ -0,0 +1,136 @@
+import logging
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import gateway_metrics
+from .lazy_imports import lazy_import
+
+requests = lazy_import('requests')
+
+logger = logging.getLogger(__name__)
+
+# Africa's Talking per-recipient status codes that mean the message was accepted
+SUCCESS_STATUS_CODES = (100, 101, 102)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Process-wide session so bulk sends reuse pooled keep-alive connections"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def _normalize(number):
+    return str(number).strip().lstrip('+')
+
+
+class SMSError(Exception):
+    """The whole bulk request failed; no recipient was sent"""
+
+
+class AfricasTalkingSMS:
+    """Sends SMS through Africa's Talking, one request per batch of identical messages"""
+
+    def __init__(self):
+        self.api_key = getattr(settings, 'AFRICAS_TALKING_API_KEY', '')
+        self.username = getattr(settings, 'AFRICAS_TALKING_USERNAME', '')
+        self.sender_id = getattr(settings, 'SMS_SENDER_ID', 'YourStore')
+        self.base_url = getattr(settings, 'AFRICAS_TALKING_BASE_URL', 'https://api.africastalking.com').rstrip('/')
+        self.timeout = getattr(settings, 'SMS_TIMEOUT', 10)
+        self.batch_size = getattr(settings, 'SMS_BATCH_SIZE', 1000)
+
+    @property
+    def configured(self):
+        return bool(self.api_key and self.username)
+
+    def send_bulk(self, message, recipients, retried=()):
+        """Send one message to many numbers.
+
+        Returns ``{number: error}`` where error is None for numbers Africa's
+        Talking accepted. Numbers missing from the response count as failed,
+        as do all numbers of a batch whose request failed as a whole; other
+        batches are unaffected. Raises SMSError if credentials are missing.
+        ``retried`` lists the recipients whose earlier attempt failed, for
+        the gateway metrics.
+        """
+        if not self.configured:
+            raise SMSError("Africa's Talking credentials are not configured")
+
+        # Keep the caller's spelling of each number while matching on digits only
+        numbers = OrderedDict((_normalize(r), r) for r in recipients)
+        results = {}
+        retried = {_normalize(r) for r in retried}
+        pending = list(numbers)
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start:start + self.batch_size]
+            retries = sum(1 for number in batch if number in retried)
+            try:
+                batch_results = self._send_batch(message, batch, retries)
+            except SMSError as e:
+                # Earlier batches were already accepted; only this one failed
+                logger.warning(f"SMS batch of {len(batch)} failed: {e}")
+                batch_results = {number: str(e) for number in batch}
+            for number, error in batch_results.items():
+                results[numbers[number]] = error
+        return results
+
+    def send(self, phone, message):
+        """Send a single SMS; raises SMSError unless it was accepted"""
+        error = self.send_bulk(message, [phone]).get(phone, 'No result returned')
+        if error:
+            raise SMSError(error)
+
+    def _send_batch(self, message, numbers, retries=0):
+        try:
+            with gateway_metrics.call('africastalking_messaging', retries) as call:
+                response = call.response = get_session().post(
+                    f'{self.base_url}/version1/messaging',
+                    headers={
+                        'Accept': 'application/json',
+                        'Content-Type': 'application/x-www-form-urlencoded',
+                        'apiKey': self.api_key
+                    },
+                    data={
+                        'username': self.username,
+                        'to': ','.join(f'+{n}' for n in numbers),
+                        'message': message,
+                        'from': self.sender_id
+                    },
+                    timeout=self.timeout
+                )
+        except requests.RequestException as e:
+            raise SMSError(f"Africa's Talking request failed: {e}") from e
+
+        if response.status_code != 201:
+            raise SMSError(f"Africa's Talking returned {response.status_code}: {response.text[:200]}")
+
+        try:
+            recipients = response.json()['SMSMessageData']['Recipients']
+        except (ValueError, KeyError, TypeError) as e:
+            raise SMSError(f"Unexpected Africa's Talking response: {response.text[:200]}") from e
+
+        results = {number: 'No result returned' for number in numbers}
+        for recipient in recipients:
+            number = _normalize(recipient.get('number', ''))
+            if number not in results:
+                continue
+            if recipient.get('statusCode') in SUCCESS_STATUS_CODES:
+                results[number] = None
+            else:
+                results[number] = f"{recipient.get('status', 'Failed')} ({recipient.get('statusCode')})"
+
+        sent = sum(1 for error in results.values() if error is None)
+        logger.info(f"Africa's Talking accepted {sent}/{len(numbers)} recipients")
+        return results
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from . import stk_latency
+from .models import MpesaTransaction
+from .mpesa_service import MpesaService
+
+logger = logging.getLogger(__name__)
+
+
+def _dedup_window():
+    return getattr(settings, 'MPESA_STK_DEDUP_WINDOW', 120)
+
+
+def _keys(order, amount):
+    amount = Decimal(str(amount)).quantize(Decimal('0.01'))
+    base = f'stk_push_{order.pk}_{amount}'
+    return f'{base}_result', f'{base}_lock'
+
+
+def _still_pending(response):
+    checkout_request_id = response['checkout_request_id']
+    if checkout_request_id.startswith('test_'):
+        return cache.get(f'test_status_{checkout_request_id}') is None
+    return MpesaTransaction.objects.filter(checkout_request_id=checkout_request_id, status='PENDING').exists()
+
+
+def _existing_push(order, amount, result_key):
+    """Return the response of a push for this order and amount that is still pending"""
+    cached = cache.get(result_key)
+    if cached and _still_pending(cached):
+        return cached
+
+    # The cache can be cold (restart, other worker under LocMemCache); the
+    # transaction table is the source of truth for real pushes
+    transaction = (
+        MpesaTransaction.objects
+        .filter(
+            order=order,
+            amount=Decimal(str(amount)).quantize(Decimal('0.01')),
+            status='PENDING',
+            created_at__gte=timezone.now() - timedelta(seconds=_dedup_window()),
+        )
+        .order_by('-created_at')
+        .first()
+    )
+    if transaction:
+        return {
+            'status': 'success',
+            'checkout_request_id': transaction.checkout_request_id,
+            'merchant_request_id': transaction.merchant_request_id,
+            'message': f'Payment prompt already sent to {transaction.phone_number}. Check your phone for M-Pesa notification.'
+        }
+    return None
+
+
+def _deduplicated(response):
+    logger.info(f"Reusing pending STK push {response['checkout_request_id']}")
+    return dict(response, deduplicated=True)
+
+
+async def ainitiate_order_stk_push(order, phone_number, amount, description="Payment"):
+    """Send an STK push for an order, at most once per order and amount.
+
+    While an earlier push for the same order and amount is in flight or still
+    pending within MPESA_STK_DEDUP_WINDOW seconds, its response is returned
+    instead of prompting the customer again. Concurrent duplicates wait on a
+    cache lock and share the result of the first request.
+    """
+    result_key, lock_key = _keys(order, amount)
+    window = _dedup_window()
+
+    existing = await sync_to_async(_existing_push)(order, amount, result_key)
+    if existing:
+        return _deduplicated(existing)
+
+    mpesa_service = MpesaService()
+    # Long enough for a token fetch plus the push itself
+    lock_timeout = mpesa_service.timeout * 2 + 5
+    token = uuid.uuid4().hex
+
+    if not await cache.aadd(lock_key, token, lock_timeout):
+        deadline = time.monotonic() + lock_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+            existing = await cache.aget(result_key)
+            # A push the customer has since paid or cancelled must not be handed out
+            if existing and await sync_to_async(_still_pending)(existing):
+                return _deduplicated(existing)
+            if await cache.aget(lock_key) is None:
+                # The other request finished without a usable push; try again
+                return await ainitiate_order_stk_push(order, phone_number, amount, description)
+        return {'status': 'error', 'message': 'A payment request for this order is already in progress.'}
+
+    try:
+        existing = await sync_to_async(_existing_push)(order, amount, result_key)
+        if existing:
+            return _deduplicated(existing)
+
+        push_sent_at = timezone.now()
+        response = await mpesa_service.ainitiate_stk_push(
+            phone_number=phone_number,
+            amount=amount,
+            order_id=order.id,
+            description=description
+        )
+
+        if response['status'] == 'success':
+            # Create M-Pesa transaction record (only for real transactions)
+            if not response['checkout_request_id'].startswith('test_'):
+                transaction = await MpesaTransaction.objects.acreate(
+                    order=order,
+                    checkout_request_id=response['checkout_request_id'],
+                    merchant_request_id=response['merchant_request_id'],
+                    phone_number=phone_number,
+                    amount=amount,
+                    push_sent_at=push_sent_at,
+                    push_accepted_at=timezone.now(),
+                )
+                await sync_to_async(stk_latency.push_accepted)(transaction)
+            await cache.aset(result_key, response, window)
+        return response
+    finally:
+        if await cache.aget(lock_key) == token:
+            await cache.adelete(lock_key)
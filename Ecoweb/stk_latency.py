@@ -0,0 +1,168 @@
+"""
+How long M-Pesa payments take, stage by stage.
+
+Each MpesaTransaction carries the time its STK push was sent and accepted,
+when Daraja's callback arrived and when it settled (by callback or by a
+status query). As a stage completes, its duration goes into a histogram
+for the hour it completed in and the Daraja ResultCode:
+
+- ``push``: push sent -> accepted by Daraja
+- ``callback``: push accepted -> callback received (includes the customer
+  entering their PIN)
+- ``delivery``: TransactionDate -> callback received, Safaricom's lag in
+  telling us about a completed payment
+- ``settled_by_callback`` / ``settled_by_poll``: push accepted -> settled,
+  what the customer waits on the payment page
+
+Like the gateway counters, the histograms are cache counters shared by all
+workers and updated as payments happen, so reading them never scans the
+transaction table. Hours older than STK_LATENCY_HOURS expire.
+``manage.py stk_latency`` prints them.
+"""
+
+import bisect
+import logging
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import MpesaTransaction
+
+logger = logging.getLogger(__name__)
+
+PUSH = 'push'
+CALLBACK = 'callback'
+DELIVERY = 'delivery'
+SETTLED = 'settled_by_{via}'
+
+# settled_via values
+VIA_CALLBACK = 'callback'
+VIA_POLL = 'poll'
+
+# Seconds; customers have about a minute to enter their PIN
+BUCKETS = (0.5, 1, 2, 5, 10, 15, 20, 30, 45, 60, 90, 120, 300)
+
+
+def _hour(at):
+    return at.astimezone(dt_timezone.utc).strftime('%Y%m%d%H')
+
+
+def _key(hour, label, field):
+    return f'stk_latency:{hour}:{label}:{field}'
+
+
+def _label_count_key(hour):
+    return f'stk_latency:{hour}:labels'
+
+
+def _label_key(hour, slot):
+    return f'stk_latency:{hour}:label:{slot}'
+
+
+def _retention():
+    return getattr(settings, 'STK_LATENCY_HOURS', 168) * 3600
+
+
+def _incr(key, delta, timeout):
+    """Increment a counter that expires ``timeout`` seconds after it was created; True if it was created"""
+    try:
+        cache.incr(key, delta)
+        return False
+    except ValueError:
+        if cache.add(key, delta, timeout):
+            return True
+        cache.incr(key, delta)
+        return False
+
+
+def record(stage, result_code, start, end):
+    """Count a stage that ran from ``start`` to ``end`` in the histogram for end's hour"""
+    if start is None or end is None:
+        return
+    try:
+        seconds = max(0.0, (end - start).total_seconds())
+        hour, label, timeout = _hour(end), f'{stage}:{result_code}', _retention()
+        _incr(_key(hour, label, f'bucket:{bisect.bisect_left(BUCKETS, seconds)}'), 1, timeout)
+        if _incr(_key(hour, label, 'sum_ms'), round(seconds * 1000), timeout):
+            # Labels are open-ended; remember which this hour has. Each new label
+            # takes its own slot from an atomic counter, so workers adding labels
+            # at the same time cannot overwrite each other
+            slot = 1 if cache.add(_label_count_key(hour), 1, timeout) else cache.incr(_label_count_key(hour))
+            cache.set(_label_key(hour, slot), label, timeout)
+    except Exception as e:
+        # Analytics must never fail a payment
+        logger.warning(f"Could not record STK {stage} latency: {e}")
+
+
+def push_accepted(transaction):
+    record(PUSH, '0', transaction.push_sent_at, transaction.push_accepted_at)
+
+
+def callback_received(transaction, at):
+    """Record Daraja's callback and settle the transaction by it, each once"""
+    start = transaction.push_accepted_at or transaction.created_at
+    # Daraja retries callbacks it thinks we missed
+    if MpesaTransaction.objects.filter(pk=transaction.pk, callback_received_at__isnull=True).update(callback_received_at=at):
+        transaction.callback_received_at = at
+        record(CALLBACK, transaction.result_code, start, at)
+        record(DELIVERY, transaction.result_code, transaction.transaction_date, at)
+    settle(transaction, VIA_CALLBACK, at)
+
+
+def settle(transaction, via, at=None):
+    """Mark the transaction settled; only the first of the callback and a status query counts"""
+    at = at or timezone.now()
+    if MpesaTransaction.objects.filter(pk=transaction.pk, settled_at__isnull=True).update(settled_at=at, settled_via=via):
+        transaction.settled_at, transaction.settled_via = at, via
+        record(SETTLED.format(via=via), transaction.result_code, transaction.push_accepted_at or transaction.created_at, at)
+
+
+def snapshot(hours=24, now=None):
+    """``{hour: {label: {'buckets', 'sum_ms', 'count'}}}`` for the last ``hours`` hours, oldest first"""
+    now = now or timezone.now()
+    hour_keys = [_hour(now - timedelta(hours=n)) for n in reversed(range(hours))]
+    counts = cache.get_many([_label_count_key(hour) for hour in hour_keys])
+    slots = {
+        _label_key(hour, slot): hour
+        for hour in hour_keys
+        for slot in range(1, counts.get(_label_count_key(hour), 0) + 1)
+    }
+    # A slot whose label is still being written is simply missing
+    slot_labels = cache.get_many(list(slots))
+
+    keys = {}
+    fields = [f'bucket:{i}' for i in range(len(BUCKETS) + 1)] + ['sum_ms']
+    for slot_key, label in slot_labels.items():
+        hour = slots[slot_key]
+        keys.update({_key(hour, label, field): (hour, label, field) for field in fields})
+    values = cache.get_many(keys)
+
+    stats = {}
+    for key, (hour, label, field) in keys.items():
+        entry = stats.setdefault(hour, {}).setdefault(label, {'buckets': [0] * (len(BUCKETS) + 1), 'sum_ms': 0})
+        value = values.get(key, 0)
+        if field == 'sum_ms':
+            entry['sum_ms'] = value
+        else:
+            entry['buckets'][int(field.partition(':')[2])] = value
+    for hour, labels in stats.items():
+        for label, entry in list(labels.items()):
+            entry['count'] = sum(entry['buckets'])
+            if not entry['count']:
+                # Its counters expired before the index did
+                del labels[label]
+    return {hour: stats[hour] for hour in hour_keys if stats.get(hour)}
+
+
+def combined(stats):
+    """Merge a snapshot's hours into one histogram per label"""
+    totals = {}
+    for labels in stats.values():
+        for label, entry in labels.items():
+            total = totals.setdefault(label, {'buckets': [0] * (len(BUCKETS) + 1), 'sum_ms': 0, 'count': 0})
+            total['buckets'] = [a + b for a, b in zip(total['buckets'], entry['buckets'])]
+            total['sum_ms'] += entry['sum_ms']
+            total['count'] += entry['count']
+    return dict(sorted(totals.items()))
@@ -0,0 +1,26 @@
+from django import template
+from django.conf import settings
+from django.templatetags.static import static
+from django.utils.html import format_html_join
+
+from Ecoweb.assets import bundle_name, bundle_sources
+
+register = template.Library()
+
+
+def _paths(kind, name):
+    if getattr(settings, 'STATIC_BUNDLES', not settings.DEBUG):
+        return [bundle_name(kind, name)]
+    return bundle_sources(kind, name)
+
+
+@register.simple_tag
+def css_bundle(name):
+    """<link> for a stylesheet bundle, or for each of its sources when bundling is off"""
+    return format_html_join('\n', '<link rel="stylesheet" href="{}">', ((static(p),) for p in _paths('css', name)))
+
+
+@register.simple_tag
+def js_bundle(name):
+    """<script> for a script bundle, or for each of its sources when bundling is off"""
+    return format_html_join('\n', '<script src="{}"></script>', ((static(p),) for p in _paths('js', name)))
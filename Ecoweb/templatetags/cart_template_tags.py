@@ -1,5 +1,6 @@
 from django import template
-from Ecoweb.models import Order
+from django.db.models import Subquery
+from Ecoweb.models import Order, OrderItem
 
 register = template.Library()
 
@@ -7,7 +8,7 @@ register = template.Library()
 @register.filter
 def cart_item_count(user):
     if user.is_authenticated:
-        qs = Order.objects.filter(user=user, ordered=False)
-        if qs.exists():
-            return qs[0].items.count()
+        # One query: the lines of the user's open order
+        open_order = Order.objects.filter(user=user, ordered=False).order_by('pk').values('pk')[:1]
+        return OrderItem.objects.filter(order=Subquery(open_order)).count()
     return 0
@@ -11,7 +11,9 @@ from .views import(
  mpesa_callback,
  check_payment_status,
  send_payment_confirmation,
- send_payment_success_notification
+ send_payment_success_notification,
+ health,
+ metrics
 )
 
 
@@ -29,6 +31,7 @@ urlpatterns = [
     path('accounts/', include('allauth.urls')),
     path('admin/', admin.site.urls),
     path('', HomeView.as_view(), name='index'),
+    path('search/', views.search, name='search'),
     path('product/<slug>/',ProductDetailView.as_view(), name='detail'),
     path('add-to-cart/<slug>/',views.add_to_cart,name='add-to-cart'),
     path('remove-from-cart/<slug>/',views.remove_from_cart,name='remove-from-cart'),
@@ -44,10 +47,11 @@ urlpatterns = [
     path('check-payment-status/<str:checkout_request_id>/', check_payment_status, name='check_payment_status'),
     path('api/send-phone-confirmation/', send_payment_confirmation, name='send_payment_confirmation'),
     path('api/send-payment-success/', send_payment_success_notification, name='send_payment_success'),
+    path('health/', health, name='health'),
+    path('metrics', metrics, name='metrics'),
 ]
 
+# Uploads are served by Ecoweb.middleware.MediaFilesMiddleware
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL,
-                          document_root=settings.MEDIA_ROOT)
     urlpatterns += static(settings.STATIC_URL,
                           document_root=settings.STATIC_ROOT)
@@ -1,22 +1,36 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.shortcuts import render, get_object_or_404
 from .models import Item, OrderItem, Order, MpesaTransaction
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import ObjectDoesNotExist
-from django.contrib.auth.mixins import LoginRequiredMixin
+from django.utils.decorators import method_decorator
 from django.views.generic import ListView, DetailView, View
 from django.shortcuts import redirect
 from django.utils import timezone
 from django.contrib import messages
 from django.contrib.auth.views import LoginView
 from django.contrib.auth.forms import AuthenticationForm, UserCreationForm
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, Http404
 from django.views.decorators.csrf import csrf_exempt
 from .pesapal_service import PesapalService
-from .mpesa_service import MpesaService
+from .mpesa_service import STK_QUERY_RESULT_STATUS, MpesaService, parse_transaction_date
+from .fulfilment import fulfil_order, fail_order, apply_pesapal_status
+from .stk_dedup import ainitiate_order_stk_push
+from .decorators import async_csrf_exempt, async_login_required
+from .phone import normalize_phone
+from . import gateway_metrics, stk_latency
+from . import metrics as request_metrics
+import hmac
 import json
 import uuid
 
 
+def open_order(user):
+    """The user's unpaid order, with its lines and their items loaded for the templates"""
+    return Order.objects.prefetch_related('items__item').get(user=user, ordered=False)
+
+
 # Create your views here.
 def index(request):
     data = Item.objects.all()
@@ -27,14 +41,14 @@ def index(request):
 
 
 def search(request):
-    if request.method == 'GET':
-        query = request.GET.get('query')
-        if query:
-            kim = Item.objects.filter(title__icontains=query)
-            return render(request, 'index.html', {'kim': kim})
-        else:
-            print("No information to show")
-            return render(request, 'index.html', {})
+    query = request.GET.get('query')
+    context = {
+        # The product grid fragment is shared with the home page; without the
+        # catalog here a miss would cache an empty grid for both
+        'object_list': Item.objects.all(),
+        'kim': Item.objects.filter(title__icontains=query) if query else [],
+    }
+    return render(request, 'index.html', context)
 
 
 def detailitem(request):
@@ -45,22 +59,50 @@ def cartlist(request):
     return render(request, "cart.html")
 
 
-class CheckoutView(LoginRequiredMixin, View):
-    def get(self, *args, **kwargs):
+@method_decorator(async_login_required, name='dispatch')
+class CheckoutView(View):
+    async def get(self, *args, **kwargs):
+        return await sync_to_async(self.render_checkout)()
+
+    def render_checkout(self):
         try:
-            order = Order.objects.get(user=self.request.user, ordered=False)
+            order = open_order(self.request.user)
             context = {'object': order}
             return render(self.request, 'checkout.html', context)
         except ObjectDoesNotExist:
             messages.error(self.request, "You do not have an active order")
-            return redirect("Ecoweb:cart")
+            return redirect("cart")
+
+    async def post(self, *args, **kwargs):
+        checkout = await sync_to_async(self.save_billing_details)()
+        if isinstance(checkout, HttpResponse):
+            return checkout
+        order, details = checkout
+
+        # Handle M-Pesa STK Push payment without holding a thread while Safaricom answers
+        if details['payment_method'] == 'mpesa':
+            amount = await sync_to_async(order.get_total)()
+            # Repeated submits for the same order reuse the pending push
+            stk_response = await ainitiate_order_stk_push(
+                order,
+                phone_number=details['mpesa_phone'],
+                amount=amount,
+                description=f"Payment for Order #{order.id}"
+            )
+            return await sync_to_async(self.mpesa_response)(order, details['mpesa_phone'], amount, stk_response)
 
-    def post(self, *args, **kwargs):
+        return await sync_to_async(self.pesapal_checkout)(order, details)
+
+    def wants_json(self):
+        return self.request.headers.get('Content-Type') == 'application/json' or self.request.headers.get('Accept') == 'application/json'
+
+    def save_billing_details(self):
+        """Validate the checkout form and save it on the order; returns (order, details) or an error response"""
         try:
-            order = Order.objects.get(user=self.request.user, ordered=False)
+            order = open_order(self.request.user)
         except ObjectDoesNotExist:
             messages.error(self.request, "You do not have an active order")
-            return redirect("Ecoweb:cart")
+            return redirect("cart")
         
         # Get form data
         first_name = self.request.POST.get('first_name')
@@ -80,12 +122,11 @@ class CheckoutView(LoginRequiredMixin, View):
         # Validate phone numbers
         try:
             # Validate main phone number
-            pesapal = PesapalService()
-            formatted_phone = pesapal.format_phone_number(phone)
+            formatted_phone = normalize_phone(phone)
             
             # Validate M-Pesa phone if provided
             if payment_method == 'mpesa' and mpesa_phone:
-                formatted_mpesa_phone = pesapal.format_phone_number(mpesa_phone)
+                formatted_mpesa_phone = normalize_phone(mpesa_phone)
             else:
                 formatted_mpesa_phone = formatted_phone
                 
@@ -102,61 +143,55 @@ class CheckoutView(LoginRequiredMixin, View):
         order.city = city
         order.payment_method = payment_method
         order.customer_phone = formatted_mpesa_phone
-        order.save()
-        
-        # Handle M-Pesa STK Push payment
-        if payment_method == 'mpesa':
-            mpesa_service = MpesaService()
-            stk_response = mpesa_service.initiate_stk_push(
-                phone_number=formatted_mpesa_phone,
-                amount=order.get_total(),
-                order_id=order.id,
-                description=f"Payment for Order #{order.id}"
-            )
+        order.save(update_fields=[
+            'first_name', 'last_name', 'email', 'phone', 'address', 'city',
+            'payment_method', 'customer_phone'
+        ])
+        return order, {
+            'first_name': first_name,
+            'last_name': last_name,
+            'email': email,
+            'address': address,
+            'city': city,
+            'payment_method': payment_method,
+            'mpesa_phone': formatted_mpesa_phone,
+        }
+
+    def mpesa_response(self, order, formatted_mpesa_phone, amount, stk_response):
+        if stk_response['status'] == 'success':
+            test_mode_msg = " (Test Mode)" if stk_response['checkout_request_id'].startswith('test_') else ""
             
-            if stk_response['status'] == 'success':
-                # Create M-Pesa transaction record (only for real transactions)
-                if not stk_response['checkout_request_id'].startswith('test_'):
-                    MpesaTransaction.objects.create(
-                        order=order,
-                        checkout_request_id=stk_response['checkout_request_id'],
-                        merchant_request_id=stk_response['merchant_request_id'],
-                        phone_number=formatted_mpesa_phone,
-                        amount=order.get_total()
-                    )
-                
-                test_mode_msg = " (Test Mode)" if stk_response['checkout_request_id'].startswith('test_') else ""
-                
-                # Return JSON response for AJAX requests
-                if self.request.headers.get('Content-Type') == 'application/json' or self.request.headers.get('Accept') == 'application/json':
-                    return JsonResponse({
-                        'status': 'success',
-                        'message': f"Payment prompt sent to {formatted_mpesa_phone}{test_mode_msg}. Please check your phone and enter your M-Pesa PIN to complete payment.",
-                        'checkout_request_id': stk_response['checkout_request_id'],
-                        'redirect_url': '/payment-waiting/',
-                        'amount': str(order.get_total())
-                    })
-                
-                messages.success(self.request, 
-                    f"✅ Payment prompt sent to {formatted_mpesa_phone}{test_mode_msg}. Please check your phone and enter your M-Pesa PIN to complete payment.")
-                return render(self.request, 'payment-waiting.html', {
-                    'order': order,
-                    'amount': order.get_total(),
+            # Return JSON response for AJAX requests
+            if self.wants_json():
+                return JsonResponse({
+                    'status': 'success',
+                    'message': f"Payment prompt sent to {formatted_mpesa_phone}{test_mode_msg}. Please check your phone and enter your M-Pesa PIN to complete payment.",
                     'checkout_request_id': stk_response['checkout_request_id'],
-                    'phone_number': formatted_mpesa_phone,
-                    'test_mode': stk_response['checkout_request_id'].startswith('test_')
+                    'redirect_url': '/payment-waiting/',
+                    'amount': str(amount)
                 })
-            else:
-                # Return JSON response for AJAX requests
-                if self.request.headers.get('Content-Type') == 'application/json' or self.request.headers.get('Accept') == 'application/json':
-                    return JsonResponse({
-                        'status': 'error',
-                        'message': f"Failed to send payment prompt: {stk_response['message']}"
-                    })
-                
-                messages.error(self.request, f"❌ Failed to send payment prompt: {stk_response['message']}")
-                return render(self.request, 'checkout.html', {'object': order})
+            
+            messages.success(self.request, 
+                f"✅ Payment prompt sent to {formatted_mpesa_phone}{test_mode_msg}. Please check your phone and enter your M-Pesa PIN to complete payment.")
+            return render(self.request, 'payment-waiting.html', {
+                'order': order,
+                'amount': amount,
+                'checkout_request_id': stk_response['checkout_request_id'],
+                'phone_number': formatted_mpesa_phone,
+                'test_mode': stk_response['checkout_request_id'].startswith('test_')
+            })
+
+        # Return JSON response for AJAX requests
+        if self.wants_json():
+            return JsonResponse({
+                'status': 'error',
+                'message': f"Failed to send payment prompt: {stk_response['message']}"
+            })
         
+        messages.error(self.request, f"❌ Failed to send payment prompt: {stk_response['message']}")
+        return render(self.request, 'checkout.html', {'object': order})
+
+    def pesapal_checkout(self, order, details):
         # Initialize Pesapal service for other payment methods
         pesapal = PesapalService()
         token = pesapal.get_access_token()
@@ -165,19 +200,17 @@ class CheckoutView(LoginRequiredMixin, View):
             messages.error(self.request, "Payment service unavailable. Please try again.")
             return render(self.request, "checkout.html", {'object': order})
         
-        # Register IPN URL
-        pesapal.register_ipn_url(token)
-        
-        # Prepare order data for Pesapal
+        # Prepare order data for Pesapal (the IPN URL is registered once and its id reused)
         order_data = {
             'amount': order.get_total(),
             'order_number': order.id,
-            'email': email,
-            'phone': formatted_mpesa_phone,
-            'first_name': first_name,
-            'last_name': last_name,
-            'address': address,
-            'city': city
+            'ipn_id': pesapal.get_ipn_id(token),
+            'email': details['email'],
+            'phone': details['mpesa_phone'],
+            'first_name': details['first_name'],
+            'last_name': details['last_name'],
+            'address': details['address'],
+            'city': details['city']
         }
         
         # Submit order to Pesapal
@@ -187,7 +220,7 @@ class CheckoutView(LoginRequiredMixin, View):
             # Store tracking ID
             order.pesapal_tracking_id = payment_response['order_tracking_id']
             order.pesapal_merchant_reference = payment_response['merchant_reference']
-            order.save()
+            order.save(update_fields=['pesapal_tracking_id', 'pesapal_merchant_reference'])
             
             # Store in session
             self.request.session['order_tracking_id'] = payment_response['order_tracking_id']
@@ -218,10 +251,11 @@ class HomeView(ListView):
     template_name = "index.html"
 
 
+@method_decorator(login_required, name='dispatch')
 class OrderSummaryView(View):
     def get(self, *args, **kwargs):
         try:
-            order = Order.objects.get(user=self.request.user, ordered=False)
+            order = open_order(self.request.user)
             context = {
                 'object': order
             }
@@ -243,27 +277,26 @@ def add_to_cart(request, slug):
         item=item,
         user=request.user,
         ordered=False)
-    order_qs = Order.objects.filter(user=request.user, ordered=False)
-    if order_qs.exists():
-        order = order_qs[0]
+    order = Order.objects.filter(user=request.user, ordered=False).first()
+    if order is not None:
         # check if the order item is in the order
         if order.items.filter(item__slug=item.slug).exists():
             order_item.quantity += 1
-            order_item.save()
+            order_item.save(update_fields=['quantity'])
         else:
             order.items.add(order_item)
     else:
         ordered_date = timezone.now()
         order = Order.objects.create(user=request.user, ordered_date=ordered_date)
         order.items.add(order_item)
-    return redirect("Ecoweb:detail", slug=slug)
+    return redirect("detail", slug=slug)
 
 
+@login_required
 def remove_from_cart(request, slug):
     item = get_object_or_404(Item, slug=slug)
-    order_qs = Order.objects.filter(user=request.user, ordered=False)
-    if order_qs.exists():
-        order = order_qs[0]
+    order = Order.objects.filter(user=request.user, ordered=False).first()
+    if order is not None:
         # check if the order item is in the order
         if order.items.filter(item__slug=item.slug).exists():
             order_item = OrderItem.objects.filter(
@@ -271,14 +304,14 @@ def remove_from_cart(request, slug):
                 user=request.user,
                 ordered=False)[0]
             order.items.remove(order_item)
-            return redirect("Ecoweb:cart")
+            return redirect("cart")
         else:
             # add a message saying the order does not contain the item
-            return redirect("Ecoweb:detail", slug=slug)
+            return redirect("detail", slug=slug)
     else:
         # add a message saying the user doesn't have an order
-        return redirect("Ecoweb:detail", slug=slug)
-    return redirect("Ecoweb:detail", slug=slug)
+        return redirect("detail", slug=slug)
+    return redirect("detail", slug=slug)
 class CustomLoginView(LoginView):
     template_name = 'accounts/login.html'
     authentication_form = AuthenticationForm
@@ -295,11 +328,11 @@ class CustomSignupView(View):
         form = self.form_class(request.POST)
         if form.is_valid():
             form.save()
-            return redirect('Ecoweb:index')
+            return redirect('index')
         return render(request, self.template_name, {'form': form})
 
-@csrf_exempt
-def pesapal_callback(request):
+@async_csrf_exempt
+async def pesapal_callback(request):
     """Handle Pesapal payment callback"""
     order_tracking_id = request.GET.get('OrderTrackingId')
     merchant_reference = request.GET.get('OrderMerchantReference')
@@ -307,86 +340,53 @@ def pesapal_callback(request):
     if not order_tracking_id:
         return HttpResponse("Missing tracking ID", status=400)
     
-    # Get access token
-    pesapal = PesapalService()
-    token = pesapal.get_access_token()
+    order = await Order.objects.filter(pesapal_tracking_id=order_tracking_id).afirst()
+    if order is None:
+        return HttpResponse("Order not found", status=404)
     
-    if not token:
-        return HttpResponse("Service unavailable", status=500)
+    # The IPN may already have settled the order
+    if order.payment_status == 'COMPLETED':
+        messages.success(request, "Payment successful! Your order has been confirmed.")
+        return redirect('complete')
     
-    # Get transaction status
-    status_response = pesapal.get_transaction_status(order_tracking_id, token)
+    # Shares one upstream lookup with an IPN for the same payment
+    status_response = await PesapalService().aresolve_transaction_status(order_tracking_id)
     
-    if status_response:
-        try:
-            # Find the order
-            order = Order.objects.get(pesapal_tracking_id=order_tracking_id)
-            
-            payment_status = status_response.get('payment_status_description', '').upper()
-            
-            if payment_status == 'COMPLETED':
-                order.payment_status = 'COMPLETED'
-                order.ordered = True
-                order.ordered_date = timezone.now()
-                # Mark all order items as ordered
-                for item in order.items.all():
-                    item.ordered = True
-                    item.save()
-                messages.success(request, "Payment successful! Your order has been confirmed.")
-            elif payment_status in ['FAILED', 'INVALID']:
-                order.payment_status = 'FAILED'
-                messages.error(request, "Payment failed. Please try again.")
-            
-            order.save()
-            
-        except Order.DoesNotExist:
-            return HttpResponse("Order not found", status=404)
+    if not status_response:
+        return HttpResponse("Service unavailable", status=500)
+    
+    payment_status = await sync_to_async(apply_pesapal_status)(order, status_response)
+    if payment_status == 'COMPLETED':
+        messages.success(request, "Payment successful! Your order has been confirmed.")
+    elif payment_status in ['FAILED', 'INVALID']:
+        messages.error(request, "Payment failed. Please try again.")
     
     # Redirect to order complete page
-    return redirect('Ecoweb:complete')
+    return redirect('complete')
 
-@csrf_exempt
-def pesapal_ipn(request):
+@async_csrf_exempt
+async def pesapal_ipn(request):
     """Handle Pesapal IPN notifications"""
     order_tracking_id = request.GET.get('OrderTrackingId')
     
     if order_tracking_id:
-        # Get access token
-        pesapal = PesapalService()
-        token = pesapal.get_access_token()
+        order = await Order.objects.filter(pesapal_tracking_id=order_tracking_id).afirst()
         
-        if token:
-            # Get transaction status
-            status_response = pesapal.get_transaction_status(order_tracking_id, token)
-            
+        # Answer from the database once the callback has settled the order
+        if order and order.payment_status != 'COMPLETED':
+            status_response = await PesapalService().aresolve_transaction_status(order_tracking_id)
             if status_response:
-                try:
-                    order = Order.objects.get(pesapal_tracking_id=order_tracking_id)
-                    payment_status = status_response.get('payment_status_description', '').upper()
-                    
-                    if payment_status == 'COMPLETED' and order.payment_status != 'COMPLETED':
-                        order.payment_status = 'COMPLETED'
-                        order.ordered = True
-                        order.ordered_date = timezone.now()
-                        for item in order.items.all():
-                            item.ordered = True
-                            item.save()
-                        order.save()
-                    elif payment_status in ['FAILED', 'INVALID']:
-                        order.payment_status = 'FAILED'
-                        order.save()
-                        
-                except Order.DoesNotExist:
-                    pass
+                await sync_to_async(apply_pesapal_status)(order, status_response)
     
     return HttpResponse("OK", status=200)
 
 
-@csrf_exempt
-def mpesa_callback(request):
+@async_csrf_exempt
+async def mpesa_callback(request):
     """Handle M-Pesa STK push callback"""
     if request.method == 'POST':
         try:
+            received_at = timezone.now()
             callback_data = json.loads(request.body)
             
             # Extract callback data
@@ -400,7 +400,7 @@ def mpesa_callback(request):
             
             try:
                 # Find the M-Pesa transaction
-                mpesa_transaction = MpesaTransaction.objects.get(
+                mpesa_transaction = await MpesaTransaction.objects.select_related('order').aget(
                     checkout_request_id=checkout_request_id
                 )
                 order = mpesa_transaction.order
@@ -420,28 +420,24 @@ def mpesa_callback(request):
                     # Update transaction
                     mpesa_transaction.status = 'SUCCESS'
                     mpesa_transaction.mpesa_receipt_number = mpesa_receipt_number
+                    mpesa_transaction.result_code = str(result_code)
+                    update_fields = ['status', 'mpesa_receipt_number', 'result_code', 'updated_at']
                     if transaction_date:
-                        mpesa_transaction.transaction_date = timezone.now()
-                    mpesa_transaction.save()
-                    
-                    # Update order
-                    order.payment_status = 'COMPLETED'
-                    order.ordered = True
-                    order.ordered_date = timezone.now()
-                    
-                    # Mark all order items as ordered
-                    for item in order.items.all():
-                        item.ordered = True
-                        item.save()
+                        mpesa_transaction.transaction_date = parse_transaction_date(transaction_date)
+                        update_fields.append('transaction_date')
+                    await mpesa_transaction.asave(update_fields=update_fields)
+                    await sync_to_async(stk_latency.callback_received)(mpesa_transaction, received_at)
                     
-                    order.save()
+                    # Mark the order and all its items as ordered
+                    await sync_to_async(fulfil_order)(order)
                     
                 else:  # Failed
                     mpesa_transaction.status = 'FAILED'
-                    mpesa_transaction.save()
+                    mpesa_transaction.result_code = str(result_code)
+                    await mpesa_transaction.asave(update_fields=['status', 'result_code', 'updated_at'])
+                    await sync_to_async(stk_latency.callback_received)(mpesa_transaction, received_at)
                     
-                    order.payment_status = 'FAILED'
-                    order.save()
+                    await sync_to_async(fail_order)(order)
                 
             except MpesaTransaction.DoesNotExist:
                 return HttpResponse("Transaction not found", status=404)
@@ -454,46 +450,34 @@ def mpesa_callback(request):
     return HttpResponse("OK", status=200)
 
 
-@login_required
-def check_payment_status(request, checkout_request_id):
+@async_login_required
+async def check_payment_status(request, checkout_request_id):
     """Check M-Pesa payment status via AJAX with test mode support"""
     try:
         # Handle test mode transactions
         if checkout_request_id.startswith('test_'):
-            return handle_test_payment_status(checkout_request_id)
+            return await handle_test_payment_status(checkout_request_id)
             
-        mpesa_transaction = MpesaTransaction.objects.get(
+        mpesa_transaction = await MpesaTransaction.objects.select_related('order').aget(
             checkout_request_id=checkout_request_id
         )
         
         # Query M-Pesa API for status if still pending
         if mpesa_transaction.status == 'PENDING':
             mpesa_service = MpesaService()
-            status_response = mpesa_service.query_stk_status(checkout_request_id)
+            status_response = await mpesa_service.aquery_stk_status(checkout_request_id)
             
             if status_response.get('ResponseCode') == '0':
                 result_code = status_response.get('ResultCode')
-                if result_code == '0':
-                    mpesa_transaction.status = 'SUCCESS'
-                    mpesa_transaction.save()
-                    
-                    order = mpesa_transaction.order
-                    order.payment_status = 'COMPLETED'
-                    order.ordered = True
-                    order.ordered_date = timezone.now()
-                    
-                    # Mark all order items as ordered
-                    for item in order.items.all():
-                        item.ordered = True
-                        item.save()
-                    
-                    order.save()
-                elif result_code in ['1032', '1037']:  # User cancelled or timeout
-                    mpesa_transaction.status = 'CANCELLED'
-                    mpesa_transaction.save()
-                elif result_code == '1':  # Failed
-                    mpesa_transaction.status = 'FAILED'
-                    mpesa_transaction.save()
+                status = STK_QUERY_RESULT_STATUS.get(result_code)
+                if status:
+                    mpesa_transaction.status = status
+                    mpesa_transaction.result_code = result_code
+                    await mpesa_transaction.asave(update_fields=['status', 'result_code', 'updated_at'])
+                    await sync_to_async(stk_latency.settle)(mpesa_transaction, stk_latency.VIA_POLL)
+                    if status == 'SUCCESS':
+                        # Mark the order and all its items as ordered
+                        await sync_to_async(fulfil_order)(mpesa_transaction.order)
         
         return JsonResponse({
             'status': mpesa_transaction.status.lower(),
@@ -509,12 +493,12 @@ def check_payment_status(request, checkout_request_id):
         return JsonResponse({'status': 'error', 'message': 'Transaction not found'})
 
 
-def handle_test_payment_status(checkout_request_id):
+async def handle_test_payment_status(checkout_request_id):
     """Handle test mode payment status checking"""
     from django.core.cache import cache
     import time
     
-    test_data = cache.get(f'test_payment_{checkout_request_id}')
+    test_data = await cache.aget(f'test_payment_{checkout_request_id}')
     if not test_data:
         return JsonResponse({'status': 'error', 'message': 'Test transaction not found'})
     
@@ -526,21 +510,21 @@ def handle_test_payment_status(checkout_request_id):
     if phone == '254700000000':  # Success after 10 seconds
         if elapsed > 10:
             # Mark as successful in cache
-            cache.set(f'test_status_{checkout_request_id}', 'success', 300)
+            await cache.aset(f'test_status_{checkout_request_id}', 'success', 300)
             return JsonResponse({
                 'status': 'success',
                 'message': 'Test payment completed successfully!'
             })
     elif phone == '254711111111':  # Cancelled after 15 seconds
         if elapsed > 15:
-            cache.set(f'test_status_{checkout_request_id}', 'cancelled', 300)
+            await cache.aset(f'test_status_{checkout_request_id}', 'cancelled', 300)
             return JsonResponse({
                 'status': 'cancelled',
                 'message': 'Test payment was cancelled.'
             })
     elif phone == '254722222222':  # Failed after 20 seconds
         if elapsed > 20:
-            cache.set(f'test_status_{checkout_request_id}', 'failed', 300)
+            await cache.aset(f'test_status_{checkout_request_id}', 'failed', 300)
             return JsonResponse({
                 'status': 'failed',
                 'message': 'Test payment failed.'
@@ -563,8 +547,7 @@ def send_payment_confirmation(request):
             
             if phone:
                 # Format phone number
-                mpesa_service = MpesaService()
-                formatted_phone = mpesa_service.format_phone_number(phone)
+                formatted_phone = normalize_phone(phone)
                 
                 return JsonResponse({
                     'status': 'success',
@@ -600,4 +583,29 @@ def send_payment_success_notification(request):
             'message': 'Payment success notification sent'
         })
     
-    return JsonResponse({'status': 'error', 'message': 'Invalid request method'})
\ No newline at end of file
+    return JsonResponse({'status': 'error', 'message': 'Invalid request method'})
+
+def health(request):
+    """Report gateway circuit breaker state for uptime checks"""
+    circuits = MpesaService.circuit_status()
+    degraded = any(circuit['state'] != 'closed' for circuit in circuits.values())
+    return JsonResponse({
+        'status': 'degraded' if degraded else 'ok',
+        'circuits': circuits
+    })
+
+
+def metrics(request):
+    """Request timing and gateway histograms in the Prometheus text format.
+
+    Requires ``Authorization: Bearer <METRICS_TOKEN>``; without a token
+    configured, only served under DEBUG.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token:
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return HttpResponse(status=401, headers={'WWW-Authenticate': 'Bearer'})
+    elif not settings.DEBUG:
+        raise Http404
+    body = request_metrics.registry.exposition() + gateway_metrics.exposition()
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
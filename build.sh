@@ -22,12 +22,20 @@ else
     pip install -r requirements.txt
 fi
 
+echo "Building static asset bundles..."
+# Per-page CSS/JS bundles and subset icon fonts, written to static/dist
+python manage.py build_assets
+
 echo "Collecting static files..."
-# Collect static files
-python manage.py collectstatic --no-input
+# Collect static files (hashed, gzip and Brotli compressed); Sass sources are not served
+python manage.py collectstatic --no-input --ignore "sass" --ignore "*.scss" --ignore "prepros-6.config"
 
 echo "Running database migrations..."
 # Run database migrations
 python manage.py migrate
 
+echo "Hashing media file names..."
+# Item photos uploaded before content-hashed names; already hashed ones are skipped
+python manage.py hash_media
+
 echo "Build completed successfully!"
\ No newline at end of file
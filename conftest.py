@@ -0,0 +1,39 @@
+"""
+Shared fixtures for the test modules in this directory
+"""
+
+import contextlib
+
+import pytest
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        'markers', 'database(**settings): run the module against a fresh test database, with settings overridden'
+    )
+
+
+@pytest.fixture(scope='module', autouse=True)
+def database(request):
+    """A test database for modules marked ``pytest.mark.database(**settings)``"""
+    marker = request.node.get_closest_marker('database')
+    if marker is None:
+        yield
+        return
+    try:
+        # pytest-django blocks database access outside its own fixtures once
+        # Django is configured (as when a module runs itself)
+        unblocked = request.getfixturevalue('django_db_blocker').unblock()
+    except pytest.FixtureLookupError:
+        unblocked = contextlib.nullcontext()
+    with unblocked, override_settings(**marker.kwargs):
+        try:
+            setup_test_environment()
+        except RuntimeError:
+            # Already set up by a test runner plugin
+            pass
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        yield
+        connection.creation.destroy_test_db(old_name, verbosity=0)
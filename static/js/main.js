@@ -202,7 +202,9 @@
 
 
 	var sliderMain = function() {
-		
+		// Plugins are only bundled into the pages that use them
+		if ( !$.fn.flexslider ) return;
+
 	  	$('#colorlib-hero .flexslider').flexslider({
 			animation: "fade",
 			slideshowSpeed: 5000,
@@ -265,7 +267,7 @@
 
 	var parallax = function() {
 
-		if ( !isMobile.any() ) {
+		if ( $.fn.stellar && !isMobile.any() ) {
 			$(window).stellar({
 				horizontalScrolling: false,
 				hideDistantElements: false, 
@@ -276,6 +278,7 @@
 	};
 
 	var datePicker = function() {
+		if ( !jQuery.fn.datepicker ) return;
 		// jQuery('#time').timepicker();
 		jQuery('.date').datepicker({
 		  'format': 'm/d/yyyy',
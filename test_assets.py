@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Tests for the static asset bundle helpers
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import django
+
+project_dir = Path(__file__).resolve().parent
+sys.path.append(str(project_dir))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Ecoweb.settings')
+django.setup()
+
+import pytest
+from django.template import Context, Template
+from django.test.utils import override_settings
+
+from Ecoweb import assets
+
+
+def test_rebase_urls_points_at_the_bundle_directory():
+    css = '.a{background:url(../images/bg.png)} .b{src:url("fonts/x.woff?v=2#iefix")} .c{background:url(data:image/png;base64,AA)}'
+    rebased = assets.rebase_urls(css, 'css/style.css', 'dist/base.css')
+    assert 'url("../images/bg.png")' in rebased
+    assert 'url("../css/fonts/x.woff?v=2#iefix")' in rebased
+    assert 'url(data:image/png;base64,AA)' in rebased
+
+
+def test_unused_icon_rules_are_pruned():
+    css = '.icon-cart:before{content:"\\e900"}.icon-bin:before,.icon-trash:before{content:"\\e901"}.btn{color:red}'
+    pruned = assets.prune_icon_rules(css, ['icon-'], {'icon-cart', 'icon-trash'})
+    assert pruned == '.icon-cart:before{content:"\\e900"}.icon-trash:before{content:"\\e901"}.btn{color:red}'
+    assert assets.glyph_codepoints(pruned) == {0xe900, 0xe901}
+
+
+@pytest.mark.parametrize('bundled, expected', [
+    (True, ['/static/dist/home.js']),
+    (False, ['/static/js/jquery.flexslider-min.js']),
+])
+def test_js_bundle_tag(bundled, expected):
+    with override_settings(STATIC_BUNDLES=bundled, STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage'):
+        html = Template("{% load assets %}{% js_bundle 'home' %}").render(Context())
+    assert html == ''.join(f'<script src="{src}"></script>' for src in expected)
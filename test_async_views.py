@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Tests for the async payment views served through the ASGI handler
+"""
+
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import django
+
+project_dir = Path(__file__).resolve().parent
+sys.path.append(str(project_dir))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Ecoweb.settings')
+django.setup()
+
+import pytest
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import AsyncClient
+from django.utils import timezone
+
+from Ecoweb.models import Item, Order, OrderItem
+from Ecoweb.pesapal_service import PesapalService
+
+
+pytestmark = pytest.mark.database(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'async_views'}},
+    SESSION_ENGINE='django.contrib.sessions.backends.db',
+    PAGE_CACHE_TIMEOUT=0,
+    MPESA_TEST_MODE=True,
+    SECURE_SSL_REDIRECT=False,
+)
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    cache.clear()
+
+
+def make_cart(username):
+    user = User.objects.create_user(username, password='x')
+    item = Item.objects.create(title='Sneaker', price=1500, photo='pics/sneaker.jpg', slug=f'sneaker-{username}')
+    order = Order.objects.create(user=user, ordered_date=timezone.now())
+    order.items.add(OrderItem.objects.create(user=user, item=item, quantity=2))
+    return user, order
+
+
+CHECKOUT_FORM = {
+    'first_name': 'Wanjiku',
+    'last_name': 'Kamau',
+    'email': 'wanjiku@example.com',
+    'phone': '0712345678',
+    'address': 'Kimathi street',
+    'city': 'Nairobi',
+    'payment_method': 'mpesa',
+    # Simulated in test mode
+    'mpesa_phone': '0700000000',
+}
+
+
+def test_mpesa_checkout_and_status_poll():
+    user, order = make_cart('async_checkout')
+    client = AsyncClient()
+    client.force_login(user)
+
+    async def checkout_twice_and_poll():
+        first = await client.post('/checkout/', CHECKOUT_FORM, headers={'Accept': 'application/json'})
+        second = await client.post('/checkout/', CHECKOUT_FORM, headers={'Accept': 'application/json'})
+        poll = await client.get(f"/check-payment-status/{first.json()['checkout_request_id']}/")
+        return first, second, poll
+
+    first, second, poll = asyncio.run(checkout_twice_and_poll())
+
+    assert first.status_code == 200
+    assert first.json()['status'] == 'success'
+    assert first.json()['amount'] == '3000.0'
+    # The second submit reuses the pending push
+    assert second.json()['checkout_request_id'] == first.json()['checkout_request_id']
+    assert poll.json()['status'] == 'pending'
+    order.refresh_from_db()
+    assert (order.payment_method, order.first_name) == ('mpesa', 'Wanjiku')
+
+
+class StubbedPesapal:
+    lookups = 0
+
+    async def aget_access_token(self):
+        return 'token'
+
+    async def aget_transaction_status(self, order_tracking_id, token):
+        StubbedPesapal.lookups += 1
+        await asyncio.sleep(0.1)
+        return {'payment_status_description': 'Completed', 'order_tracking_id': order_tracking_id}
+
+
+def test_pesapal_callback_settles_the_order(monkeypatch):
+    monkeypatch.setattr(PesapalService, 'aget_access_token', StubbedPesapal.aget_access_token)
+    monkeypatch.setattr(PesapalService, 'aget_transaction_status', StubbedPesapal.aget_transaction_status)
+    StubbedPesapal.lookups = 0
+    _, order = make_cart('async_pesapal')
+    Order.objects.filter(pk=order.pk).update(pesapal_tracking_id='track-async', payment_method='pesapal')
+    client = AsyncClient()
+
+    async def callback_and_ipn():
+        return await asyncio.gather(
+            client.get('/payment/callback/', {'OrderTrackingId': 'track-async'}),
+            client.get('/payment/ipn/', {'OrderTrackingId': 'track-async'}),
+        )
+
+    callback, ipn = asyncio.run(callback_and_ipn())
+
+    assert callback.status_code == 302
+    assert callback['Location'] == '/complete/'
+    assert ipn.status_code == 200
+    assert StubbedPesapal.lookups == 1
+    order.refresh_from_db()
+    assert order.payment_status == 'COMPLETED'
+    assert order.ordered
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-q']))
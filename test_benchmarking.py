@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Tests for the in-process WSGI client and baseline comparison used by manage.py bench
+"""
+
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+import django
+
+project_dir = Path(__file__).resolve().parent
+sys.path.append(str(project_dir))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Ecoweb.settings')
+django.setup()
+
+import pytest
+
+from Ecoweb.benchmarking import WSGIClient, compare
+from Ecoweb.fake_gateway import FakeGateway, FakeGatewayConfig
+
+
+def cookie_app(environ, start_response):
+    headers = [('Content-Type', 'application/json')]
+    if environ['PATH_INFO'] == '/login/':
+        headers.append(('Set-Cookie', 'sessionid=abc; Path=/; HttpOnly; Secure'))
+    elif environ['PATH_INFO'] == '/logout/':
+        headers.append(('Set-Cookie', 'sessionid=""; expires=Thu, 01 Jan 1970 00:00:00 GMT; Max-Age=0; Path=/'))
+    body = (
+        f'{{"cookie": "{environ.get("HTTP_COOKIE", "")}", "scheme": "{environ["wsgi.url_scheme"]}", '
+        f'"token": "{environ.get("HTTP_X_CSRFTOKEN", "")}", "body": "{environ["wsgi.input"].read().decode()}"}}'
+    )
+    start_response('200 OK', headers)
+    return [body.encode()]
+
+
+def test_client_keeps_and_expires_cookies():
+    client = WSGIClient(cookie_app)
+    assert client.get('/').json()['cookie'] == ''
+    client.get('/login/')
+    response = client.post('/cart/', {'quantity': 2}, x_csrftoken='t0k')
+    assert response.json() == {'cookie': 'sessionid=abc', 'scheme': 'https', 'token': 't0k', 'body': 'quantity=2'}
+    client.get('/logout/')
+    assert client.cookies == {}
+
+
+def test_compare_reports_slowdowns_as_positive():
+    baseline = {'steps': {'checkout': {'throughput': 10.0, 'p50_ms': 100.0, 'p95_ms': 200.0, 'p99_ms': 0.0}}}
+    current = {'steps': {
+        'checkout': {'throughput': 8.0, 'p50_ms': 50.0, 'p95_ms': 300.0, 'p99_ms': 400.0},
+        'search': {'throughput': 5.0, 'p50_ms': 10.0, 'p95_ms': 20.0, 'p99_ms': 30.0},
+    }}
+    changes = {(step, metric): change for step, metric, _, _, change in compare(baseline, current)}
+    # Steps and metrics missing from the baseline are skipped
+    assert changes == {
+        ('checkout', 'throughput'): pytest.approx(20.0),
+        ('checkout', 'p50_ms'): pytest.approx(-50.0),
+        ('checkout', 'p95_ms'): pytest.approx(50.0),
+    }
+
+
+def test_fake_gateway_forgets_fired_callbacks():
+    gateway = FakeGateway(config=FakeGatewayConfig(callback_delay=0.01)).start()
+    fired = threading.Event()
+    for _ in range(20):
+        gateway._schedule(fired.set)
+    time.sleep(0.1)
+    assert fired.is_set()
+
+    held = threading.Event()
+    gateway.config.callback_delay = 60
+    gateway._schedule(held.set)
+    assert len(gateway.timers) == 1
+
+    gateway.stop()
+    assert gateway.timers == []
+    assert not held.is_set()
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-q']))
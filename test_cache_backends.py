@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Tests for the two-tier (in-process LRU in front of Redis) cache backend.
+
+The LocalLRU and invalidation tests always run; the TwoTierRedisCache tests
+need a Redis server at REDIS_URL and are skipped without one.
+"""
+
+import json
+import os
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import django
+
+project_dir = Path(__file__).resolve().parent
+sys.path.append(str(project_dir))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Ecoweb.settings')
+django.setup()
+
+import pytest
+
+from Ecoweb import cache_backends
+from Ecoweb.cache_backends import _MISSING, LocalLRU, LocalTier, TwoTierRedisCache
+
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/15')
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_lru_returns_values_until_they_expire():
+    store = LocalLRU(10)
+    store.set('a', {'n': 1}, 0.1)
+    assert store.get('a') == {'n': 1}
+    time.sleep(0.15)
+    assert store.get('a') is _MISSING
+    assert len(store) == 0
+
+
+def test_lru_evicts_the_least_recently_used():
+    store = LocalLRU(2)
+    store.set('a', 1, 60)
+    store.set('b', 2, 60)
+    store.get('a')
+    store.set('c', 3, 60)
+    assert store.get('b') is _MISSING
+    assert store.get('a') == 1
+    assert store.get('c') == 3
+
+
+def test_lru_hands_out_copies():
+    store = LocalLRU(10)
+    store.set('a', [1], 60)
+    store.get('a').append(2)
+    assert store.get('a') == [1]
+
+
+def test_invalidations_from_other_processes_are_applied():
+    tier = LocalTier(10, 'channel')
+    for key in ('a', 'b', 'c'):
+        tier.store.set(key, key, 60)
+
+    tier.apply(json.dumps({'origin': uuid.uuid4().hex, 'keys': ['a']}))
+    assert tier.store.get('a') is _MISSING
+    assert tier.store.get('b') == 'b'
+
+    # Our own writes already updated L1
+    tier.apply(json.dumps({'origin': tier.origin, 'keys': ['b']}))
+    assert tier.store.get('b') == 'b'
+
+    tier.apply(b'not json')
+    tier.apply(json.dumps({'origin': None, 'keys': '*'}))
+    assert len(tier.store) == 0
+
+
+def redis_available():
+    try:
+        import redis
+
+        return redis.Redis.from_url(REDIS_URL, socket_connect_timeout=0.5).ping()
+    except Exception:
+        return False
+
+
+needs_redis = pytest.mark.skipif(not redis_available(), reason=f'No Redis server at {REDIS_URL}')
+
+
+@pytest.fixture
+def two_tier():
+    """A TwoTierRedisCache with its own key prefix, subscribed to invalidations"""
+    backend = TwoTierRedisCache(REDIS_URL, {
+        'KEY_PREFIX': f'test_two_tier_{uuid.uuid4().hex}',
+        'OPTIONS': {'CLIENT_CLASS': 'django_redis.client.DefaultClient', 'L1_TIMEOUT': 0.3},
+    })
+    assert wait_for(lambda: backend._tier() is not None)
+    yield backend
+    backend.delete_pattern('*')
+
+
+def raw(backend):
+    """The Redis client underneath, for changes the backend does not see"""
+    return backend.client.get_client(write=True)
+
+
+@needs_redis
+def test_reads_are_served_from_l1_until_it_expires(two_tier):
+    two_tier.set('price', 100)
+    raw(two_tier).delete(two_tier.make_key('price'))
+
+    assert two_tier.get('price') == 100
+    time.sleep(0.35)
+    assert two_tier.get('price') is None
+
+
+@needs_redis
+def test_writes_invalidate_other_processes(two_tier):
+    other = LocalTier(10, two_tier.invalidation_channel)
+    other.start(lambda: raw(two_tier))
+    assert other.subscribed.wait(5)
+
+    made_key = two_tier.make_key('price')
+    other.store.set(made_key, 100, 60)
+    two_tier.set('price', 120)
+    assert wait_for(lambda: other.store.get(made_key) is _MISSING)
+
+    other.store.set(made_key, 120, 60)
+    two_tier.delete('price')
+    assert wait_for(lambda: other.store.get(made_key) is _MISSING)
+
+
+@needs_redis
+def test_add_and_incr_go_to_redis(two_tier):
+    tier = two_tier._tier()
+
+    assert two_tier.add('lock', 'token', 60)
+    assert tier.store.get(two_tier.make_key('lock')) is _MISSING
+    assert not two_tier.add('lock', 'other', 60)
+    assert two_tier.get('lock') == 'token'
+
+    two_tier.set('hits', 1)
+    assert two_tier.incr('hits') == 2
+    assert tier.store.get(two_tier.make_key('hits')) is _MISSING
+    assert two_tier.get('hits') == 2
+
+
+@needs_redis
+def test_get_many_fills_l1(two_tier):
+    two_tier.set_many({'a': 1, 'b': 2})
+    tier = two_tier._tier()
+    tier.store.clear()
+
+    assert two_tier.get_many(['a', 'b', 'missing']) == {'a': 1, 'b': 2}
+    assert tier.store.get(two_tier.make_key('a')) == 1
+    assert tier.store.get(two_tier.make_key('b')) == 2
+    assert tier.store.get(two_tier.make_key('missing')) is _MISSING
+
+
+@needs_redis
+def test_a_forked_process_starts_with_an_empty_l1(two_tier, monkeypatch):
+    two_tier.set('price', 100)
+    parent = two_tier._tier()
+    assert parent.store.get(two_tier.make_key('price')) == 100
+
+    monkeypatch.setattr(cache_backends.os, 'getpid', lambda: parent.pid + 1)
+    assert wait_for(lambda: two_tier._tier() is not None)
+    child = two_tier._tier()
+
+    assert child is not parent
+    assert child.origin != parent.origin
+    assert child.store.get(two_tier.make_key('price')) is _MISSING
+    assert two_tier.get('price') == 100
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-q']))
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Tests for the shared circuit breaker
+"""
+
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import django
+
+project_dir = Path(__file__).resolve().parent
+sys.path.append(str(project_dir))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Ecoweb.settings')
+django.setup()
+
+import pytest
+from django.core.cache import cache
+from django.test.utils import override_settings
+
+from Ecoweb import circuit_breaker
+from Ecoweb.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(autouse=True)
+def breaker_cache():
+    with override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'breaker'}},
+    ):
+        cache.clear()
+        yield
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker.time, 'time', clock)
+    return clock
+
+
+def attempt(breaker):
+    try:
+        breaker.before_call()
+        return True
+    except CircuitOpenError:
+        return False
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker('test', failure_threshold=3, recovery_timeout=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state() == CLOSED
+    breaker.before_call()
+
+    breaker.record_failure()
+    assert breaker.state() == OPEN
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.before_call()
+    assert error.value.retry_after == 61
+
+
+def test_a_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker('test', failure_threshold=3, recovery_timeout=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state() == CLOSED
+    assert breaker.status()['failures'] == 2
+
+
+def test_half_open_lets_one_trial_through_after_the_cool_down(clock):
+    breaker = CircuitBreaker('test', failure_threshold=1, recovery_timeout=60)
+    breaker.record_failure()
+
+    clock.now += 59
+    assert not attempt(breaker)
+
+    clock.now += 2
+    assert breaker.state() == HALF_OPEN
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        allowed = list(pool.map(lambda _: attempt(CircuitBreaker('test', 1, 60)), range(8)))
+    assert allowed.count(True) == 1
+
+
+def test_a_failed_trial_restarts_the_cool_down(clock):
+    breaker = CircuitBreaker('test', failure_threshold=1, recovery_timeout=60)
+    breaker.record_failure()
+    clock.now += 61
+    assert attempt(breaker)
+
+    breaker.record_failure()
+    assert breaker.state() == OPEN
+    clock.now += 61
+    assert attempt(breaker)
+
+
+def test_a_successful_trial_closes_the_circuit(clock):
+    breaker = CircuitBreaker('test', failure_threshold=1, recovery_timeout=60)
+    breaker.record_failure()
+    clock.now += 61
+    assert attempt(breaker)
+
+    breaker.record_success()
+    assert breaker.state() == CLOSED
+    assert breaker.status() == {'state': CLOSED, 'failures': 0, 'retry_after': 0}
+    assert attempt(breaker)
+    assert attempt(breaker)
+
+
+def test_success_on_a_closed_circuit_does_not_write(clock, monkeypatch):
+    breaker = CircuitBreaker('test')
+    deletes = []
+    monkeypatch.setattr(cache, 'delete_many', lambda keys, *args, **kwargs: deletes.append(keys))
+    breaker.record_success()
+    assert deletes == []
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-q']))
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Tests for the read-replica router and the primary pin cookie
+"""
+
+import os
+import sys
+import time
+from pathlib import Path
+
+import django
+
+project_dir = Path(__file__).resolve().parent
+sys.path.append(str(project_dir))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Ecoweb.settings')
+django.setup()
+
+import pytest
+from django.conf import settings
+from django.db import router
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from Ecoweb import db_routers
+from Ecoweb.middleware import ReplicaPinMiddleware
+from Ecoweb.models import Item, Order
+
+WITH_REPLICA = dict(settings.DATABASES, replica=dict(settings.DATABASES['default']))
+
+
+def run_request(view, cookies=None):
+    request = RequestFactory().get('/')
+    request.COOKIES.update(cookies or {})
+    return ReplicaPinMiddleware(view)(request)
+
+
+@pytest.fixture
+def replica():
+    with override_settings(DATABASES=WITH_REPLICA):
+        yield
+
+
+def test_primary_only_without_replica():
+    seen = []
+    run_request(lambda request: seen.append(router.db_for_read(Item)) or HttpResponse())
+    assert seen == ['default']
+
+
+def test_outside_requests_reads_use_primary(replica):
+    assert router.db_for_read(Item) == 'default'
+
+
+def test_catalog_reads_go_to_replica(replica):
+    seen = []
+
+    def view(request):
+        seen.append((router.db_for_read(Item), router.db_for_read(Order)))
+        return HttpResponse()
+
+    response = run_request(view)
+    assert seen == [('replica', 'default')]
+    assert settings.REPLICA_PIN_COOKIE not in response.cookies
+
+
+def test_write_pins_client_to_primary(replica):
+    seen = []
+
+    def view(request):
+        seen.append(router.db_for_read(Item))
+        router.db_for_write(Order)
+        # Reads later in the same request see the write too
+        seen.append(router.db_for_read(Item))
+        return HttpResponse()
+
+    response = run_request(view)
+    assert seen == ['replica', 'default']
+    pin = response.cookies[settings.REPLICA_PIN_COOKIE]
+    assert pin['max-age'] == settings.REPLICA_PIN_SECONDS
+
+    seen.clear()
+    run_request(lambda request: seen.append(router.db_for_read(Item)) or HttpResponse(),
+                cookies={settings.REPLICA_PIN_COOKIE: pin.value})
+    assert seen == ['default']
+
+
+def test_expired_or_garbled_pin_is_ignored(replica):
+    for value in [str(int(time.time()) - 1), 'nonsense']:
+        seen = []
+        run_request(lambda request: seen.append(router.db_for_read(Item)) or HttpResponse(),
+                    cookies={settings.REPLICA_PIN_COOKIE: value})
+        assert seen == ['replica'], value
+
+
+def test_migrations_only_run_on_primary():
+    assert db_routers.ReplicaRouter().allow_migrate('default', 'Ecoweb')
+    assert not db_routers.ReplicaRouter().allow_migrate('replica', 'Ecoweb')
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-q']))
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Tests for version-keyed template fragment caching
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import django
+
+project_dir = Path(__file__).resolve().parent
+sys.path.append(str(project_dir))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Ecoweb.settings')
+django.setup()
+
+import pytest
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.template import Context, Template
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from Ecoweb import fragment_cache
+from Ecoweb.models import Item
+
+GRID = Template(
+    '{% load cache %}'
+    '{% cache fragment_cache_timeout grid release catalog_version %}'
+    '{% for item in items %}'
+    '{% cache fragment_cache_timeout card release item.pk item.title %}[{{ item.render }}]{% endcache %}'
+    '{% endfor %}'
+    '{% endcache %}'
+)
+
+
+class Card:
+    def __init__(self, pk, title):
+        self.pk = pk
+        self.title = title
+        self.renders = 0
+
+    def render(self):
+        self.renders += 1
+        return self.title
+
+
+@pytest.fixture(autouse=True)
+def locmem_cache():
+    with override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'fragments'}},
+        FRAGMENT_CACHE_TIMEOUT=300,
+    ):
+        cache.clear()
+        yield
+
+
+def render(items):
+    context = fragment_cache.fragment_cache(RequestFactory().get('/'))
+    return GRID.render(Context(dict(context, items=items)))
+
+
+def test_item_signals_bump_the_catalog_version():
+    version = fragment_cache.catalog_version()
+    post_save.send(sender=Item, instance=Item(pk=1), created=False)
+    assert fragment_cache.catalog_version() == version + 1
+    post_delete.send(sender=Item, instance=Item(pk=1))
+    assert fragment_cache.catalog_version() == version + 2
+
+
+def test_lost_version_never_goes_backwards():
+    version = fragment_cache.catalog_version()
+    cache.clear()
+    assert fragment_cache.bump_catalog_version() > version
+
+
+def test_grid_rebuilds_only_changed_cards():
+    items = [Card(1, 'boots'), Card(2, 'sandals')]
+    assert render(items) == '[boots][sandals]'
+    # Cached grid: no card is looked at, even if the list changed underneath
+    items.append(Card(3, 'slippers'))
+    assert render(items) == '[boots][sandals]'
+    assert [item.renders for item in items] == [1, 1, 0]
+
+    items[1].title = 'flip-flops'
+    fragment_cache.bump_catalog_version()
+    assert render(items) == '[boots][flip-flops][slippers]'
+    assert [item.renders for item in items] == [1, 2, 1]
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-q']))
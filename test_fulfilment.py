@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Tests for settling orders from payment results
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import django
+
+project_dir = Path(__file__).resolve().parent
+sys.path.append(str(project_dir))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Ecoweb.settings')
+django.setup()
+
+import pytest
+from django.contrib.auth.models import User
+
+from Ecoweb.fulfilment import apply_pesapal_status, fail_order
+from Ecoweb.models import Order
+
+
+pytestmark = pytest.mark.database(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'fulfilment'}},
+)
+
+
+@pytest.fixture
+def order():
+    user, _ = User.objects.get_or_create(username='fulfilment')
+    return Order.objects.create(user=user)
+
+
+def test_a_pending_order_is_failed(order):
+    assert fail_order(order)
+    assert order.payment_status == 'FAILED'
+    order.refresh_from_db()
+    assert order.payment_status == 'FAILED'
+
+
+def test_a_late_failure_does_not_undo_a_payment(order):
+    assert apply_pesapal_status(order, {'payment_status_description': 'Completed'}) == 'COMPLETED'
+    # A stale copy of the order, as a late callback would load it
+    stale = Order.objects.get(pk=order.pk)
+    stale.payment_status = 'PENDING'
+
+    assert not fail_order(stale)
+    order.refresh_from_db()
+    assert (order.payment_status, order.ordered) == ('COMPLETED', True)
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-q']))
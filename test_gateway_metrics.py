@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Tests for the payment and SMS gateway telemetry
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+import django
+
+project_dir = Path(__file__).resolve().parent
+sys.path.append(str(project_dir))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Ecoweb.settings')
+django.setup()
+
+import pytest
+import requests
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.test.utils import override_settings
+
+from Ecoweb import gateway_metrics, mpesa_service
+from Ecoweb.mpesa_service import CIRCUIT_STK_QUERY, MpesaService
+
+
+class Response:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        if self.body is None:
+            raise ValueError('No JSON')
+        return self.body
+
+
+@pytest.fixture(autouse=True)
+def gateway_cache():
+    with override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'gateway'}},
+    ):
+        cache.clear()
+        yield
+
+
+def test_statuses_result_codes_and_retries_are_counted():
+    for body in [{'ResultCode': '0'}, {'ResultCode': '1032'}, {'errorCode': '500.001.1001'}]:
+        with gateway_metrics.call('mpesa_stk_query') as call:
+            call.response = Response(200 if 'ResultCode' in body else 500, body)
+    with gateway_metrics.call('africastalking_messaging', retries=2) as call:
+        call.response = Response(201, {'SMSMessageData': {'Recipients': [{'statusCode': 101}, {'statusCode': 406}]}})
+    with gateway_metrics.call('africastalking_messaging') as call:
+        call.response = Response(502, None)
+
+    stats = gateway_metrics.snapshot()
+    assert set(stats) == {'mpesa_stk_query', 'africastalking_messaging'}
+    assert stats['mpesa_stk_query']['calls'] == 3
+    assert stats['mpesa_stk_query']['status'] == {'200': 2, '500': 1}
+    assert stats['mpesa_stk_query']['result'] == {'0': 1, '1032': 1, '500.001.1001': 1}
+    assert stats['africastalking_messaging']['status'] == {'201': 1, '502': 1}
+    assert stats['africastalking_messaging']['result'] == {'101': 1, '406': 1}
+    assert stats['africastalking_messaging']['retries'] == 2
+
+    text = gateway_metrics.exposition(stats)
+    assert 'ecoweb_gateway_duration_seconds_count{endpoint="mpesa_stk_query"} 3' in text
+    assert 'ecoweb_gateway_result_codes_total{endpoint="mpesa_stk_query",code="1032"} 1' in text
+    assert 'ecoweb_gateway_retries_total{endpoint="africastalking_messaging"} 2' in text
+
+    gateway_metrics.reset()
+    assert gateway_metrics.snapshot() == {}
+
+
+def test_daraja_timeouts_are_counted_per_endpoint(monkeypatch):
+    def timeout(*args, **kwargs):
+        raise requests.ReadTimeout('read timed out')
+
+    monkeypatch.setattr(requests, 'request', timeout)
+    with pytest.raises(requests.Timeout):
+        MpesaService()._request(CIRCUIT_STK_QUERY, 'POST', 'https://daraja.invalid/query')
+    monkeypatch.setattr(requests, 'request', lambda *args, **kwargs: Response(200, {'ResultCode': '0'}))
+    MpesaService()._request(CIRCUIT_STK_QUERY, 'POST', 'https://daraja.invalid/query')
+
+    stats = gateway_metrics.snapshot()[CIRCUIT_STK_QUERY]
+    assert stats['timeouts'] == 1
+    assert stats['status'] == {'timeout': 1, '200': 1}
+
+
+def test_async_calls_keep_cache_writes_off_the_event_loop(monkeypatch):
+    on_loop = []
+
+    def watch(method):
+        original = getattr(LocMemCache, method)
+
+        def watched(self, *args, **kwargs):
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(method)
+            except RuntimeError:
+                pass
+            return original(self, *args, **kwargs)
+        monkeypatch.setattr(LocMemCache, method, watched)
+
+    for method in ('get', 'get_many', 'add', 'set', 'incr', 'delete', 'delete_many'):
+        watch(method)
+
+    class Client:
+        async def request(self, method, url, **kwargs):
+            return Response(200, {'ResultCode': '1032'})
+
+    monkeypatch.setattr(mpesa_service, 'get_async_client', Client)
+    asyncio.run(MpesaService()._arequest(CIRCUIT_STK_QUERY, 'POST', 'https://daraja.invalid/query'))
+
+    assert on_loop == []
+    assert gateway_metrics.snapshot()[CIRCUIT_STK_QUERY]['result'] == {'1032': 1}
+
+
+def test_quantile_interpolates_within_buckets():
+    buckets = [0] * (len(gateway_metrics.BUCKETS) + 1)
+    # Ten calls in (0.1, 0.25]
+    buckets[gateway_metrics.BUCKETS.index(0.25)] = 10
+    assert gateway_metrics.quantile(buckets, 0.5) == pytest.approx(0.175)
+    assert gateway_metrics.quantile([0] * len(buckets), 0.5) is None
+
+
+def test_result_codes_added_concurrently_are_all_kept(monkeypatch):
+    get = LocMemCache.get
+
+    def slow_get(self, *args, **kwargs):
+        # Widen any read-modify-write window, as a busy shared cache would
+        value = get(self, *args, **kwargs)
+        time.sleep(0.01)
+        return value
+
+    codes = [str(code) for code in range(40)]
+    start_together = threading.Barrier(len(codes))
+
+    def record(code):
+        start_together.wait()
+        with gateway_metrics.call('mpesa_stk_query') as call:
+            call.response = Response(200, {'ResultCode': code})
+
+    threads = [threading.Thread(target=record, args=(code,)) for code in codes]
+    with monkeypatch.context() as patched:
+        # Each thread has its own cache instance
+        patched.setattr(LocMemCache, 'get', slow_get)
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    stats = gateway_metrics.snapshot()['mpesa_stk_query']
+    assert stats['result'] == {code: 1 for code in codes}
+    assert stats['status'] == {'200': 40}
+
+    gateway_metrics.reset()
+    assert gateway_metrics.snapshot() == {}
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-q']))
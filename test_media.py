@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Tests for content-hashed media storage and media serving
+"""
+
+import asyncio
+import os
+import sys
+import warnings
+from pathlib import Path
+
+import django
+
+project_dir = Path(__file__).resolve().parent
+sys.path.append(str(project_dir))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Ecoweb.settings')
+django.setup()
+
+import pytest
+from django.core.files.base import ContentFile
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from Ecoweb.middleware import MediaFilesMiddleware
+from Ecoweb.storage import HashedMediaStorage
+
+PHOTO = b'\xff\xd8\xff' + bytes(range(256)) * 4
+
+
+@pytest.fixture
+def media_root(tmp_path):
+    with override_settings(MEDIA_ROOT=str(tmp_path), MEDIA_URL='/media/'):
+        yield tmp_path
+
+
+def serve(path, **headers):
+    middleware = MediaFilesMiddleware(lambda request: HttpResponse(status=404))
+    response = middleware(RequestFactory().get(path, headers=headers))
+    return response, b''.join(response.streaming_content) if response.streaming else response.content
+
+
+def test_uploads_are_named_by_content(media_root):
+    storage = HashedMediaStorage()
+    name = storage.save('pics/item-13.jpg', ContentFile(PHOTO))
+    assert name.startswith('pics/item-13.') and name.endswith('.jpg') and len(name) == len('pics/item-13.jpg') + 13
+    # Same photo again: same file, no random suffix; re-saving a hashed name keeps one hash
+    assert storage.save('pics/item-13.jpg', ContentFile(PHOTO)) == name
+    assert storage.save(name, ContentFile(PHOTO)) == name
+    edited = storage.save('pics/item-13.jpg', ContentFile(PHOTO + b'!'))
+    assert edited != name
+    assert sorted((media_root / 'pics').iterdir()) == sorted([media_root / name, media_root / edited])
+
+
+def test_hashed_media_is_immutable_and_supports_ranges(media_root):
+    name = HashedMediaStorage().save('pics/item-3.jpg', ContentFile(PHOTO))
+
+    response, body = serve(f'/media/{name}')
+    assert response.status_code == 200 and body == PHOTO
+    assert response['Cache-Control'] == 'max-age=315360000, public, immutable'
+
+    response, body = serve(f'/media/{name}', range='bytes=3-9')
+    assert response.status_code == 206 and body == PHOTO[3:10]
+    assert response['Content-Range'] == f'bytes 3-9/{len(PHOTO)}'
+
+    response, body = serve(f'/media/{name}', if_none_match=response['ETag'])
+    assert response.status_code == 304 and body == b''
+
+
+def test_unhashed_and_missing_media(media_root):
+    (media_root / 'pics').mkdir()
+    (media_root / 'pics' / 'item-3_c3D7vRs.jpg').write_bytes(PHOTO)
+
+    response, _ = serve('/media/pics/item-3_c3D7vRs.jpg')
+    assert response['Cache-Control'] == 'max-age=3600, public'
+    assert serve('/media/pics/nope.jpg')[0].status_code == 404
+    assert serve('/media/../settings.py')[0].status_code == 404
+
+
+def test_async_media_is_streamed_without_buffering(media_root):
+    name = HashedMediaStorage().save('pics/item-3.jpg', ContentFile(PHOTO * 100))
+
+    async def not_found(request):
+        return HttpResponse(status=404)
+
+    async def aserve(path, **headers):
+        middleware = MediaFilesMiddleware(not_found)
+        response = await middleware(RequestFactory().get(path, headers=headers))
+        with warnings.catch_warnings():
+            # Django warns when it has to buffer a sync iterator under ASGI
+            warnings.simplefilter('error')
+            chunks = [chunk async for chunk in response] if response.streaming else [response.content]
+        return response, chunks
+
+    response, chunks = asyncio.run(aserve(f'/media/{name}'))
+    assert response.status_code == 200 and response.is_async
+    assert len(chunks) > 1 and b''.join(chunks) == PHOTO * 100
+    assert response['Content-Length'] == str(len(PHOTO) * 100)
+    assert response['Content-Type'] == 'image/jpeg'
+
+    response, chunks = asyncio.run(aserve(f'/media/{name}', range='bytes=3-9'))
+    assert response.status_code == 206 and b''.join(chunks) == PHOTO[3:10]
+
+    response, chunks = asyncio.run(aserve(f'/media/{name}', if_none_match=response['ETag']))
+    assert response.status_code == 304 and chunks == [b'']
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-q']))
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Tests for per-request timing, Server-Timing and the /metrics endpoint
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import django
+
+project_dir = Path(__file__).resolve().parent
+sys.path.append(str(project_dir))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Ecoweb.settings')
+django.setup()
+
+import pytest
+from django.http import HttpResponse
+from django.template import engines
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from Ecoweb import metrics
+from Ecoweb.middleware import RequestMetricsMiddleware
+from Ecoweb.views import metrics as metrics_view
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    registry = metrics.Registry()
+    monkeypatch.setattr(metrics, 'registry', registry)
+    return registry
+
+
+def view(request):
+    with metrics.timed_outbound(metrics.DARAJA):
+        pass
+    html = engines['django'].from_string('{% for i in items %}{{ i }}{% endfor %}').render({'items': [1, 2]})
+    return HttpResponse(html)
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    timings = metrics.RequestTimings()
+    timings.db_queries = 3
+    for total in [0.003, 0.02, 0.02, 40]:
+        registry.record('detail', 'GET', 200, total, timings)
+
+    text = registry.exposition()
+    assert 'ecoweb_requests_total{view="detail",method="GET",status="200"} 4' in text
+    assert 'ecoweb_request_duration_seconds_bucket{view="detail",le="0.005"} 1' in text
+    assert 'ecoweb_request_duration_seconds_bucket{view="detail",le="0.025"} 3' in text
+    assert 'ecoweb_request_duration_seconds_bucket{view="detail",le="30.0"} 3' in text
+    assert 'ecoweb_request_duration_seconds_bucket{view="detail",le="+Inf"} 4' in text
+    assert 'ecoweb_db_queries_bucket{view="detail",le="2.0"} 0' in text
+    assert 'ecoweb_db_queries_bucket{view="detail",le="3.0"} 4' in text
+
+
+@override_settings(DEBUG=True)
+def test_server_timing_breaks_down_the_request(registry):
+    response = RequestMetricsMiddleware(view)(RequestFactory().get('/'))
+
+    entries = [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')]
+    assert entries == ['total', 'db', 'tpl', metrics.DARAJA]
+    text = registry.exposition()
+    assert 'ecoweb_requests_total{view="unmatched",method="GET",status="200"} 1' in text
+    assert 'ecoweb_outbound_duration_seconds_count{view="unmatched",service="daraja"} 1' in text
+    assert metrics.current() is None
+
+
+@override_settings(DEBUG=False)
+def test_server_timing_is_hidden_from_anonymous_clients(registry):
+    response = RequestMetricsMiddleware(view)(RequestFactory().get('/'))
+    assert not response.has_header('Server-Timing')
+    assert 'ecoweb_requests_total' in registry.exposition()
+
+
+def test_metrics_endpoint_requires_token():
+    with override_settings(METRICS_TOKEN='s3cret'):
+        assert metrics_view(RequestFactory().get('/metrics')).status_code == 401
+        response = metrics_view(RequestFactory().get('/metrics', HTTP_AUTHORIZATION='Bearer s3cret'))
+        assert response.status_code == 200
+        assert response['Content-Type'].startswith('text/plain; version=0.0.4')
+
+    with override_settings(METRICS_TOKEN='', DEBUG=False), pytest.raises(django.http.Http404):
+        metrics_view(RequestFactory().get('/metrics'))
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-q']))
@@ -17,6 +17,7 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Ecoweb.settings')
 django.setup()
 
 from Ecoweb.mpesa_service import MpesaService
+from Ecoweb.phone import normalize_phone
 
 def test_mpesa_config():
     """Test M-Pesa configuration and service"""
@@ -45,7 +46,7 @@ def test_mpesa_config():
     print("Phone Number Formatting Test:")
     for number in test_numbers:
         try:
-            formatted = mpesa.format_phone_number(number)
+            formatted = normalize_phone(number)
             print(f"✅ {number} -> {formatted}")
         except Exception as e:
             print(f"❌ {number} -> Error: {e}")
@@ -99,7 +100,7 @@ def test_your_number():
     
     try:
         # Test formatting
-        formatted = mpesa.format_phone_number(your_number)
+        formatted = normalize_phone(your_number)
         print(f"✅ Formatted correctly: {formatted}")
         
         # Note: Don't actually send STK push to real number in test
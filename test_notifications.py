@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Tests for the notification outbox
+"""
+
+import json
+import os
+import sys
+from datetime import timedelta
+from pathlib import Path
+
+import django
+
+project_dir = Path(__file__).resolve().parent
+sys.path.append(str(project_dir))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Ecoweb.settings')
+django.setup()
+
+import pytest
+from django.contrib.auth.models import AnonymousUser, User
+from django.db import IntegrityError, connection, transaction
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from Ecoweb import notifications
+from Ecoweb.api_views import PhoneConfirmationAPI
+from Ecoweb.models import Notification, Order
+
+
+pytestmark = pytest.mark.database(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'outbox'}},
+)
+
+
+@pytest.fixture(autouse=True)
+def empty_outbox():
+    Notification.objects.all().delete()
+
+
+def confirm_phone(user, phone):
+    request = RequestFactory().post('/api/phone-confirmation/', json.dumps({'phone': phone}), content_type='application/json')
+    request.user = user
+    return json.loads(PhoneConfirmationAPI.as_view()(request).content)
+
+
+def test_phone_confirmation_is_sent_once_per_order():
+    user = User.objects.create_user('confirmer', password='x')
+    first = Order.objects.create(user=user, ordered_date=timezone.now())
+
+    assert confirm_phone(user, '0712345678')['message_sent'] is True
+    # A repeat for the same order and number queues nothing, and says so
+    assert confirm_phone(user, '0712345678')['message_sent'] is False
+    assert confirm_phone(user, '0722000000')['message_sent'] is True
+
+    Order.objects.filter(pk=first.pk).update(ordered=True)
+    Order.objects.create(user=user, ordered_date=timezone.now())
+    assert confirm_phone(user, '0712345678')['message_sent'] is True
+    assert Notification.objects.filter(template='phone_confirmation').count() == 3
+
+
+def test_anonymous_phone_confirmation_is_sent_once_a_day():
+    assert confirm_phone(AnonymousUser(), '0733000000')['message_sent'] is True
+    assert confirm_phone(AnonymousUser(), '0733000000')['message_sent'] is False
+
+
+def queue_emails(count):
+    return [
+        notifications.enqueue('promo', 'email', f'customer{n}@example.com', 'Hello', dedup_key=f'promo:{n}')[0]
+        for n in range(count)
+    ]
+
+
+def test_a_dedup_key_is_queued_once():
+    first, created = notifications.enqueue('promo', 'sms', '254712345678', 'Hello', dedup_key='promo:1')
+    assert created
+    again, created = notifications.enqueue('promo', 'sms', '254722000000', 'Hello again', dedup_key='promo:1')
+    assert not created
+    assert again.pk == first.pk and again.recipient == '254712345678'
+
+    with pytest.raises(IntegrityError), transaction.atomic():
+        Notification.objects.create(template='promo', channel='sms', recipient='254733000000', body='Hi', dedup_key='promo:1')
+    assert Notification.objects.count() == 1
+
+
+def test_losing_an_enqueue_race_returns_the_winner(monkeypatch):
+    notifications.enqueue('promo', 'sms', '254700000001', 'Hello', dedup_key='promo:race')
+
+    def racing_get_or_create(dedup_key, defaults):
+        # Another worker inserted the key between our SELECT and INSERT
+        raise IntegrityError('UNIQUE constraint failed: dedup_key')
+
+    monkeypatch.setattr(Notification.objects, 'get_or_create', racing_get_or_create)
+    notification, created = notifications.enqueue('promo', 'sms', '254712345678', 'Hello', dedup_key='promo:race')
+
+    assert not created
+    assert notification.recipient == '254700000001'
+    assert Notification.objects.filter(dedup_key='promo:race').count() == 1
+
+
+def test_workers_do_not_claim_the_same_notifications():
+    queue_emails(5)
+
+    first = notifications._claim(3)
+    second = notifications._claim(10)
+
+    assert len(first) == 3 and len(second) == 2
+    assert not {n.pk for n in first} & {n.pk for n in second}
+    assert notifications._claim(10) == []
+    assert set(Notification.objects.values_list('status', flat=True)) == {'SENDING'}
+
+
+def test_an_expired_claim_is_picked_up_again():
+    queue_emails(2)
+    claimed = notifications._claim(10)
+    assert notifications._claim(10) == []
+
+    # The worker holding the lease died
+    Notification.objects.filter(pk=claimed[0].pk).update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+
+    assert [n.pk for n in notifications._claim(10)] == [claimed[0].pk]
+
+
+def test_failures_are_retried_with_backoff_until_max_attempts(monkeypatch):
+    monkeypatch.setattr(notifications, 'send_emails', lambda emails: {n.pk: 'Connection refused' for n in emails})
+    notification = queue_emails(1)[0]
+
+    for attempt, delay in [(1, 30), (2, 60)]:
+        started = timezone.now()
+        assert notifications.deliver_pending(max_attempts=3) == (0, 1)
+        notification.refresh_from_db()
+        assert (notification.status, notification.attempts) == ('PENDING', attempt)
+        assert notification.last_error == 'Connection refused'
+        assert started + timedelta(seconds=delay) <= notification.next_attempt_at <= timezone.now() + timedelta(seconds=delay)
+        # Not due yet
+        assert notifications.deliver_pending(max_attempts=3) == (0, 0)
+        Notification.objects.filter(pk=notification.pk).update(next_attempt_at=timezone.now())
+
+    assert notifications.deliver_pending(max_attempts=3) == (0, 1)
+    notification.refresh_from_db()
+    assert (notification.status, notification.attempts) == ('FAILED', 3)
+    assert notifications.deliver_pending(max_attempts=3) == (0, 0)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+def test_a_retry_that_succeeds_is_marked_sent(monkeypatch):
+    notification = queue_emails(1)[0]
+    with monkeypatch.context() as patched:
+        patched.setattr(notifications, 'send_emails', lambda emails: {n.pk: 'Timed out' for n in emails})
+        assert notifications.deliver_pending() == (0, 1)
+    Notification.objects.filter(pk=notification.pk).update(next_attempt_at=timezone.now())
+
+    assert notifications.deliver_pending() == (1, 0)
+    notification.refresh_from_db()
+    assert (notification.status, notification.attempts, notification.last_error) == ('SENT', 2, '')
+    assert notification.sent_at is not None
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-q']))
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Tests for the anonymous full-page cache
+"""
+
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import django
+
+project_dir = Path(__file__).resolve().parent
+sys.path.append(str(project_dir))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Ecoweb.settings')
+django.setup()
+
+import pytest
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models.signals import post_save
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from Ecoweb import fragment_cache
+from Ecoweb.middleware import PageCacheMiddleware
+from Ecoweb.models import Item
+
+
+@pytest.fixture(autouse=True)
+def page_cache():
+    with override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'pages'}},
+        PAGE_CACHE_TIMEOUT=300,
+    ):
+        cache.clear()
+        yield
+
+
+class View:
+    def __init__(self, response=None):
+        self.calls = 0
+        self.response = response or (lambda: HttpResponse('page'))
+
+    def __call__(self, request):
+        self.calls += 1
+        return self.response()
+
+
+def get(view, path='/about/', cookies=None, **headers):
+    request = RequestFactory().get(path, headers=headers)
+    request.COOKIES.update(cookies or {})
+    return PageCacheMiddleware(view)(request)
+
+
+def test_anonymous_pages_are_served_from_cache():
+    view = View()
+    first = get(view)
+    second = get(view)
+    assert (first['X-Cache'], second['X-Cache'], view.calls) == ('MISS', 'HIT', 1)
+    assert second.content == b'page'
+    assert second['Cache-Control'] == f'public, max-age=0, s-maxage={settings.PAGE_CACHE_CDN_MAX_AGE}'
+    assert second['Vary'] == 'Cookie'
+    assert get(view, if_none_match=second['ETag']).status_code == 304
+    # Tracking parameters share the page; anything else is not cached
+    assert get(view, '/about/?utm_source=newsletter')['X-Cache'] == 'HIT'
+    assert 'X-Cache' not in get(view, '/about/?page=2')
+
+
+def test_signed_in_and_cookie_setting_responses_bypass_cache():
+    view = View()
+    get(view)
+    response = get(view, cookies={settings.SESSION_COOKIE_NAME: 'abc'})
+    assert 'X-Cache' not in response and response['Cache-Control'] == 'private'
+    assert view.calls == 2
+
+    def with_cookie():
+        response = HttpResponse('page')
+        response.set_cookie('csrftoken', 'x')
+        return response
+
+    view = View(with_cookie)
+    get(view, '/contact/')
+    get(view, '/contact/')
+    assert view.calls == 2
+
+
+def test_item_change_purges_its_pages():
+    view = View()
+    get(view, '/')
+    get(view, '/product/boots/')
+    get(view, '/about/')
+    post_save.send(sender=Item, instance=Item(pk=1, slug='boots'), created=False)
+    assert [get(view, path)['X-Cache'] for path in ['/', '/product/boots/', '/about/']] == ['MISS', 'MISS', 'HIT']
+
+
+def test_page_rendered_across_a_catalog_change_is_not_stored():
+    def render_during_change():
+        fragment_cache.bump_catalog_version()
+        return HttpResponse('old page')
+
+    view = View(render_during_change)
+    get(view, '/')
+    get(view, '/')
+    assert view.calls == 2
+
+
+def test_async_stack_is_served_from_cache(monkeypatch):
+    on_loop = []
+
+    def watch(method):
+        original = getattr(LocMemCache, method)
+
+        def watched(self, *args, **kwargs):
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(method)
+            except RuntimeError:
+                pass
+            return original(self, *args, **kwargs)
+        monkeypatch.setattr(LocMemCache, method, watched)
+
+    for method in ('get', 'add', 'set'):
+        watch(method)
+    view = View()
+
+    async def aview(request):
+        return view(request)
+
+    async def aget(path='/about/'):
+        return await PageCacheMiddleware(aview)(RequestFactory().get(path))
+
+    first, second = asyncio.run(aget()), asyncio.run(aget())
+    assert view.calls == 1
+    assert (first['X-Cache'], second['X-Cache']) == ('MISS', 'HIT')
+    assert second.content == b'page' and second['ETag'] == first['ETag']
+
+    def render_during_change():
+        fragment_cache.bump_catalog_version()
+        return HttpResponse('old page')
+
+    view = View(render_during_change)
+    asyncio.run(aget('/'))
+    asyncio.run(aget('/'))
+    assert view.calls == 2
+    assert on_loop == []
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-q']))
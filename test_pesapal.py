@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Tests for the Pesapal client's status lookups and credential caching
+"""
+
+import asyncio
+import os
+import sys
+import time
+from datetime import timedelta
+from pathlib import Path
+
+import django
+
+project_dir = Path(__file__).resolve().parent
+sys.path.append(str(project_dir))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Ecoweb.settings')
+django.setup()
+
+import pytest
+import requests
+from django.core.cache import cache
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from Ecoweb import pesapal_service
+from Ecoweb.pesapal_service import PesapalService
+
+
+@pytest.fixture(autouse=True)
+def pesapal_cache():
+    with override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'pesapal'}},
+        PESAPAL_CONSUMER_KEY='key',
+        PESAPAL_CONSUMER_SECRET='secret',
+        PESAPAL_IPN_URL='https://shop.example.com/payment/ipn/',
+    ):
+        cache.clear()
+        yield
+
+
+class StubbedStatus(PesapalService):
+    """Answers status lookups with ``statuses`` in turn, after ``delay`` seconds"""
+
+    def __init__(self, *statuses, delay=0.0):
+        super().__init__()
+        self.statuses = list(statuses)
+        self.delay = delay
+        self.lookups = 0
+
+    async def aget_access_token(self):
+        return 'token'
+
+    async def aget_transaction_status(self, order_tracking_id, token):
+        self.lookups += 1
+        await asyncio.sleep(self.delay)
+        return {'payment_status_description': self.statuses.pop(0)}
+
+
+def test_concurrent_lookups_share_one_upstream_call():
+    service = StubbedStatus('Pending', delay=0.2)
+
+    async def callback_and_ipn():
+        return await asyncio.gather(*(service.aresolve_transaction_status('track-1') for _ in range(3)))
+
+    results = asyncio.run(callback_and_ipn())
+    assert service.lookups == 1
+    assert results == [{'payment_status_description': 'Pending'}] * 3
+
+
+def test_only_terminal_statuses_are_cached():
+    service = StubbedStatus('Pending', 'Completed', 'Failed')
+    lookup = service.aresolve_transaction_status
+
+    assert asyncio.run(lookup('track-2'))['payment_status_description'] == 'Pending'
+    # The IPN that follows must see the change
+    assert asyncio.run(lookup('track-2'))['payment_status_description'] == 'Completed'
+    assert asyncio.run(lookup('track-2'))['payment_status_description'] == 'Completed'
+    assert service.lookups == 2
+
+
+class Response:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+class Pesapal:
+    """Stands in for requests.post; answers each endpoint with the next of its responses"""
+
+    def __init__(self, **responses):
+        self.responses = responses
+        self.calls = []
+
+    def __call__(self, url, json=None, headers=None, timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls.append(endpoint)
+        return self.responses[endpoint].pop(0)
+
+
+def token_response(token, expires_in):
+    # Pesapal sends UTC with 7 fractional digits
+    expiry = (timezone.now() + timedelta(seconds=expires_in)).strftime('%Y-%m-%dT%H:%M:%S.%f0Z')
+    return Response(200, {'token': token, 'expiryDate': expiry, 'status': '200'})
+
+
+def test_the_token_is_reused_until_shortly_before_it_expires(monkeypatch):
+    pesapal = Pesapal(RequestToken=[token_response('first', 32), token_response('second', 300)])
+    monkeypatch.setattr(requests, 'post', pesapal)
+    service = PesapalService()
+
+    assert service.get_access_token() == 'first'
+    assert service.get_access_token() == 'first'
+    assert pesapal.calls == ['RequestToken']
+
+    # Cached for 1 s: until 30 s before Pesapal's expiryDate
+    time.sleep(1.1)
+    assert service.get_access_token() == 'second'
+    assert pesapal.calls == ['RequestToken'] * 2
+
+
+def test_a_token_about_to_expire_is_not_cached(monkeypatch):
+    pesapal = Pesapal(RequestToken=[token_response('first', 10), token_response('second', 300)])
+    monkeypatch.setattr(requests, 'post', pesapal)
+    service = PesapalService()
+
+    assert service.get_access_token() == 'first'
+    assert service.get_access_token() == 'second'
+
+
+def test_the_ipn_url_is_registered_once(monkeypatch):
+    pesapal = Pesapal(RegisterIPN=[Response(500, {}), Response(200, {'ipn_id': 'ipn-1'}), Response(200, {'ipn_id': 'ipn-2'})])
+    monkeypatch.setattr(requests, 'post', pesapal)
+
+    # A failed registration is tried again next time
+    assert PesapalService().get_ipn_id('token') is None
+    assert PesapalService().get_ipn_id('token') == 'ipn-1'
+    assert PesapalService().get_ipn_id('token') == 'ipn-1'
+    assert pesapal.calls == ['RegisterIPN'] * 2
+
+    with override_settings(PESAPAL_IPN_URL='https://shop.example.com/other/ipn/'):
+        assert PesapalService().get_ipn_id('token') == 'ipn-2'
+
+
+def test_an_async_401_drops_the_cached_token(monkeypatch):
+    class Client:
+        async def get(self, url, headers=None, params=None, timeout=None):
+            return Response(401, {'error': {'code': 'invalid_token'}})
+
+    monkeypatch.setattr(pesapal_service, 'get_async_client', Client)
+    service = PesapalService()
+    cache.set(service.token_cache_key, 'revoked')
+
+    assert asyncio.run(service.aget_transaction_status('track-3', 'revoked')) is None
+    assert cache.get(service.token_cache_key) is None
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-q']))
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Property tests for Ecoweb.phone
+
+Random inputs built from Kenyan prefixes, digits and separators are checked
+against the normalizers the services used before they were merged.
+"""
+
+import itertools
+import random
+import re
+
+import pytest
+
+from Ecoweb.phone import InvalidPhoneNumber, normalize_phone, normalize_phone_or_none, normalize_phones
+
+SEED = 20240601
+CASES = 20000
+
+
+def legacy_service_format(phone):
+    """MpesaService / PesapalService.format_phone_number before the merge"""
+    phone = re.sub(r'\D', '', phone)
+    if phone.startswith('0'):
+        if not (phone.startswith('07') or phone.startswith('01')):
+            raise ValueError("Phone number must start with 07 or 01")
+        phone = '254' + phone[1:]
+    elif phone.startswith('254'):
+        if not (phone.startswith('2547') or phone.startswith('2541')):
+            raise ValueError("Phone number must be a valid Kenyan mobile number (7... or 1...)")
+    elif phone.startswith('7') or phone.startswith('1'):
+        phone = '254' + phone
+    else:
+        raise ValueError("Phone number must start with 07, 01 or 254")
+    if len(phone) != 12:
+        raise ValueError("Invalid phone number length. Expected 10 digits (07...) or 12 digits (254...)")
+    return phone
+
+
+def legacy_confirmation_format(phone):
+    """PhoneConfirmationAPI.format_phone_number before the merge"""
+    phone = re.sub(r'\D', '', phone)
+    if phone.startswith('0') and len(phone) == 10:
+        return '254' + phone[1:]
+    elif phone.startswith('254') and len(phone) == 12:
+        return phone
+    elif (phone.startswith('7') or phone.startswith('1')) and len(phone) == 9:
+        return '254' + phone
+    return None
+
+
+def random_phone(rng):
+    prefix = rng.choice(['', '0', '07', '01', '02', '254', '2547', '2541', '2542', '+254', '7', '1', '9', '25'])
+    body = ''.join(rng.choice('0123456789') for _ in range(rng.randint(0, 11)))
+    phone = prefix + body
+    # Sprinkle separators people type into forms
+    for _ in range(rng.randint(0, 3)):
+        at = rng.randint(0, len(phone))
+        phone = phone[:at] + rng.choice([' ', '-', '(', ')', '.', '+', 'x']) + phone[at:]
+    return phone
+
+
+def random_phones(count=CASES):
+    rng = random.Random(SEED)
+    return [random_phone(rng) for _ in range(count)]
+
+
+def outcome(func, phone):
+    try:
+        return func(phone)
+    except ValueError as e:
+        return ('error', str(e))
+
+
+def test_matches_legacy_service_rules():
+    for phone in random_phones():
+        expected = outcome(legacy_service_format, phone)
+        assert outcome(normalize_phone, phone) == expected, phone
+
+
+def test_valid_numbers_are_a_subset_of_legacy_confirmation_rules():
+    # The confirmation API used to also accept non-mobile numbers (020..., 2542...)
+    # that can never receive an STK push; everything else is unchanged
+    for phone in random_phones():
+        normalized = normalize_phone_or_none(phone)
+        legacy = legacy_confirmation_format(phone)
+        if normalized is not None:
+            assert normalized == legacy, phone
+        elif legacy is not None:
+            assert not legacy.startswith(('2547', '2541')), phone
+
+
+def test_output_is_canonical_and_idempotent():
+    for phone in random_phones():
+        normalized = normalize_phone_or_none(phone)
+        if normalized is None:
+            continue
+        assert re.fullmatch(r'254[17]\d{8}', normalized), phone
+        assert normalize_phone(normalized) == normalized
+        assert normalize_phone('+' + normalized) == normalized
+        assert normalize_phone('0' + normalized[3:]) == normalized
+
+
+def test_errors_are_value_errors():
+    with pytest.raises(ValueError):
+        normalize_phone('0201234567')
+    with pytest.raises(InvalidPhoneNumber):
+        normalize_phone('')
+    assert normalize_phone_or_none(None) is None
+
+
+def test_bulk_agrees_with_single_number_path():
+    phones = random_phones(5000)
+    assert list(normalize_phones(phones)) == [(p, normalize_phone_or_none(p)) for p in phones]
+
+
+def test_bulk_is_streaming():
+    endless = itertools.cycle(['0712 345 678', 'not a phone'])
+    first = list(itertools.islice(normalize_phones(endless), 4))
+    assert first == [
+        ('0712 345 678', '254712345678'),
+        ('not a phone', None),
+        ('0712 345 678', '254712345678'),
+        ('not a phone', None),
+    ]
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-q']))
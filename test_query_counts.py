@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Query budgets for every URL in Ecoweb/urls.py.
+
+Each view is requested twice, once with a small cart and once with a large
+one, against a throwaway test database. The query count must stay within
+the view's budget and must not grow with the number of cart lines.
+Sessions use the database backend, so the counts include a cold session
+load.
+"""
+
+import itertools
+import json
+import os
+import sys
+from pathlib import Path
+
+import django
+
+project_dir = Path(__file__).resolve().parent
+sys.path.append(str(project_dir))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Ecoweb.settings')
+django.setup()
+
+import pytest
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, get_resolver
+from django.utils import timezone
+
+from Ecoweb.models import Item, MpesaTransaction, Order, OrderItem
+
+SMALL_CART = 2
+LARGE_CART = 12
+
+# Queries per request; a logged-in page costs session + user + cart count
+BUDGETS = {
+    'account_signup': 0,
+    'account_login': 0,
+    'index': 4,
+    'search': 5,
+    'detail': 4,
+    'add-to-cart': 7,
+    'remove-from-cart': 9,
+    'linkage': 3,
+    'cart': 6,
+    'checkout': 6,
+    'complete': 3,
+    'about': 3,
+    'contact': 3,
+    'pesapal_callback': 1,
+    'pesapal_ipn': 1,
+    # Settles the order, stamps the callback and settlement times and queues the payment SMS
+    'mpesa_callback': 15,
+    'check_payment_status': 3,
+    'send_payment_confirmation': 0,
+    'send_payment_success': 0,
+    'health': 0,
+    'metrics': 0,
+}
+
+# A checkout POST also saves the billing details and checks for a pending push
+CHECKOUT_POST_BUDGET = 8
+
+_ids = itertools.count()
+
+
+pytestmark = pytest.mark.database(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'queries'}},
+    SESSION_ENGINE='django.contrib.sessions.backends.db',
+    PAGE_CACHE_TIMEOUT=0,
+    FRAGMENT_CACHE_TIMEOUT=0,
+    STATIC_BUNDLES=False,
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+    MPESA_TEST_MODE=True,
+    METRICS_TOKEN='metrics-token',
+)
+
+
+@pytest.fixture(scope='module', autouse=True)
+def catalog(database):
+    Item.objects.bulk_create([
+        Item(title=f'Sneaker {i}', price=1500 + i, photo=f'pics/sneaker-{i}.jpg', slug=f'sneaker-{i}')
+        for i in range(LARGE_CART + 1)
+    ])
+
+
+@pytest.fixture(autouse=True)
+def current_site():
+    # The login page looks up the current Site, which is cached per process
+    # (and cleared between tests by pytest-django); keep it out of the counts
+    Site.objects.get_current()
+
+
+def make_cart(lines, **order_fields):
+    """A user with an open order of ``lines`` lines"""
+    user = User.objects.create_user(f'shopper{next(_ids)}', password='x')
+    order = Order.objects.create(user=user, ordered_date=timezone.now(), **order_fields)
+    items = Item.objects.order_by('pk')[:lines]
+    order.items.add(*OrderItem.objects.bulk_create([OrderItem(user=user, item=item, quantity=2) for item in items]))
+    return user, order
+
+
+def scenario(name, lines):
+    """(user, method, path, request kwargs, expected status) for one URL name"""
+    user, order = make_cart(lines)
+    slug = Item.objects.order_by('pk').values_list('slug', flat=True)[0]
+    paid = dict(pesapal_tracking_id=f'track-{order.pk}', payment_status='COMPLETED')
+    if name in ('pesapal_callback', 'pesapal_ipn'):
+        Order.objects.filter(pk=order.pk).update(**paid)
+        return None, 'get', f'/payment/{"callback" if name == "pesapal_callback" else "ipn"}/', {'data': {'OrderTrackingId': paid['pesapal_tracking_id']}}, 302 if name == 'pesapal_callback' else 200
+    if name == 'mpesa_callback':
+        MpesaTransaction.objects.create(order=order, checkout_request_id=f'ws_CO_{order.pk}', merchant_request_id='m', phone_number='254700000000', amount=order.get_total())
+        body = {'Body': {'stkCallback': {'CheckoutRequestID': f'ws_CO_{order.pk}', 'ResultCode': 0, 'ResultDesc': 'OK', 'CallbackMetadata': {'Item': [
+            {'Name': 'MpesaReceiptNumber', 'Value': 'QK12345'}, {'Name': 'TransactionDate', 'Value': 20240101120000},
+        ]}}}}
+        return None, 'post', '/mpesa/callback/', {'data': json.dumps(body), 'content_type': 'application/json'}, 200
+    if name == 'check_payment_status':
+        MpesaTransaction.objects.create(order=order, checkout_request_id=f'ws_CO_{order.pk}', merchant_request_id='m', phone_number='254700000000', amount=1, status='SUCCESS')
+        return user, 'get', f'/check-payment-status/ws_CO_{order.pk}/', {}, 200
+    if name in ('send_payment_confirmation', 'send_payment_success'):
+        path = '/api/send-phone-confirmation/' if name == 'send_payment_confirmation' else '/api/send-payment-success/'
+        return None, 'post', path, {'data': json.dumps({'phone': '0712345678'}), 'content_type': 'application/json'}, 200
+    if name == 'metrics':
+        return None, 'get', '/metrics', {'HTTP_AUTHORIZATION': 'Bearer metrics-token'}, 200
+    if name in ('account_login', 'account_signup', 'health'):
+        return None, 'get', {'account_login': '/accounts/login/', 'account_signup': '/accounts/signup/', 'health': '/health/'}[name], {}, 200
+    path = {
+        'index': '/', 'search': '/search/?query=Sneaker', 'detail': f'/product/{slug}/', 'add-to-cart': f'/add-to-cart/{slug}/',
+        'remove-from-cart': f'/remove-from-cart/{slug}/', 'linkage': '/link/', 'cart': '/cart/',
+        'checkout': '/checkout/', 'complete': '/complete/', 'about': '/about/', 'contact': '/contact/',
+    }[name]
+    status = 302 if name in ('add-to-cart', 'remove-from-cart') else 200
+    return user, 'get', path, {}, status
+
+
+def count_queries(user, method, path, kwargs, status):
+    client = Client()
+    if user is not None:
+        client.force_login(user)
+    with CaptureQueriesContext(connection) as queries:
+        response = getattr(client, method)(path, secure=True, **kwargs)
+    assert response.status_code == status, (path, response.status_code)
+    return len(queries)
+
+
+def url_names():
+    # Unnamed patterns are the DEBUG-only static file routes
+    return [p.name for p in get_resolver().url_patterns if isinstance(p, URLPattern) and p.name]
+
+
+def test_every_url_has_a_budget():
+    assert sorted(url_names()) == sorted(BUDGETS)
+
+
+@pytest.mark.parametrize('name', sorted(BUDGETS))
+def test_query_budget(name):
+    small = count_queries(*scenario(name, SMALL_CART))
+    large = count_queries(*scenario(name, LARGE_CART))
+    assert large == small, f'{name}: {small} queries with {SMALL_CART} cart lines, {large} with {LARGE_CART}'
+    assert small <= BUDGETS[name], f'{name}: {small} queries, budget {BUDGETS[name]}'
+
+
+def test_checkout_post_budget():
+    counts = []
+    for lines in (SMALL_CART, LARGE_CART):
+        user, _ = make_cart(lines)
+        form = {
+            'first_name': 'Wanjiru', 'last_name': 'Kamau', 'email': 'w@example.com', 'phone': '0712345678',
+            'address': 'Moi Avenue', 'city': 'Nairobi', 'payment_method': 'mpesa', 'mpesa_phone': '254700000000',
+        }
+        counts.append(count_queries(user, 'post', '/checkout/', {'data': form}, 200))
+    assert counts[0] == counts[1] <= CHECKOUT_POST_BUDGET, counts
+
+
+def test_anonymous_cart_redirects_to_login():
+    response = Client().get('/cart/', secure=True)
+    assert response.status_code == 302
+    assert response['Location'].startswith('/accounts/login/')
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-q']))
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Tests for the Pesapal reconciliation command, against a stubbed Pesapal
+"""
+
+import os
+import sys
+from io import StringIO
+from pathlib import Path
+
+import django
+
+project_dir = Path(__file__).resolve().parent
+sys.path.append(str(project_dir))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Ecoweb.settings')
+django.setup()
+
+import pytest
+import requests
+from django.contrib.auth.models import User
+from django.core.management import call_command
+
+from Ecoweb.models import Order
+
+
+pytestmark = pytest.mark.database(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'reconcile'}},
+    PESAPAL_CONSUMER_KEY='key',
+    PESAPAL_CONSUMER_SECRET='secret',
+)
+
+
+class Response:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        if self.body is None:
+            raise ValueError('Expecting value: line 1 column 1 (char 0)')
+        return self.body
+
+
+# What Pesapal answers for each tracking id; None is a 200 with an HTML body
+STATUSES = {'track-paid': 'Completed', 'track-error-page': None, 'track-declined': 'Failed', 'track-waiting': 'Pending'}
+
+
+@pytest.fixture
+def pesapal(monkeypatch):
+    def post(url, json=None, headers=None, timeout=None):
+        return Response(200, {'token': 'token', 'expiryDate': None})
+
+    def get(url, headers=None, params=None, timeout=None):
+        status = STATUSES[params['orderTrackingId']]
+        return Response(200, {'payment_status_description': status} if status else None)
+
+    monkeypatch.setattr(requests, 'post', post)
+    monkeypatch.setattr(requests, 'get', get)
+
+
+def test_an_unreadable_status_skips_only_that_order(pesapal, tmp_path):
+    Order.objects.all().delete()
+    user, _ = User.objects.get_or_create(username='reconcile')
+    orders = {
+        tracking_id: Order.objects.create(user=user, pesapal_tracking_id=tracking_id).pk
+        for tracking_id in STATUSES
+    }
+    checkpoint = tmp_path / 'checkpoint.json'
+    out, err = StringIO(), StringIO()
+
+    call_command(
+        'reconcile_pesapal', '--older-than=0', '--rate=0', '--workers=2', '--chunk-size=2',
+        f'--checkpoint-file={checkpoint}', stdout=out, stderr=err,
+    )
+
+    statuses = dict(Order.objects.filter(pk__in=orders.values()).values_list('pesapal_tracking_id', 'payment_status'))
+    assert statuses == {
+        'track-paid': 'COMPLETED', 'track-error-page': 'PENDING', 'track-declined': 'FAILED', 'track-waiting': 'PENDING',
+    }
+    assert 'Checked 4 orders' in out.getvalue()
+    assert '1 completed, 1 failed, 1 lookups failed' in out.getvalue()
+    assert 'track-error-page: unreadable Pesapal response' in err.getvalue()
+    # The run finished, so the next one starts over
+    assert not checkpoint.exists()
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-q']))
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Tests for the slow-query log
+"""
+
+import os
+import sys
+import threading
+import time
+from io import StringIO
+from pathlib import Path
+
+import django
+
+project_dir = Path(__file__).resolve().parent
+sys.path.append(str(project_dir))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Ecoweb.settings')
+django.setup()
+
+import pytest
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from django.urls import ResolverMatch
+
+from Ecoweb import metrics, slow_queries
+
+
+@pytest.fixture(autouse=True)
+def slow_query_cache():
+    with override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'slowq'}},
+        SLOW_QUERY_MS=0.000001,
+    ):
+        cache.clear()
+        yield
+
+
+def run(sql, params=None):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def test_normalize_collapses_literals_and_lists():
+    assert slow_queries.normalize(
+        "SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'it''s'  AND n > 10"
+    ) == slow_queries.normalize("SELECT * FROM t WHERE id IN (%s) AND name = 'x' AND n > 2") == (
+        'SELECT * FROM t WHERE id IN (...) AND name = ? AND n > ?'
+    )
+    assert slow_queries.normalize('INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s)') == 'INSERT INTO t (a, b) VALUES (?, ?), ...'
+
+
+def test_slow_queries_are_grouped_and_explained():
+    request = RequestFactory().get('/order-summary/')
+    request.resolver_match = ResolverMatch(lambda request: None, (), {}, url_name='cart')
+    token = metrics.begin_request(request)
+    try:
+        run('SELECT name FROM sqlite_master WHERE type = %s', ['table'])
+        run('SELECT name FROM sqlite_master WHERE type = %s', ['index'])
+    finally:
+        metrics._current.reset(token)
+    run('SELECT 2 + 2')
+
+    entries = {entry['detail']['shape']: entry for entry in slow_queries.top()}
+    assert set(entries) == {'SELECT name FROM sqlite_master WHERE type = ?', 'SELECT ? + ?'}
+    master = entries['SELECT name FROM sqlite_master WHERE type = ?']
+    assert master['count'] == 2
+    assert master['detail']['view'] == 'cart'
+    assert master['detail']['frame'].startswith('test_slow_queries.py:')
+    assert 'SCAN' in master['detail']['plan']
+    assert entries['SELECT ? + ?']['last']['view'] == slow_queries.NO_REQUEST
+
+    out = StringIO()
+    call_command('slow_queries', '--reset', stdout=out)
+    assert 'sqlite_master' in out.getvalue()
+    assert slow_queries.top() == []
+
+
+def test_only_the_top_shapes_are_listed():
+    run('SELECT 1')
+    run('SELECT 1 + 1')
+    with override_settings(SLOW_QUERY_TOP_N=1):
+        assert len(slow_queries.top()) == 1
+    assert len(slow_queries.top()) == 2
+
+
+def test_shapes_seen_concurrently_are_all_kept(monkeypatch):
+    get = LocMemCache.get
+
+    def slow_get(self, *args, **kwargs):
+        # Widen any read-modify-write window, as a busy shared cache would
+        value = get(self, *args, **kwargs)
+        time.sleep(0.01)
+        return value
+
+    columns = [f'c{n}' for n in range(40)]
+    start_together = threading.Barrier(len(columns))
+
+    def record(column):
+        start_together.wait()
+        # many=True skips EXPLAIN, which would need a connection per thread
+        slow_queries.record(connection, f'SELECT 1 AS {column}', None, True, 0.5)
+
+    threads = [threading.Thread(target=record, args=(column,)) for column in columns]
+    with monkeypatch.context() as patched:
+        # Each thread has its own cache instance
+        patched.setattr(LocMemCache, 'get', slow_get)
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    shapes = {entry['detail']['shape'] for entry in slow_queries.top()}
+    assert shapes == {f'SELECT ? AS {column}' for column in columns}
+
+
+def test_threshold_zero_turns_the_log_off():
+    with override_settings(SLOW_QUERY_MS=0):
+        run('SELECT 1')
+    assert slow_queries.top() == []
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-q']))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Tests for bulk SMS delivery through Africa's Talking
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import django
+
+project_dir = Path(__file__).resolve().parent
+sys.path.append(str(project_dir))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Ecoweb.settings')
+django.setup()
+
+import pytest
+
+from Ecoweb import notifications, sms
+from Ecoweb.models import Notification
+
+
+pytestmark = pytest.mark.database(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'sms'}},
+    AFRICAS_TALKING_API_KEY='key',
+    AFRICAS_TALKING_USERNAME='sandbox',
+    SMS_BATCH_SIZE=2,
+)
+
+
+class Response:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+        self.text = str(body)
+
+    def json(self):
+        return self.body
+
+
+class Session:
+    """Accepts every batch except the ones numbered in ``failing`` (1-based)"""
+
+    def __init__(self, failing=()):
+        self.failing = failing
+        self.batches = []
+
+    def post(self, url, headers, data, timeout):
+        numbers = data['to'].split(',')
+        self.batches.append(numbers)
+        if len(self.batches) in self.failing:
+            return Response(500, {'error': 'Internal error'})
+        recipients = [{'number': n, 'statusCode': 101, 'status': 'Success'} for n in numbers]
+        return Response(201, {'SMSMessageData': {'Recipients': recipients}})
+
+
+@pytest.fixture
+def session(monkeypatch):
+    stub = Session(failing=(2,))
+    monkeypatch.setattr(sms, 'get_session', lambda: stub)
+    return stub
+
+
+def test_a_failed_batch_only_fails_its_own_numbers(session):
+    results = sms.AfricasTalkingSMS().send_bulk('Hi', ['254700000001', '254700000002', '254700000003'])
+    assert session.batches == [['+254700000001', '+254700000002'], ['+254700000003']]
+    assert results['254700000001'] is None
+    assert results['254700000002'] is None
+    assert '500' in results['254700000003']
+
+
+def test_recipients_of_accepted_batches_are_not_retried(session):
+    Notification.objects.all().delete()
+    for n in range(1, 5):
+        notifications.enqueue('promo', 'sms', f'25470000000{n}', 'Sale on now', dedup_key=f'promo:{n}')
+
+    assert notifications.deliver_pending() == (2, 2)
+    statuses = dict(Notification.objects.values_list('recipient', 'status'))
+    assert statuses == {
+        '254700000001': 'SENT', '254700000002': 'SENT', '254700000003': 'PENDING', '254700000004': 'PENDING',
+    }
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-q']))
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Tests for sending at most one STK push per order and amount
+"""
+
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import django
+
+project_dir = Path(__file__).resolve().parent
+sys.path.append(str(project_dir))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Ecoweb.settings')
+django.setup()
+
+import pytest
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+from Ecoweb.models import MpesaTransaction, Order
+from Ecoweb.mpesa_service import MpesaService
+from Ecoweb.stk_dedup import _keys, ainitiate_order_stk_push
+
+
+pytestmark = pytest.mark.database(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'stk_dedup'}},
+    MPESA_TEST_MODE=False,
+)
+
+
+class Daraja:
+    """Stands in for MpesaService.ainitiate_stk_push; answers with ``responses`` in turn"""
+
+    def __init__(self, *responses, delay=0.0):
+        self.responses = list(responses)
+        self.delay = delay
+        self.pushes = 0
+
+    async def __call__(self, phone_number, amount, order_id, description="Payment"):
+        self.pushes += 1
+        await asyncio.sleep(self.delay)
+        status = self.responses.pop(0)
+        if status != 'success':
+            return {'status': 'error', 'message': 'Daraja is unavailable'}
+        return {
+            'status': 'success',
+            'checkout_request_id': f'ws_CO_{order_id}_{self.pushes}',
+            'merchant_request_id': f'mr_{order_id}_{self.pushes}',
+            'message': 'Payment prompt sent',
+        }
+
+
+@pytest.fixture
+def order():
+    cache.clear()
+    user, _ = User.objects.get_or_create(username='stk_dedup')
+    return Order.objects.create(user=user)
+
+
+@pytest.fixture
+def daraja(monkeypatch):
+    def install(*responses, delay=0.0):
+        stub = Daraja(*responses, delay=delay)
+
+        async def ainitiate_stk_push(service, **kwargs):
+            return await stub(**kwargs)
+
+        monkeypatch.setattr(MpesaService, 'ainitiate_stk_push', ainitiate_stk_push)
+        return stub
+    return install
+
+
+def push(order, times=1):
+    async def pushes():
+        return await asyncio.gather(*(
+            ainitiate_order_stk_push(order, '254712345678', 100) for _ in range(times)
+        ))
+    return asyncio.run(pushes())
+
+
+def test_concurrent_checkouts_send_one_push(order, daraja):
+    stub = daraja('success', delay=0.3)
+
+    responses = push(order, times=3)
+
+    assert stub.pushes == 1
+    assert {response['checkout_request_id'] for response in responses} == {f'ws_CO_{order.pk}_1'}
+    assert sorted(bool(response.get('deduplicated')) for response in responses) == [False, True, True]
+    assert MpesaTransaction.objects.filter(order=order).count() == 1
+
+
+def test_a_failed_push_can_be_retried(order, daraja):
+    stub = daraja('error', 'success')
+
+    assert push(order)[0]['status'] == 'error'
+    response = push(order)[0]
+
+    assert stub.pushes == 2
+    assert response['status'] == 'success'
+    assert not response.get('deduplicated')
+
+
+def test_a_settled_push_is_not_reused(order, daraja):
+    stub = daraja('success', 'success')
+    first = push(order)[0]
+    MpesaTransaction.objects.filter(checkout_request_id=first['checkout_request_id']).update(status='FAILED')
+
+    second = push(order)[0]
+
+    assert stub.pushes == 2
+    assert second['checkout_request_id'] != first['checkout_request_id']
+    assert not second.get('deduplicated')
+
+
+def test_waiters_do_not_reuse_a_settled_push(order, daraja):
+    stub = daraja('success', 'success', delay=0.3)
+    first = push(order)[0]
+    MpesaTransaction.objects.filter(checkout_request_id=first['checkout_request_id']).update(status='COMPLETED')
+    # The old response is still cached while the retry is in flight
+    result_key, _ = _keys(order, 100)
+    assert cache.get(result_key) == first
+
+    responses = push(order, times=2)
+
+    assert stub.pushes == 2
+    assert {response['checkout_request_id'] for response in responses} == {f'ws_CO_{order.pk}_2'}
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-q']))
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Tests for the M-Pesa payment stage timestamps and latency histograms
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from pathlib import Path
+
+import django
+
+project_dir = Path(__file__).resolve().parent
+sys.path.append(str(project_dir))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Ecoweb.settings')
+django.setup()
+
+import pytest
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.test import Client
+from django.utils import timezone
+
+from Ecoweb import stk_latency
+from Ecoweb.models import MpesaTransaction, Order
+from Ecoweb.mpesa_service import parse_transaction_date
+
+
+pytestmark = pytest.mark.database(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'stk'}},
+    SESSION_ENGINE='django.contrib.sessions.backends.db',
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+
+
+def pending_transaction(accepted_seconds_ago):
+    user = User.objects.create_user(f'payer{User.objects.count()}', password='x')
+    order = Order.objects.create(user=user, ordered_date=timezone.now())
+    accepted = timezone.now() - timedelta(seconds=accepted_seconds_ago)
+    return MpesaTransaction.objects.create(
+        order=order, checkout_request_id=f'ws_CO_{order.pk}', merchant_request_id='m', phone_number='254700000000',
+        amount=100, push_sent_at=accepted - timedelta(seconds=1), push_accepted_at=accepted,
+    )
+
+
+def callback(transaction, result_code, transaction_date=None):
+    stk = {'CheckoutRequestID': transaction.checkout_request_id, 'ResultCode': result_code, 'ResultDesc': 'x'}
+    if transaction_date:
+        stk['CallbackMetadata'] = {'Item': [
+            {'Name': 'MpesaReceiptNumber', 'Value': 'QK12345'}, {'Name': 'TransactionDate', 'Value': transaction_date},
+        ]}
+    response = Client().post('/mpesa/callback/', json.dumps({'Body': {'stkCallback': stk}}), content_type='application/json', secure=True)
+    assert response.status_code == 200
+
+
+def test_transaction_date_is_parsed_as_east_africa_time():
+    assert parse_transaction_date(20240101120000) == datetime(2024, 1, 1, 9, 0, tzinfo=dt_timezone.utc)
+    assert parse_transaction_date('2024') is None
+    assert parse_transaction_date(None) is None
+
+
+def test_callback_records_each_stage_once():
+    transaction = pending_transaction(accepted_seconds_ago=12)
+    stk_latency.push_accepted(transaction)
+    paid_at = timezone.now().astimezone(dt_timezone(timedelta(hours=3))) - timedelta(seconds=3)
+    callback(transaction, 0, int(paid_at.strftime('%Y%m%d%H%M%S')))
+    # Daraja retrying the callback changes nothing
+    callback(transaction, 0, int(paid_at.strftime('%Y%m%d%H%M%S')))
+
+    transaction.refresh_from_db()
+    assert transaction.status == 'SUCCESS'
+    assert transaction.result_code == '0'
+    assert transaction.settled_via == stk_latency.VIA_CALLBACK
+    assert transaction.settled_at == transaction.callback_received_at
+    assert transaction.transaction_date == paid_at.replace(microsecond=0)
+
+    totals = stk_latency.combined(stk_latency.snapshot(hours=2))
+    assert {label: entry['count'] for label, entry in totals.items()} == {
+        'push:0': 1, 'callback:0': 1, 'delivery:0': 1, 'settled_by_callback:0': 1,
+    }
+    # Twelve seconds from acceptance, in the (10, 15] bucket
+    assert totals['callback:0']['buckets'][stk_latency.BUCKETS.index(15)] == 1
+
+
+def test_first_settlement_wins():
+    transaction = pending_transaction(accepted_seconds_ago=40)
+    transaction.result_code = '1032'
+    stk_latency.settle(transaction, stk_latency.VIA_POLL)
+    callback(transaction, 1032)
+
+    transaction.refresh_from_db()
+    assert transaction.settled_via == stk_latency.VIA_POLL
+    assert transaction.callback_received_at is not None
+    totals = stk_latency.combined(stk_latency.snapshot(hours=2))
+    assert set(totals) == {'settled_by_poll:1032', 'callback:1032'}
+
+    out = StringIO()
+    call_command('stk_latency', stdout=out)
+    assert 'settled_by_poll' in out.getvalue()
+
+
+def test_labels_added_concurrently_are_all_kept(monkeypatch):
+    get = LocMemCache.get
+
+    def slow_get(self, *args, **kwargs):
+        # Widen any read-modify-write window, as a busy shared cache would
+        value = get(self, *args, **kwargs)
+        time.sleep(0.01)
+        return value
+
+    end = timezone.now()
+    codes = [str(code) for code in range(40)]
+    start_together = threading.Barrier(len(codes))
+
+    def record(code):
+        start_together.wait()
+        stk_latency.record(stk_latency.CALLBACK, code, end - timedelta(seconds=3), end)
+
+    threads = [threading.Thread(target=record, args=(code,)) for code in codes]
+    with monkeypatch.context() as patched:
+        # Each thread has its own cache instance
+        patched.setattr(LocMemCache, 'get', slow_get)
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    stk_latency.record(stk_latency.CALLBACK, '0', end - timedelta(seconds=1), end)
+
+    labels = stk_latency.snapshot(1, now=end)[stk_latency._hour(end)]
+    assert set(labels) == {f'callback:{code}' for code in codes}
+    assert labels['callback:0']['count'] == 2
+    assert labels['callback:1']['count'] == 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-q']))